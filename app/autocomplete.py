@@ -0,0 +1,55 @@
+"""
+Server-side autocomplete, so that the browser does not need every name.
+"""
+
+from typing import List, Sequence
+
+import numpy as np
+
+
+# Sorts after any other character, to find the end of a prefix range
+MAX_CHAR = chr(0x10FFFF)
+
+
+def normalize_prefix(s: str) -> str:
+    return ' '.join(s.lower().split())
+
+
+class PrefixIndex(object):
+    """
+    Sorted array of the suffixes (starting at each word) of the names, so
+    that names with a word starting with a prefix are found by binary search
+    """
+
+    def __init__(self, names: Sequence[str], scores: Sequence[float]):
+        keys = []
+        entries = []
+        for i, name in enumerate(names):
+            tokens = normalize_prefix(name).split(' ')
+            for j in range(len(tokens)):
+                keys.append(' '.join(tokens[j:]))
+                entries.append(i)
+        order = np.argsort(np.array(keys, dtype=str), kind='stable')
+        self._keys = np.array(keys, dtype=str)[order]
+        self._entries = np.array(entries, dtype=np.int64)[order]
+        self._names = list(names)
+        self._scores = np.array(scores, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def search(
+            self,
+            prefix: str,
+            limit: int,
+            min_score: float = float('-inf')
+    ) -> List[str]:
+        """Matching names, by decreasing score (then by order in the index)"""
+        prefix = normalize_prefix(prefix)
+        lo = np.searchsorted(self._keys, prefix, side='left')
+        hi = np.searchsorted(self._keys, prefix + MAX_CHAR, side='left')
+        entries = np.unique(self._entries[lo:hi])
+        entries = entries[self._scores[entries] >= min_score]
+        entries = entries[
+            np.argsort(-self._scores[entries], kind='stable')[:limit]]
+        return [self._names[i] for i in entries]
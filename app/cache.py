@@ -0,0 +1,126 @@
+"""
+In-memory caches for computed responses.
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from flask import Response, request
+
+try:
+    import brotli                                           # type: ignore
+except ImportError:
+    brotli = None   # Optional: responses are only gzipped
+
+from .types_backend import JsonObject
+
+
+class LRUCache(object):
+    """Least-recently-used cache with a memory budget (in bytes)"""
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int] = len):
+        self._max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._values: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._sizes = {}
+        self._num_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_bytes > 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._values.get(key)
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._values.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = self._sizeof(value)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._values:
+                self._num_bytes -= self._sizes[key]
+                del self._values[key]
+            self._values[key] = value
+            self._sizes[key] = size
+            self._num_bytes += size
+            while self._num_bytes > self._max_bytes:
+                old_key, _ = self._values.popitem(last=False)
+                self._num_bytes -= self._sizes.pop(old_key)
+                self._evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+            self._sizes.clear()
+            self._num_bytes = 0
+
+    def stats(self) -> JsonObject:
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'entries': len(self._values),
+                'bytes': self._num_bytes,
+                'max_bytes': self._max_bytes
+            }
+
+
+class PrecomputedResponse(object):
+    """
+    Response body that is serialized and compressed once, and then served
+    with a strong ETag (for conditional requests) and Cache-Control
+    """
+
+    def __init__(self, data: bytes, mimetype: str, max_age: int):
+        self._data = data
+        # In order of preference
+        self._encoded_data: Dict[str, bytes] = OrderedDict()
+        if brotli is not None:
+            self._encoded_data['br'] = brotli.compress(data)
+        self._encoded_data['gzip'] = gzip.compress(data)
+        self._etag = hashlib.sha1(data).hexdigest()
+        self._mimetype = mimetype
+        self._max_age = max_age
+
+    @staticmethod
+    def from_json(value: Any, max_age: int) -> 'PrecomputedResponse':
+        return PrecomputedResponse(
+            json.dumps(value).encode(), 'application/json', max_age)
+
+    @property
+    def num_bytes(self) -> int:
+        return len(self._data) + sum(
+            len(v) for v in self._encoded_data.values())
+
+    def get(self) -> Response:
+        resp = Response(mimetype=self._mimetype)
+        encoding = request.accept_encodings.best_match(
+            list(self._encoded_data))
+        if encoding is not None:
+            resp.set_data(self._encoded_data[encoding])
+            resp.headers['Content-Encoding'] = encoding
+            # Each encoding is a different representation
+            resp.set_etag(self._etag + '-' + encoding)
+        else:
+            resp.set_data(self._data)
+            resp.set_etag(self._etag)
+        resp.vary.add('Accept-Encoding')
+        resp.cache_control.public = True
+        resp.cache_control.max_age = self._max_age
+        return resp.make_conditional(request)
@@ -0,0 +1,198 @@
+"""
+Captions of each video, rendered once (by derive_data.py) as gzipped JSON
+and concatenated into one file, so that they can be served without decoding
+the caption index.
+"""
+
+import bisect
+import gzip
+import json
+import mmap
+import os
+import re
+import zlib
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from captions import Documents, Lexicon                     # type: ignore
+
+from .types_backend import Caption
+
+
+# In data/derived
+CAPTION_STORE_FILE = 'captions.bin'
+CAPTION_STORE_INDEX_FILE = 'captions.npz'
+
+# In the caption index directory, which the store is rendered from
+CAPTION_INDEX_FILES = ['documents.txt', 'lexicon.txt', 'index.bin', 'data']
+
+
+def untokenize(words: Iterable[str]) -> str:
+    text = ' '.join(words)
+    step1 = text.replace("`` ", '"').replace(" ''", '"').replace('. . .', '...')
+    step2 = step1.replace(" ( ", " (").replace(" ) ", ") ")
+    step3 = re.sub(r' ([.,:;?!%>]+)([ \'"`])', r"\1\2", step2)
+    step4 = re.sub(r' ([.,:;?!%>]+)$', r"\1", step3)
+    step5 = step4.replace(" '", "'").replace(" n't", "n't")\
+        .replace(" N'T", "N'T").replace("' t", "'t").replace("' T", "'T")\
+        .replace("can not", "cannot").replace("CAN NOT", "CANNOT")\
+        .replace("' s", "'s").replace("' S", "'S")
+    step6 = step5.replace(" ` ", " '")
+    return step6.strip()
+
+
+def find_caption_window(
+        starts: Sequence[float],
+        ends: Sequence[float],
+        start: float,
+        end: float
+) -> Tuple[int, int]:
+    """Range of the lines (sorted by start) that overlap [start, end)"""
+    lo = max(bisect.bisect_right(starts, start) - 1, 0)
+    while lo < len(ends) and ends[lo] <= start:
+        lo += 1
+    hi = bisect.bisect_left(starts, end, lo)
+    return lo, max(lo, hi)
+
+
+class CaptionLineIndex(NamedTuple):
+    """Times and token positions of the (non-empty) lines of a document"""
+    starts: np.ndarray
+    ends: np.ndarray
+    positions: np.ndarray       # (idx, len) of the tokens of each line
+
+    @property
+    def nbytes(self) -> int:
+        return self.starts.nbytes + self.ends.nbytes + self.positions.nbytes
+
+
+def index_caption_lines(
+        documents: Documents,
+        document: 'Documents.Document'
+) -> CaptionLineIndex:
+    lines = [l for l in documents.open(document).lines() if l.len > 0]
+    return CaptionLineIndex(
+        np.array([l.start for l in lines], dtype=np.float64),
+        np.array([l.end for l in lines], dtype=np.float64),
+        np.array([(l.idx, l.len) for l in lines],
+                 dtype=np.int64).reshape(-1, 2))
+
+
+def render_captions(
+        documents: Documents,
+        lexicon: Lexicon,
+        document: 'Documents.Document',
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        line_index: Optional[CaptionLineIndex] = None
+) -> List[Caption]:
+    """
+    Captions of the document (only those overlapping [start, end) if set,
+    which are found with the line index instead of reading every line)
+    """
+    doc_handle = documents.open(document)
+    if start is None and end is None:
+        doc_lines = (
+            (l.start, l.end, l.idx, l.len) for l in doc_handle.lines()
+            if l.len > 0)
+    else:
+        if line_index is None:
+            line_index = index_caption_lines(documents, document)
+        lo, hi = find_caption_window(
+            line_index.starts, line_index.ends,
+            start if start is not None else float('-inf'),
+            end if end is not None else float('inf'))
+        doc_lines = zip(
+            line_index.starts[lo:hi].tolist(), line_index.ends[lo:hi].tolist(),
+            line_index.positions[lo:hi, 0].tolist(),
+            line_index.positions[lo:hi, 1].tolist())
+
+    lines = []
+    for line_start, line_end, idx, length in doc_lines:
+        tokens = [lexicon.decode(t) for t in doc_handle.tokens(idx, length)]
+        lines.append((round(line_start, 2), round(line_end, 2),
+                      untokenize(tokens)))
+    return lines
+
+
+def get_caption_index_fingerprint(index_dir: str) -> str:
+    """Sizes and modification times of the caption index files"""
+    fingerprint = 0
+    for name in CAPTION_INDEX_FILES:
+        fname = os.path.join(index_dir, name)
+        if os.path.exists(fname):
+            stat = os.stat(fname)
+            fingerprint = zlib.crc32('{}:{}:{};'.format(
+                name, stat.st_size, stat.st_mtime_ns).encode(), fingerprint)
+    return '{:08x}'.format(fingerprint)
+
+
+class EncodedCaptions(NamedTuple):
+    data: bytes         # gzipped JSON
+    etag: str
+
+
+def encode_captions(captions: List[Caption]) -> EncodedCaptions:
+    data = json.dumps(captions, separators=(',', ':')).encode()
+    return EncodedCaptions(
+        gzip.compress(data), '{:08x}'.format(zlib.crc32(data)))
+
+
+class CaptionStore(object):
+    """Encoded captions of each video id, memory mapped from a single file"""
+
+    def __init__(self, fname: str, index_fname: str):
+        with np.load(index_fname) as f:
+            self.ids = f['ids']
+            self.offsets = f['offsets']     # len(ids) + 1
+            self.etags = f['etags']
+            self.index_fingerprint = (
+                str(f['index_fingerprint'])
+                if 'index_fingerprint' in f.files else None)
+        with open(fname, 'rb') as f:
+            self._data = (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                          if self.offsets[-1] > 0 else b'')
+
+    @staticmethod
+    def write(
+            fname: str,
+            index_fname: str,
+            entries: Iterable[EncodedCaptions],
+            ids: List[int],
+            index_fingerprint: str
+    ) -> None:
+        """
+        Write the encoded captions of each of the (sorted) video ids, rendered
+        from the caption index with the given fingerprint
+        """
+        # Replaced atomically, since running servers may have them mapped
+        tmp_fname = fname + '.tmp'
+        tmp_index_fname = index_fname + '.tmp'
+
+        offsets = [0]
+        etags = []
+        with open(tmp_fname, 'wb') as f:
+            for entry in entries:
+                f.write(entry.data)
+                offsets.append(offsets[-1] + len(entry.data))
+                etags.append(entry.etag)
+        assert len(offsets) == len(ids) + 1
+        with open(tmp_index_fname, 'wb') as f:
+            np.savez(f, ids=np.array(ids, dtype=np.int64),
+                     offsets=np.array(offsets, dtype=np.int64),
+                     etags=np.array(etags, dtype=str),
+                     index_fingerprint=np.array(index_fingerprint))
+        os.replace(tmp_fname, fname)
+        os.replace(tmp_index_fname, index_fname)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get(self, video_id: int) -> Optional[EncodedCaptions]:
+        i = np.searchsorted(self.ids, video_id)
+        if i == len(self.ids) or self.ids[i] != video_id:
+            return None
+        return EncodedCaptions(
+            self._data[self.offsets[i]:self.offsets[i + 1]],
+            str(self.etags[i]))
@@ -3,20 +3,22 @@ Main application code
 """
 
 from datetime import datetime
+import gzip
 import os
-import re
-from typing import List, Optional, Iterable
+from typing import List, Optional
 
 from pytz import timezone
-from flask import (
-    Flask, Response, jsonify, request, render_template,
-    make_response)
+from flask import Flask, Response, jsonify, request, render_template
 
 from .types_frontend import *
 from .types_backend import *
 from .error import InvalidUsage, NotFound
 from .parsing import format_date
-from .load import load_app_data, CaptionDataContext
+from .load import load_app_data
+from .memory import get_memory_usage
+from .cache import LRUCache, PrecomputedResponse
+from .caption_store import (
+    EncodedCaptions, render_captions, encode_captions, index_caption_lines)
 from .route_html import add_html_routes
 from .route_data_json import add_data_json_routes
 from .route_search import add_search_routes
@@ -29,36 +31,14 @@ STATIC_DIR = os.path.join(FILE_DIR, '..', 'static')
 
 NUM_VIDEO_SAMPLES = 1000
 
+# Memory budget for captions that are not in the caption store
+CAPTION_CACHE_BYTES = 64 * 1024 * 1024
 
-def _untokenize(words: Iterable[str]) -> str:
-    text = ' '.join(words)
-    step1 = text.replace("`` ", '"').replace(" ''", '"').replace('. . .', '...')
-    step2 = step1.replace(" ( ", " (").replace(" ) ", ") ")
-    step3 = re.sub(r' ([.,:;?!%>]+)([ \'"`])', r"\1\2", step2)
-    step4 = re.sub(r' ([.,:;?!%>]+)$', r"\1", step3)
-    step5 = step4.replace(" '", "'").replace(" n't", "n't")\
-        .replace(" N'T", "N'T").replace("' t", "'t").replace("' T", "'T")\
-        .replace("can not", "cannot").replace("CAN NOT", "CANNOT")\
-        .replace("' s", "'s").replace("' S", "'S")
-    step6 = step5.replace(" ` ", " '")
-    return step6.strip()
-
-
-def _get_captions(
-        cdc: CaptionDataContext,
-        document: 'Documents.Document'
-) -> List[Caption]:
-    lines = []
-    doc_handle = cdc.documents.open(document)
-    for line in doc_handle.lines():
-        if line.len > 0:
-            tokens = [
-                cdc.lexicon.decode(t)
-                for t in doc_handle.tokens(line.idx, line.len)]
-            start = round(line.start, 2)
-            end = round(line.end, 2)
-            lines.append((start, end, _untokenize(tokens)))
-    return lines
+# Memory budget for the line times of videos, to find windows of captions
+CAPTION_LINE_CACHE_BYTES = 16 * 1024 * 1024
+
+# Memory budget for values.js, which is rendered once per host
+VALUES_JS_CACHE_BYTES = 16 * 1024 * 1024
 
 
 def build_app(
@@ -84,7 +64,9 @@ def build_app(
         default_is_commercial: Ternary,         # Whether to exclude commercials by default
         allow_sharing: bool,                    # Show share, embed, download links
         data_version: Optional[str],
-        show_uptime: bool
+        show_uptime: bool,
+        search_cache_bytes: int,                # Memory budget for cached searches
+        search_parallelism: int                 # Max threads used by a search
 ) -> Flask:
 
     caption_data_context, video_data_context = \
@@ -112,7 +94,7 @@ def build_app(
     num_videos_with_captions = sum(
         1 for v in video_data_context.video_dict.values()
         if v.date >= min_date and v.date <= max_date
-        and v.name in caption_data_context.document_by_name)
+        and caption_data_context.get_document(v.id) is not None)
 
     add_html_routes(
         app, host,
@@ -143,13 +125,17 @@ def build_app(
         app, video_data_context,
         min_date=min_date, max_date=max_date,
         num_video_samples=NUM_VIDEO_SAMPLES,
-        hide_person_tags=hide_person_tags)
+        hide_person_tags=hide_person_tags,
+        min_person_autocomplete_screen_time=min_person_autocomplete_screen_time)
 
     add_search_routes(
         app, caption_data_context, video_data_context,
         default_aggregate_by=default_aggregate_by,
         default_is_commercial=default_is_commercial,
-        default_text_window=default_text_window)
+        default_text_window=default_text_window,
+        data_version=data_version,
+        search_cache_bytes=search_cache_bytes,
+        search_parallelism=search_parallelism)
 
     add_data_export_routes(app, caption_data_context, video_data_context)
 
@@ -157,21 +143,23 @@ def build_app(
     if hide_gender:
         global_face_tags = [x for x in global_face_tags if 'male' not in x]
 
-    @app.route('/generated/js/values.js')
-    def get_values_js() -> Response:
-        start_date = max(min(
-            v.date for v in video_data_context.video_dict.values()), min_date)
-        end_date = min(max(
-            v.date for v in video_data_context.video_dict.values()), max_date)
-        all_shows: List[str] = list(sorted({
-            v.show for v in video_data_context.video_dict.values()
-        }))
-        resp = make_response(render_template(
+    values_js_start_date = max(min(
+        v.date for v in video_data_context.video_dict.values()), min_date)
+    values_js_end_date = min(max(
+        v.date for v in video_data_context.video_dict.values()), max_date)
+    all_shows: List[str] = list(sorted({
+        v.show for v in video_data_context.video_dict.values()
+    }))
+    values_js_cache = LRUCache(
+        VALUES_JS_CACHE_BYTES, sizeof=lambda x: x.num_bytes)
+
+    def _render_values_js(values_js_host: str) -> str:
+        return render_template(
             'js/values.js',
-            host=host if host else request.host,
+            host=values_js_host,
             data_version=data_version,
-            start_date=format_date(start_date),
-            end_date=format_date(end_date),
+            start_date=format_date(values_js_start_date),
+            end_date=format_date(values_js_end_date),
             default_agg_by=default_aggregate_by,
             default_text_window=default_text_window,
             video_endpoint=video_endpoint,
@@ -190,30 +178,91 @@ def build_app(
                 (k, v) for k, v in SearchKey.__dict__.items()
                 if not k.startswith('__')],
             shows=all_shows,
-            people=list(video_data_context.all_person_intervals.keys()),
-            autocomplete_people=[
-                intervals.name for intervals
-                in video_data_context.all_person_intervals.values()
-                if intervals.screen_time_seconds >= min_person_autocomplete_screen_time
-            ],
             hide_gender=hide_gender,
             hide_person_tags=hide_person_tags,
             global_face_tags=global_face_tags,
-            person_tags_dict=video_data_context.all_person_tags.tag_name_dict))
-        resp.headers['Content-type'] = 'application/javascript'
-        return resp
+            person_tags_dict=video_data_context.all_person_tags.tag_name_dict)
+
+    @app.route('/generated/js/values.js')
+    def get_values_js() -> Response:
+        # Rendered once, since it only depends on the data and the host
+        values_js_host = host if host else request.host
+        values_js = values_js_cache.get(values_js_host)
+        if values_js is None:
+            values_js = PrecomputedResponse(
+                _render_values_js(values_js_host).encode(),
+                'application/javascript', max_age=0)
+            values_js_cache.put(values_js_host, values_js)
+        return values_js.get()
+
+    @app.route('/memory')
+    def get_memory() -> Response:
+        return jsonify(get_memory_usage())
 
     if static_caption_endpoint is None:
+        caption_cache = LRUCache(
+            CAPTION_CACHE_BYTES, sizeof=lambda x: len(x.data))
+        caption_line_cache = LRUCache(
+            CAPTION_LINE_CACHE_BYTES, sizeof=lambda x: x.nbytes)
+
+        def _get_encoded_captions(video: Video) -> Optional[EncodedCaptions]:
+            if caption_data_context.caption_store is not None:
+                encoded = caption_data_context.caption_store.get(video.id)
+                if encoded is not None:
+                    return encoded
+            encoded = caption_cache.get(video.id)
+            if encoded is None:
+                document = caption_data_context.get_document(video.id)
+                if not document:
+                    return None
+                encoded = encode_captions(render_captions(
+                    caption_data_context.documents,
+                    caption_data_context.lexicon, document))
+                caption_cache.put(video.id, encoded)
+            return encoded
+
+        def _get_encoded_caption_window(
+                video: Video, start: Optional[float], end: Optional[float]
+        ) -> Optional[EncodedCaptions]:
+            # Windows are rarely requested twice, so only the line index
+            # (which is needed for every window) is cached
+            document = caption_data_context.get_document(video.id)
+            if not document:
+                return None
+            line_index = caption_line_cache.get(video.id)
+            if line_index is None:
+                line_index = index_caption_lines(
+                    caption_data_context.documents, document)
+                caption_line_cache.put(video.id, line_index)
+            return encode_captions(render_captions(
+                caption_data_context.documents,
+                caption_data_context.lexicon, document,
+                start=start, end=end, line_index=line_index))
+
         @app.route('/captions/<int:i>')
         def get_captions(i: int) -> Response:
             video = video_data_context.video_by_id.get(i)
             if not video:
                 raise NotFound('video id: {}'.format(i))
-            document = caption_data_context.document_by_name.get(video.name)
-            if not document:
+            start = request.args.get('start', None, type=float)
+            end = request.args.get('end', None, type=float)
+            if start is not None and end is not None and start >= end:
+                raise InvalidUsage('start must be less than end')
+            if start is None and end is None:
+                encoded = _get_encoded_captions(video)
+            else:
+                encoded = _get_encoded_caption_window(video, start, end)
+            if encoded is None:
                 raise NotFound('captions for video id: {}'.format(i))
-            resp = jsonify(_get_captions(caption_data_context, document))
-            return resp
+            resp = Response(mimetype='application/json')
+            if 'gzip' in request.accept_encodings:
+                resp.set_data(encoded.data)
+                resp.headers['Content-Encoding'] = 'gzip'
+            else:
+                resp.set_data(gzip.decompress(encoded.data))
+            resp.vary.add('Accept-Encoding')
+            resp.set_etag(encoded.etag, weak=True)
+            return resp.make_conditional(request)
     else:
         print('Serving captions from:', static_caption_endpoint)
 
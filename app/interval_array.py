@@ -0,0 +1,81 @@
+"""
+Vectorized (NumPy) algebra over interval sets.
+
+An interval set is an (n, 2) integer array of [start, end] rows in
+milliseconds, sorted by start. The results of union, intersection and
+merging are also deoverlapped.
+"""
+
+from typing import Iterable, List
+
+import numpy as np
+
+from .types_backend import Interval
+
+
+IntervalArray = np.ndarray
+
+
+def empty_intervals() -> IntervalArray:
+    return np.zeros((0, 2), dtype=np.int64)
+
+
+def intervals_from_list(intervals: Iterable[Interval]) -> IntervalArray:
+    """Array of sorted intervals (e.g., from an MmapIntervalSetMapping)"""
+    return np.array(
+        intervals if isinstance(intervals, list) else list(intervals),
+        dtype=np.int64
+    ).reshape(-1, 2)
+
+
+def intervals_to_list(intervals: IntervalArray) -> List[Interval]:
+    """List of tuples (e.g., for an MmapIntervalSetMapping)"""
+    return [(a, b) for a, b in intervals.tolist()]
+
+
+def intervals_duration(intervals: IntervalArray) -> int:
+    return int((intervals[:, 1] - intervals[:, 0]).sum())
+
+
+def merge_intervals(intervals: IntervalArray, fuzz: int = 0) -> IntervalArray:
+    """Join intervals that overlap or are at most fuzz apart"""
+    if len(intervals) < 2:
+        return intervals
+    ends = np.maximum.accumulate(intervals[:, 1])
+    is_first = np.empty(len(intervals), dtype=bool)
+    is_first[0] = True
+    is_first[1:] = intervals[1:, 0] - ends[:-1] > fuzz
+    firsts = np.flatnonzero(is_first)
+    lasts = np.append(firsts[1:] - 1, len(intervals) - 1)
+    return np.column_stack((intervals[firsts, 0], ends[lasts]))
+
+
+def union_intervals(
+        a: IntervalArray, b: IntervalArray, fuzz: int = 0
+) -> IntervalArray:
+    intervals = np.concatenate((a, b))
+    intervals = intervals[np.argsort(intervals[:, 0], kind='stable')]
+    return merge_intervals(intervals, fuzz)
+
+
+def intersect_intervals(a: IntervalArray, b: IntervalArray) -> IntervalArray:
+    a = merge_intervals(a)
+    b = merge_intervals(b)
+    if len(a) == 0 or len(b) == 0:
+        return empty_intervals()
+
+    # The intervals of b that overlap each interval of a are contiguous
+    lo = np.searchsorted(b[:, 1], a[:, 0], side='right')
+    hi = np.searchsorted(b[:, 0], a[:, 1], side='left')
+    counts = np.maximum(hi - lo, 0)
+    total = int(counts.sum())
+    if total == 0:
+        return empty_intervals()
+    a_idxs = np.repeat(np.arange(len(a)), counts)
+    b_idxs = (np.repeat(lo - (np.cumsum(counts) - counts), counts)
+              + np.arange(total))
+
+    starts = np.maximum(a[a_idxs, 0], b[b_idxs, 0])
+    ends = np.minimum(a[a_idxs, 1], b[b_idxs, 1])
+    keep = ends > starts
+    return np.column_stack((starts[keep], ends[keep]))
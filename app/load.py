@@ -10,8 +10,9 @@ import json
 from os import path
 from collections import Counter, OrderedDict, defaultdict
 from pathlib import Path
-from typing import NamedTuple, Dict, Set, Tuple, Optional
+from typing import NamedTuple, Dict, List, Set, Tuple, Optional
 
+import numpy as np
 from pytz import timezone
 
 from captions import CaptionIndex, Documents, Lexicon       # type: ignore
@@ -23,12 +24,27 @@ from .types_backend import (
     Video, FaceIntervals, PersonIntervals, Tag, AllPersonTags,
     AllPersonIntervals)
 from .types_frontend import GLOBAL_TAGS
+from .video_table import VideoTable, VideoAttributeIndex
+from .rollup import ScreenTimeRollup
+from .autocomplete import PrefixIndex
+from .caption_store import (
+    CAPTION_STORE_FILE, CAPTION_STORE_INDEX_FILE, CaptionStore,
+    get_caption_index_fingerprint)
+from .snapshot import (
+    METADATA_SNAPSHOT_FILE, MetadataSnapshot, load_snapshot,
+    is_snapshot_fresh, get_source_fingerprint)
 from .parsing import load_json, parse_date_from_video_name
 
 
 MAX_PERSON_ATTRIBUTE_LEN = 50
 MIN_PERSON_ATTRIBUTE_LEN = 3
 
+# Maps the precomputed text terms to their iset files in derived/text
+TEXT_TERMS_FILE = 'terms.json'
+
+# Touched when the data has changed, so that running servers reload it
+RELOAD_FILE = '.reload'
+
 
 def get_video_name(s: str) -> str:
     s = Path(s).name
@@ -42,12 +58,18 @@ class VideoDataContext(NamedTuple):
     """Wrapper object for video data"""
     video_dict: Dict[str, Video]
     video_by_id: Dict[int, Video]
+    video_table: VideoTable
+    video_index: VideoAttributeIndex
     commercial_isetmap: MmapIntervalSetMapping
     face_intervals: FaceIntervals
+    non_commercial_face_intervals: Optional[FaceIntervals]
+    face_rollups: Dict[str, ScreenTimeRollup]
     all_person_intervals: AllPersonIntervals
     all_person_tags: AllPersonTags
     cached_tag_intervals: Dict[str, MmapIntervalListMapping]
     host_to_channels: Dict[str, Set[str]]
+    person_name_index: PrefixIndex      # ranked by screen time
+    person_tag_index: PrefixIndex       # ranked by screen time of people
 
 
 class CaptionDataContext(NamedTuple):
@@ -55,7 +77,18 @@ class CaptionDataContext(NamedTuple):
     index: CaptionIndex
     documents: Documents
     lexicon: Lexicon
-    document_by_name: Dict[str, Documents.Document]
+    text_isetmaps: Dict[str, MmapIntervalSetMapping]
+    document_video_ids: np.ndarray      # -1 if the video is unknown
+    video_ordered_document_ids: np.ndarray
+    video_document_ids: np.ndarray      # -1 if the video has no captions
+    caption_store: Optional[CaptionStore]
+
+    def get_document(self, video_id: int) -> Optional[Documents.Document]:
+        if 0 <= video_id < len(self.video_document_ids):
+            document_id = self.video_document_ids[video_id]
+            if document_id >= 0:
+                return self.documents[document_id]
+        return None
 
 
 def load_videos(data_dir: str, tz: timezone) -> Dict[str, Video]:
@@ -94,6 +127,10 @@ def load_videos(data_dir: str, tz: timezone) -> Dict[str, Video]:
     return videos
 
 
+# Variants of the derived intervals with commercials removed
+NON_COMMERCIAL_DIR = 'noncommercial'
+
+
 def _load_face_intervals(data_dir: str) -> FaceIntervals:
     face_iset_dir = path.join(data_dir, 'derived', 'face')
     face_intervals = FaceIntervals(
@@ -122,6 +159,36 @@ def _load_face_intervals(data_dir: str) -> FaceIntervals:
     return face_intervals
 
 
+def _load_non_commercial_face_intervals(
+        data_dir: str,
+        face_intervals: FaceIntervals
+) -> Optional[FaceIntervals]:
+    """
+    Face isets with commercials removed. The ilists are unchanged, since
+    commercials are only removed after converting them to isets.
+    """
+    face_iset_dir = path.join(data_dir, 'derived', NON_COMMERCIAL_DIR, 'face')
+    if not path.isdir(face_iset_dir):
+        print('  No non-commercial face intervals found. Skipping.')
+        return None
+    return face_intervals._replace(**{
+        k: MmapIntervalSetMapping(path.join(
+            face_iset_dir, k[:-len('_isetmap')] + '.iset.bin'))
+        for k in FaceIntervals._fields if k.endswith('_isetmap')})
+
+
+def _load_face_rollups(data_dir: str) -> Dict[str, ScreenTimeRollup]:
+    face_rollup_dir = path.join(data_dir, 'derived', 'rollup', 'face')
+
+    face_rollups = {}
+    if path.isdir(face_rollup_dir):
+        for rollup_file in os.listdir(face_rollup_dir):
+            name = path.splitext(rollup_file)[0]
+            face_rollups[name] = ScreenTimeRollup.load(
+                path.join(face_rollup_dir, rollup_file))
+    return face_rollups
+
+
 def read_person_whitelist(fname):
     people = set()
     with open(fname) as f:
@@ -139,25 +206,36 @@ def _sanitize_name(name):
 MIN_NAME_TOKEN_LEN = 3
 
 
+def get_person_file_prefixes(data_dir: str) -> Set[str]:
+    def parse_person_file_prefix(fname: str) -> str:
+        return path.splitext(path.splitext(fname)[0])[0]
+
+    return {
+        parse_person_file_prefix(person_file)
+        for person_file in os.listdir(path.join(data_dir, 'people'))
+    }
+
+
 def _load_person_intervals(
         data_dir: str,
         person_whitelist_file: Optional[str],
-        min_person_screen_time: int
+        min_person_screen_time: int,
+        person_screen_time: Optional[Dict[str, float]] = None
 ) -> Dict[str, PersonIntervals]:
     if person_whitelist_file is not None:
         whitelisted_people = read_person_whitelist(person_whitelist_file)
     else:
         whitelisted_people = None
 
-    def parse_person_file_prefix(fname: str) -> str:
-        return path.splitext(path.splitext(fname)[0])[0]
-
     person_ilist_dir = path.join(data_dir, 'people')
     person_iset_dir = path.join(data_dir, 'derived', 'people')
-    person_file_prefixes = {
-        parse_person_file_prefix(person_file)
-        for person_file in os.listdir(person_ilist_dir)
-    }
+    person_non_commercial_iset_dir = path.join(
+        data_dir, 'derived', NON_COMMERCIAL_DIR, 'people')
+    person_rollup_dir = path.join(data_dir, 'derived', 'rollup', 'people')
+    if person_screen_time is not None:
+        person_file_prefixes = set(person_screen_time)
+    else:
+        person_file_prefixes = get_person_file_prefixes(data_dir)
 
     skipped_count = 0
     skipped_counter = Counter()
@@ -176,21 +254,43 @@ def _load_person_intervals(
         person_ilist_path = path.join(
             person_ilist_dir, person_file_prefix + '.ilist.bin')
         try:
+            if person_screen_time is not None:
+                # Precomputed, so the files of skipped people are not opened
+                person_time = person_screen_time[person_file_prefix]
+                if person_time < min_person_screen_time:
+                    skipped_count += 1
+                    skipped_counter[person_name_lower] = person_time
+                    continue
+
             # Heuristic to filter out people who cannot pass the threshold
             # This assumes a 3s sample rate and assigns 3s for each 8 bytes of
             # interval file as a prefilter for whether to open the file or not.
-            if os.path.getsize(person_ilist_path) / 4 / 2 * 3 < min_person_screen_time:
+            elif os.path.getsize(person_ilist_path) / 4 / 2 * 3 < min_person_screen_time:
                 skipped_counter[person_name_lower] = min_person_screen_time
                 skipped_count += 1
                 continue
 
             person_ilist_map = MmapIntervalListMapping(person_ilist_path, 1)
-            person_isetmap = (
-                MmapIntervalSetMapping(person_iset_path)
-                if os.path.isfile(person_iset_path) else
-                MmapIListToISetMapping(person_ilist_map, 0, 0, 3000, 100))
-
-            person_time = person_isetmap.sum() / 1000
+            person_rollup = None
+            person_non_commercial_isetmap = None
+            if os.path.isfile(person_iset_path):
+                person_isetmap = MmapIntervalSetMapping(person_iset_path)
+                person_non_commercial_iset_path = path.join(
+                    person_non_commercial_iset_dir,
+                    person_file_prefix + '.iset.bin')
+                if os.path.isfile(person_non_commercial_iset_path):
+                    person_non_commercial_isetmap = MmapIntervalSetMapping(
+                        person_non_commercial_iset_path)
+                person_rollup_path = path.join(
+                    person_rollup_dir, person_file_prefix + '.npz')
+                if os.path.isfile(person_rollup_path):
+                    person_rollup = ScreenTimeRollup.load(person_rollup_path)
+            else:
+                person_isetmap = MmapIListToISetMapping(
+                    person_ilist_map, 0, 0, 3000, 100)
+
+            if person_screen_time is None:
+                person_time = person_isetmap.sum() / 1000
             if (
                     person_time < min_person_screen_time
             ):
@@ -200,7 +300,9 @@ def _load_person_intervals(
 
             person_intervals = PersonIntervals(
                 name=person_name, ilistmap=person_ilist_map,
-                isetmap=person_isetmap, screen_time_seconds=person_time)
+                isetmap=person_isetmap, screen_time_seconds=person_time,
+                rollup=person_rollup,
+                non_commercial_isetmap=person_non_commercial_isetmap)
             all_person_intervals.append((person_name_lower, person_intervals))
         except Exception as e:
             print('Unable to load: {} - {}'.format(person_name, e))
@@ -226,7 +328,7 @@ def sanitize_tag(tag: str) -> str:
     return tag
 
 
-def _load_person_metadata(data_dir: str, all_people: Set[str]) -> AllPersonTags:
+def read_person_tags(data_dir: str) -> Dict[str, List[Tag]]:
     """Read in metadata attributes on individuals"""
 
     person_metadata_path = path.join(data_dir, 'people.metadata.json')
@@ -242,13 +344,35 @@ def _load_person_metadata(data_dir: str, all_people: Set[str]) -> AllPersonTags:
                             and len(tag) < MAX_PERSON_ATTRIBUTE_LEN
                     ):
                         filtered_tags.append(Tag(tag, tag_source))
-                name_lower = name.lower()
-
-                if name_lower in all_people:
-                    person_to_tags[name_lower] = filtered_tags
+                person_to_tags[name.lower()] = filtered_tags
     else:
         print('No person tags found. Skipping.')
-    return AllPersonTags(person_to_tags)
+    return person_to_tags
+
+
+def _load_person_metadata(
+        person_tags: Dict[str, List[Tag]],
+        all_people: Set[str]
+) -> AllPersonTags:
+    return AllPersonTags(
+        {k: v for k, v in person_tags.items() if k in all_people})
+
+
+def _build_person_indexes(
+        all_person_intervals: AllPersonIntervals,
+        all_person_tags: AllPersonTags
+) -> Tuple[PrefixIndex, PrefixIndex]:
+    """Autocomplete indexes of the names of people and of their tags"""
+    person_name_index = PrefixIndex(
+        [p.name for p in all_person_intervals.values()],
+        [p.screen_time_seconds for p in all_person_intervals.values()])
+    tag_names = sorted(all_person_tags.tag_name_dict)
+    person_tag_index = PrefixIndex(tag_names, [
+        sum(all_person_intervals[name].screen_time_seconds
+            for name in all_person_tags.tag_name_to_names(tag)
+            if name in all_person_intervals)
+        for tag in tag_names])
+    return person_name_index, person_tag_index
 
 
 def _load_tag_intervals(data_dir: str) -> Dict[str, MmapIntervalListMapping]:
@@ -266,7 +390,75 @@ def _load_tag_intervals(data_dir: str) -> Dict[str, MmapIntervalListMapping]:
     return tag_to_intervals
 
 
-def load_caption_data(index_dir: str) -> CaptionDataContext:
+def normalize_text_term(text: str) -> str:
+    return ' '.join(text.upper().split())
+
+
+def _load_text_intervals(data_dir: str) -> Dict[str, MmapIntervalSetMapping]:
+    text_iset_dir = path.join(data_dir, 'derived', 'text')
+    terms_path = path.join(text_iset_dir, TEXT_TERMS_FILE)
+
+    text_to_intervals = {}
+    if path.exists(terms_path):
+        for term, fname in load_json(terms_path).items():
+            text_iset_path = path.join(text_iset_dir, fname)
+            if path.exists(text_iset_path):
+                text_to_intervals[term] = MmapIntervalSetMapping(
+                    text_iset_path)
+    return text_to_intervals
+
+
+def get_document_video_ids(
+        documents: Documents,
+        videos: Optional[Dict[str, Video]]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Video id of each document id, the ids of the documents with videos
+    sorted by video id, and the document id of each video id
+    """
+    document_video_ids = np.full(
+        max((d.id for d in documents), default=-1) + 1, -1, dtype=np.int64)
+    if videos is not None:
+        for d in documents:
+            video = videos.get(d.name)
+            if video is not None:
+                document_video_ids[d.id] = video.id
+    document_ids = np.flatnonzero(document_video_ids >= 0)
+    document_ids = document_ids[np.argsort(
+        document_video_ids[document_ids], kind='stable')]
+    video_document_ids = np.full(
+        document_video_ids.max(initial=-1) + 1, -1, dtype=np.int64)
+    video_document_ids[document_video_ids[document_ids]] = document_ids
+    return document_video_ids, document_ids, video_document_ids
+
+
+def _load_caption_store(
+        index_dir: str,
+        data_dir: str
+) -> Optional[CaptionStore]:
+    store_path = path.join(data_dir, 'derived', CAPTION_STORE_FILE)
+    store_index_path = path.join(
+        data_dir, 'derived', CAPTION_STORE_INDEX_FILE)
+    if not is_snapshot_fresh(store_index_path, [
+            path.join(data_dir, 'videos.json')
+    ]):
+        print('  Caption store is missing or stale. Skipping.')
+        return None
+    caption_store = CaptionStore(store_path, store_index_path)
+    # Copying or re-indexing may not leave the index newer than the store
+    if (caption_store.index_fingerprint
+            != get_caption_index_fingerprint(index_dir)):
+        print('  Caption store is from a different caption index. Skipping.')
+        return None
+    print('  Loaded captions of {} videos.'.format(len(caption_store)))
+    return caption_store
+
+
+def load_caption_data(
+        index_dir: str,
+        data_dir: Optional[str] = None,
+        videos: Optional[Dict[str, Video]] = None
+) -> CaptionDataContext:
     """Load the captions"""
 
     documents = Documents.load(path.join(index_dir, 'documents.txt'))
@@ -280,10 +472,13 @@ def load_caption_data(index_dir: str) -> CaptionDataContext:
         d._replace(name=get_video_name(d.name)) for d in documents])
     documents.configure(path.join(index_dir, 'data'))
     return CaptionDataContext(
-        index, documents, lexicon, {d.name: d for d in documents})
+        index, documents, lexicon,
+        _load_text_intervals(data_dir) if data_dir else {},
+        *get_document_video_ids(documents, videos),
+        _load_caption_store(index_dir, data_dir) if data_dir else None)
 
 
-def _load_hosts(host_file):
+def load_hosts(host_file: str) -> Dict[str, Set[str]]:
     hosts = defaultdict(set)
     if os.path.exists(host_file):
         with open(host_file) as fp:
@@ -295,6 +490,38 @@ def _load_hosts(host_file):
     return hosts
 
 
+def get_metadata_snapshot_sources(data_dir: str) -> List[str]:
+    """Files and directories that the metadata snapshot is derived from"""
+    return [
+        path.join(data_dir, 'videos.json'),
+        path.join(data_dir, 'people'),
+        path.join(data_dir, 'derived', 'people'),
+        path.join(data_dir, 'people.metadata.json'),
+        path.join(data_dir, 'hosts.csv')
+    ]
+
+
+def _load_metadata_snapshot(
+        data_dir: str,
+        tz: timezone
+) -> Optional[MetadataSnapshot]:
+    snapshot_path = path.join(data_dir, 'derived', METADATA_SNAPSHOT_FILE)
+    if not path.isfile(snapshot_path):
+        print('  Metadata snapshot is missing. Skipping.')
+        return None
+    snapshot = load_snapshot(snapshot_path)
+    # Files may be rewritten in place, which the mtime of a directory misses
+    if snapshot.source_fingerprint != get_source_fingerprint(
+            get_metadata_snapshot_sources(data_dir)):
+        print('  Metadata snapshot is stale. Skipping.')
+        return None
+    if snapshot.timezone != tz.zone:
+        print('  Metadata snapshot is for {}. Skipping.'.format(
+              snapshot.timezone))
+        return None
+    return snapshot
+
+
 def load_app_data(
         index_dir: str,
         data_dir: str,
@@ -304,11 +531,15 @@ def load_app_data(
 ) -> Tuple[CaptionDataContext, VideoDataContext]:
     """Load all of the site's static data"""
 
-    print('Loading caption index: please wait...')
-    caption_data = load_caption_data(index_dir)
-
     print('Loading video data: please wait...')
-    videos = load_videos(data_dir, tz)
+    snapshot = _load_metadata_snapshot(data_dir, tz)
+    videos = (snapshot.videos if snapshot is not None
+              else load_videos(data_dir, tz))
+    video_table = VideoTable(videos.values())
+    video_index = VideoAttributeIndex(video_table)
+
+    print('Loading caption index: please wait...')
+    caption_data = load_caption_data(index_dir, data_dir, videos)
 
     n_videos_with_captions = sum(1 for d in caption_data.documents
                                  if d.name in videos)
@@ -321,22 +552,37 @@ def load_app_data(
 
     print('Loading face intervals: please wait...')
     face_intervals = _load_face_intervals(data_dir)
+    non_commercial_face_intervals = _load_non_commercial_face_intervals(
+        data_dir, face_intervals)
+    face_rollups = _load_face_rollups(data_dir)
     all_person_intervals = _load_person_intervals(
-        data_dir, person_whitelist_file, min_person_screen_time)
+        data_dir, person_whitelist_file, min_person_screen_time,
+        snapshot.person_screen_time if snapshot is not None else None)
 
     print('Loading person metadata tags: please wait...')
     all_person_tags = _load_person_metadata(
-        data_dir, set(all_person_intervals.keys()))
+        snapshot.person_tags if snapshot is not None
+        else read_person_tags(data_dir),
+        set(all_person_intervals.keys()))
 
     print('Loading cached tag intervals: please wait...')
     cached_tag_intervals = _load_tag_intervals(data_dir)
 
     print('Loading host list: please wait...')
-    host_to_channels = _load_hosts(path.join(data_dir, 'hosts.csv'))
+    host_to_channels = (
+        snapshot.hosts if snapshot is not None
+        else load_hosts(path.join(data_dir, 'hosts.csv')))
+
+    print('Building person autocomplete indexes: please wait...')
+    person_name_index, person_tag_index = _build_person_indexes(
+        all_person_intervals, all_person_tags)
 
     print('Done loading data!')
     return (caption_data,
             VideoDataContext(
-                videos, {v.id: v for v in videos.values()},
-                commercials, face_intervals, all_person_intervals,
-                all_person_tags, cached_tag_intervals, host_to_channels))
+                videos, {v.id: v for v in videos.values()}, video_table,
+                video_index, commercials, face_intervals,
+                non_commercial_face_intervals, face_rollups,
+                all_person_intervals, all_person_tags, cached_tag_intervals,
+                host_to_channels,
+                person_name_index, person_tag_index))
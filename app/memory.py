@@ -0,0 +1,31 @@
+"""
+Memory usage of the current process (e.g., of a pre-forked worker).
+"""
+
+import os
+from typing import Dict
+
+
+# Summed over all of the mappings of the process
+SMAPS_ROLLUP_FILE = '/proc/self/smaps_rollup'
+
+
+def get_memory_usage() -> Dict[str, int]:
+    """
+    Resident, proportional and unique (private) set sizes in bytes. The
+    unique set size is the memory that would be freed if the process exited,
+    so it is the cost of each additional worker.
+    """
+    usage = {'pid': os.getpid()}
+    if os.path.exists(SMAPS_ROLLUP_FILE):
+        fields = {}
+        with open(SMAPS_ROLLUP_FILE) as f:
+            for line in f:
+                tokens = line.split()
+                if len(tokens) == 3 and tokens[2] == 'kB':
+                    fields[tokens[0].rstrip(':')] = int(tokens[1]) * 1024
+        usage['rss'] = fields.get('Rss', 0)
+        usage['pss'] = fields.get('Pss', 0)
+        usage['uss'] = (fields.get('Private_Clean', 0)
+                        + fields.get('Private_Dirty', 0))
+    return usage
@@ -0,0 +1,63 @@
+"""
+Precomputed screen time of an interval set in each video (generated by
+derive_data.py), so that totals can be summed without reading intervals.
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+from .types_frontend import Ternary
+from .video_table import VideoTable
+
+
+class ScreenTimeRollup(object):
+    """Milliseconds in commercials and outside of commercials, per video"""
+
+    def __init__(
+            self,
+            ids: np.ndarray,
+            commercial_ms: np.ndarray,
+            non_commercial_ms: np.ndarray
+    ):
+        order = np.argsort(ids, kind='stable')
+        self.ids = ids[order]
+        self.commercial_ms = commercial_ms[order]
+        self.non_commercial_ms = non_commercial_ms[order]
+
+    @staticmethod
+    def load(fname: str) -> 'ScreenTimeRollup':
+        with np.load(fname) as f:
+            return ScreenTimeRollup(
+                f['ids'], f['commercial_ms'], f['non_commercial_ms'])
+
+    def save(self, fname: str) -> None:
+        with open(fname, 'wb') as f:
+            np.savez(f, ids=self.ids, commercial_ms=self.commercial_ms,
+                     non_commercial_ms=self.non_commercial_ms)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __add__(self, other: 'ScreenTimeRollup') -> 'ScreenTimeRollup':
+        """Combine the rollups of disjoint sets of videos"""
+        return ScreenTimeRollup(
+            np.concatenate((self.ids, other.ids)),
+            np.concatenate((self.commercial_ms, other.commercial_ms)),
+            np.concatenate((self.non_commercial_ms, other.non_commercial_ms)))
+
+    def get(
+            self, table: VideoTable, is_commercial: Ternary
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Table rows (sorted by video id) and their milliseconds"""
+        if is_commercial == Ternary.true:
+            ms = self.commercial_ms
+        elif is_commercial == Ternary.false:
+            ms = self.non_commercial_ms
+        else:
+            ms = self.commercial_ms + self.non_commercial_ms
+        rows = np.full(len(self.ids), -1, dtype=np.int64)
+        in_range = self.ids < len(table.row_by_id)
+        rows[in_range] = table.row_by_id[self.ids[in_range]]
+        keep = rows >= 0
+        return rows[keep], ms[keep]
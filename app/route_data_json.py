@@ -1,9 +1,20 @@
+import json
 import random
 from datetime import datetime, timedelta
 from collections import namedtuple, defaultdict
-from flask import Flask, Response, jsonify
+from typing import List, Tuple
+from flask import Flask, Response, jsonify, request
 
 from .load import VideoDataContext
+from .cache import PrecomputedResponse
+from .error import InvalidUsage
+
+
+# Seconds that browsers may reuse the data without revalidating
+DATA_JSON_MAX_AGE = 60 * 60
+
+MAX_AUTOCOMPLETE_RESULTS = 2000
+MAX_PERSON_NAME_LOOKUPS = 100
 
 
 def add_data_json_routes(
@@ -12,7 +23,8 @@ def add_data_json_routes(
         min_date: datetime,
         max_date: datetime,
         num_video_samples: int,
-        hide_person_tags: bool
+        hide_person_tags: bool,
+        min_person_autocomplete_screen_time: int
 ):
     Person = namedtuple('person', ['name', 'is_host', 'screen_time', 'tags'])
     people = [
@@ -25,24 +37,28 @@ def add_data_json_routes(
         for name, intervals in video_data_context.all_person_intervals.items()
     ]
 
+    # The people, tags and shows are fixed once the data is loaded
+    people_json = PrecomputedResponse.from_json({'data': [
+        (p.name, ', '.join(p.is_host),p.screen_time,
+         '' if hide_person_tags else ', '.join(sorted({t.name for t in p.tags})))
+        for p in people
+    ]}, DATA_JSON_MAX_AGE)
+
     @app.route('/data/people.json')
     def get_data_people_json() -> Response:
-        return jsonify({'data': [
-            (p.name, ', '.join(p.is_host),p.screen_time,
-             '' if hide_person_tags else ', '.join(sorted({t.name for t in p.tags})))
-            for p in people
-        ]})
+        return people_json.get()
 
     if not hide_person_tags:
+        tags_json = PrecomputedResponse.from_json({'data': [
+            (t.name, t.source, len(p), ', '.join(p))
+            for t, p in video_data_context.all_person_tags.tag_dict.items()
+        ]}, DATA_JSON_MAX_AGE)
+
         @app.route('/data/tags.json')
         def get_data_tags_json() -> Response:
-            return jsonify({'data': [
-                (t.name, t.source, len(p), ', '.join(p))
-                for t, p in video_data_context.all_person_tags.tag_dict.items()
-            ]})
+            return tags_json.get()
 
-    @app.route('/data/shows.json')
-    def get_data_shows_json() -> Response:
+    def _get_channel_and_show_hours() -> List[Tuple[str, str, float, float]]:
         time_all = defaultdict(float)
         time_1yr = defaultdict(float)
         max_date_minus_1yr = max(
@@ -59,7 +75,56 @@ def add_data_json_routes(
             (*k, round(s / 3600, 1), round(time_1yr[k] / 3600, 1))
             for k, s in time_all.items()]
         channel_and_show.sort()
-        return jsonify({'data': channel_and_show})
+        return channel_and_show
+
+    shows_json = PrecomputedResponse.from_json(
+        {'data': _get_channel_and_show_hours()}, DATA_JSON_MAX_AGE)
+
+    @app.route('/data/shows.json')
+    def get_data_shows_json() -> Response:
+        return shows_json.get()
+
+    @app.route('/autocomplete')
+    def get_autocomplete() -> Response:
+        prefix = request.args.get('prefix', '', type=str)
+        kind = request.args.get('type', 'name', type=str)
+        limit = request.args.get('limit', 25, type=int)
+        if limit <= 0 or limit > MAX_AUTOCOMPLETE_RESULTS:
+            raise InvalidUsage('limit must be between 1 and {}'.format(
+                               MAX_AUTOCOMPLETE_RESULTS))
+        if kind == 'name':
+            results = video_data_context.person_name_index.search(
+                prefix, limit, min_score=min_person_autocomplete_screen_time)
+        elif kind == 'tag':
+            results = [] if hide_person_tags else \
+                video_data_context.person_tag_index.search(prefix, limit)
+        else:
+            raise InvalidUsage('unknown type: {}'.format(kind))
+        resp = jsonify(results)
+        resp.cache_control.public = True
+        resp.cache_control.max_age = DATA_JSON_MAX_AGE
+        return resp
+
+    @app.route('/person-names')
+    def get_person_names() -> Response:
+        """Name used in queries for each name (or null if unknown)"""
+        names_str = request.args.get('names', None, type=str)
+        if not names_str:
+            raise InvalidUsage('must specify names')
+        names = json.loads(names_str)
+        if not isinstance(names, list) or not all(
+                isinstance(n, str) for n in names):
+            raise InvalidUsage('names must be a list of strings')
+        if len(names) > MAX_PERSON_NAME_LOOKUPS:
+            raise InvalidUsage('at most {} names can be looked up'.format(
+                               MAX_PERSON_NAME_LOOKUPS))
+        results = [
+            n.lower() if n.lower() in video_data_context.all_person_intervals
+            else None for n in names]
+        resp = jsonify(results)
+        resp.cache_control.public = True
+        resp.cache_control.max_age = DATA_JSON_MAX_AGE
+        return resp
 
     @app.route('/data/videos.json')
     def get_data_videos_json() -> Response:
@@ -1,10 +1,19 @@
 from datetime import datetime, timedelta
 import json
-import heapq
+import math
+import operator
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from enum import Enum
+from functools import partial, reduce
+from collections import Counter
 from typing import (
-    Any, List, Set, Tuple, Optional, Iterable, Generator, NamedTuple)
-from flask import Flask, Response, jsonify, request
+    Any, Callable, Dict, Hashable, List, Set, Tuple, Optional, Iterable,
+    Generator, Iterator, NamedTuple)
+from flask import Flask, Response, jsonify, request, stream_with_context
+import numpy as np
 
 from captions.util import PostingUtil                   # type: ignore
 from captions.query import Query                        # type: ignore
@@ -13,7 +22,6 @@ from rs_intervalset import (                            # type: ignore
 from rs_intervalset.wrapper import (                    # type: ignore
     MmapIListToISetMapping, MmapUnionIlistsToISetMapping,
     MmapISetIntersectionMapping)
-from rs_intervalset.wrapper import _deoverlap as deoverlap_intervals
 
 from .types_frontend import *
 from .types_backend import *
@@ -21,11 +29,38 @@ from .error import *
 from .parsing import (
     parse_date, format_date, parse_hour_set, parse_day_of_week_set,
     ParsedTags, parse_tags)
-from .load import VideoDataContext, CaptionDataContext
-from .sum import DetailedDateAccumulator, SimpleDateAccumulator
+from .load import VideoDataContext, CaptionDataContext, normalize_text_term
+from .sum import (
+    DateAccumulator, DetailedDateAccumulator, SimpleDateAccumulator,
+    StreamingDetailedDateAccumulator, BinaryDetailedDateAccumulator,
+    CompoundDateAccumulator)
+from .cache import LRUCache
+from .video_table import VideoFilter
+from .rollup import ScreenTimeRollup
+from .interval_array import (
+    IntervalArray, empty_intervals, intervals_from_list, intervals_to_list,
+    intervals_duration, merge_intervals, union_intervals,
+    intersect_intervals)
 
 
 MAX_VIDEO_SEARCH_IDS = 10
+MAX_BATCH_SEARCH_QUERIES = 32
+
+# Join the intervals of a video in search results that are closer than 250ms
+MERGE_RESULT_INTERVALS_MS = 249
+
+# Archive wide searches are split into ranges of video ids of at least this
+# many videos, which are searched and accumulated in parallel
+MIN_SEARCH_SHARD_VIDEOS = 10000
+
+COMPOUND_QUERY_OPERANDS = {
+    QueryOperand.main, QueryOperand.add, QueryOperand.normalize,
+    QueryOperand.subtract
+}
+
+JSON_MIMETYPE = 'application/json'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+BINARY_MIMETYPE = 'application/octet-stream'
 
 
 class SearchResultType(Enum):
@@ -43,25 +78,131 @@ class SearchContext(NamedTuple):
     hours: Optional[Set[int]] = None
     days_of_week: Optional[Set[int]] = None
     text_window: int = 0
+    video_filter: Optional[VideoFilter] = None   # e.g., from OR of contexts
+    exclude_commercials: bool = False   # use the non-commercial intervals
+    shard_filter: Optional[VideoFilter] = None   # of a parallel search
 
 
 class SearchResult(NamedTuple):
     type: SearchResultType
     context: Optional[SearchContext] = None
     data: Any = None
+    rollup: Optional[ScreenTimeRollup] = None  # totals of a rust_iset's data
+    excludes_commercials: bool = False   # all intervals are non-commercial
 
 
-class PythonISetData(NamedTuple):
-    video: Video
-    is_entire_video: bool
-    intervals: Optional[List[Interval]] = None
+# Intervals of many videos are combined in one array by offsetting them by
+# the video id. Videos are shorter than 2^32 milliseconds, and the extra bit
+# keeps the videos far enough apart that unions never merge across them.
+VIDEO_ID_SHIFT = 33
 
 
-PythonISetDataGenerator = Generator[PythonISetData, None, None]
+class PythonISetData(object):
+    """
+    Intervals of many videos, as parallel arrays sorted by video id.
+
+    The intervals of the i-th video are intervals[offsets[i]:offsets[i + 1]].
+    Entire videos have no intervals.
+    """
+    __slots__ = ['video_ids', 'is_entire_video', 'offsets', 'intervals']
+
+    def __init__(
+            self,
+            video_ids: np.ndarray,
+            is_entire_video: np.ndarray,
+            offsets: np.ndarray,
+            intervals: IntervalArray
+    ):
+        self.video_ids = video_ids
+        self.is_entire_video = is_entire_video
+        self.offsets = offsets
+        self.intervals = intervals
+
+    @staticmethod
+    def from_videos(video_ids: np.ndarray) -> 'PythonISetData':
+        """Entire videos (the ids must be sorted)"""
+        return PythonISetData(
+            video_ids, np.ones(len(video_ids), dtype=bool),
+            np.zeros(len(video_ids) + 1, dtype=np.int64), empty_intervals())
+
+    @staticmethod
+    def from_segments(
+            video_ids: np.ndarray,
+            counts: np.ndarray,
+            intervals: IntervalArray
+    ) -> 'PythonISetData':
+        """Consecutive runs of intervals (counts) of videos in any order"""
+        offsets = np.zeros(len(video_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return PythonISetData(
+            video_ids, np.zeros(len(video_ids), dtype=bool), offsets,
+            intervals
+        ).take(np.argsort(video_ids, kind='stable'))
+
+    @staticmethod
+    def from_lists(
+            video_ids: List[int],
+            interval_lists: List[List[Interval]]
+    ) -> 'PythonISetData':
+        return PythonISetData.from_segments(
+            np.array(video_ids, dtype=np.int64),
+            np.array([len(x) for x in interval_lists], dtype=np.int64),
+            intervals_from_list(
+                [i for intervals in interval_lists for i in intervals]))
+
+    @staticmethod
+    def from_global_intervals(intervals: IntervalArray) -> 'PythonISetData':
+        """Inverse of to_global_intervals (the intervals must be sorted)"""
+        ids = intervals[:, 0] >> VIDEO_ID_SHIFT
+        video_ids, counts = np.unique(ids, return_counts=True)
+        offsets = np.zeros(len(video_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return PythonISetData(
+            video_ids, np.zeros(len(video_ids), dtype=bool), offsets,
+            intervals - (ids << VIDEO_ID_SHIFT)[:, np.newaxis])
+
+    @staticmethod
+    def concat(parts: List['PythonISetData']) -> 'PythonISetData':
+        """Combine the data of disjoint sets of videos"""
+        counts = np.concatenate([np.diff(p.offsets) for p in parts])
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        video_ids = np.concatenate([p.video_ids for p in parts])
+        return PythonISetData(
+            video_ids,
+            np.concatenate([p.is_entire_video for p in parts]),
+            offsets, np.concatenate([p.intervals for p in parts])
+        ).take(np.argsort(video_ids, kind='stable'))
+
+    def __len__(self) -> int:
+        return len(self.video_ids)
+
+    def get_intervals(self, i: int) -> IntervalArray:
+        return self.intervals[self.offsets[i]:self.offsets[i + 1]]
+
+    def take(self, idxs: np.ndarray) -> 'PythonISetData':
+        """Data of the videos at idxs, in that order"""
+        starts = self.offsets[idxs]
+        counts = self.offsets[idxs + 1] - starts
+        offsets = np.zeros(len(idxs) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        interval_idxs = (np.repeat(starts - offsets[:-1], counts)
+                         + np.arange(offsets[-1]))
+        return PythonISetData(
+            self.video_ids[idxs], self.is_entire_video[idxs], offsets,
+            self.intervals[interval_idxs])
+
+    def select(self, mask: np.ndarray) -> 'PythonISetData':
+        return self.take(np.flatnonzero(mask))
+
+    def to_global_intervals(self) -> IntervalArray:
+        """Intervals of all of the videos in one sorted array"""
+        ids = np.repeat(self.video_ids, np.diff(self.offsets))
+        return self.intervals + (ids << VIDEO_ID_SHIFT)[:, np.newaxis]
 
 
 def get_non_none(a: Any, b: Any) -> Optional[Any]:
-    return a if b is None else a
+    return a if b is None else b
 
 
 def and_search_contexts(
@@ -115,8 +256,18 @@ def and_search_contexts(
     else:
         days_of_week = get_non_none(c1.days_of_week, c2.days_of_week)
 
-    return SearchContext(start_date, end_date, videos, channel, show, hours,
-                         days_of_week)
+    if c1.video_filter is not None and c2.video_filter is not None:
+        video_filter = c1.video_filter & c2.video_filter
+        if video_filter.is_empty():
+            return None
+    else:
+        video_filter = get_non_none(c1.video_filter, c2.video_filter)
+
+    return SearchContext(
+        start_date, end_date, videos, channel, show, hours, days_of_week,
+        video_filter=video_filter,
+        exclude_commercials=c1.exclude_commercials or c2.exclude_commercials,
+        shard_filter=get_non_none(c1.shard_filter, c2.shard_filter))
 
 
 # Execution order preference (lower is higher)
@@ -134,12 +285,24 @@ SEARCH_KEY_EXEC_PRIORITY = {
 }
 
 
+# Children of an AND whose results can restrict a later text child
+PUSHDOWN_SEARCH_KEYS = {
+    SearchKey.face_name, SearchKey.face_tag, SearchKey.face_count,
+    SearchKey.text
+}
+
+# Restrict the text children of an AND to the videos of its other children
+# when they match at most this many videos
+MAX_PUSHDOWN_VIDEOS = 2500
+
+
 def milliseconds(s: float) -> int:
     return int(s * 1000)
 
 
-def get_entire_video_ms_interval(video: Video) -> List[Interval]:
-    return [(0, int(video.num_frames / video.fps * 1000))]
+def get_entire_video_ms_interval(video: Video) -> IntervalArray:
+    return intervals_from_list(
+        [(0, int(video.num_frames / video.fps * 1000))])
 
 
 def assert_param_not_set(
@@ -153,6 +316,26 @@ def assert_param_not_set(
         raise InvalidUsage(mesg)
 
 
+def get_response_format() -> ResponseFormat:
+    value = request.args.get(SearchParam.format, None, type=str)
+    if not value:
+        if request.accept_mimetypes.best_match(
+                [JSON_MIMETYPE, BINARY_MIMETYPE]) == BINARY_MIMETYPE:
+            return ResponseFormat.binary
+        return ResponseFormat.json
+    try:
+        return ResponseFormat[value]
+    except KeyError:
+        raise InvalidUsage('Invalid response format: {}'.format(value))
+
+
+def ndjson_response(chunks: Iterable[Any]) -> Response:
+    """Stream each chunk as a line of JSON"""
+    return Response(
+        stream_with_context(json.dumps(c) + '\n' for c in chunks),
+        mimetype=NDJSON_MIMETYPE)
+
+
 def get_aggregate_fn(default_agg_by: str) -> AggregateFn:
     agg = request.args.get(SearchParam.aggregate, None, type=str)
     e = Aggregate[agg] if agg else default_agg_by
@@ -169,107 +352,214 @@ def get_aggregate_fn(default_agg_by: str) -> AggregateFn:
 
 def get_python_iset_from_filter(
         vdc: VideoDataContext,
-        video_filter: Optional[VideoFilterFn]
-) -> PythonISetDataGenerator:
-    for v in vdc.video_dict.values():  # sorted iterator
-        if video_filter is not None and video_filter(v):
-            yield PythonISetData(v, True)
+        video_filter: Optional[VideoFilter]
+) -> PythonISetData:
+    return PythonISetData.from_videos(
+        video_filter.ids() if video_filter is not None
+        else np.zeros(0, dtype=np.int64))
 
 
 def get_python_iset_from_rust_iset(
         vdc: VideoDataContext,
         isetmap: MmapIntervalSetMapping,
-        video_filter: Optional[VideoFilterFn]
-) -> PythonISetDataGenerator:
-    for video_id in isetmap.get_ids():
-        video = vdc.video_by_id.get(video_id)
-        if video is not None and (
-                video_filter is None or video_filter(video)
-        ):
+        video_filter: Optional[VideoFilter]
+) -> PythonISetData:
+    return get_python_iset_from_rust_iset_ids(
+        vdc, isetmap, get_rust_iset_ids(isetmap, video_filter))
+
+
+def get_rust_iset_ids(
+        isetmap: MmapIntervalSetMapping,
+        video_filter: Optional[VideoFilter]
+) -> List[int]:
+    video_ids = isetmap.get_ids()
+    if video_filter is not None:
+        video_ids = video_filter.filter_ids(video_ids).tolist()
+    return video_ids
+
+
+def get_python_iset_from_rust_iset_ids(
+        vdc: VideoDataContext,
+        isetmap: MmapIntervalSetMapping,
+        video_ids: List[int]
+) -> PythonISetData:
+    result_ids = []
+    result_intervals = []
+    for video_id in video_ids:
+        if video_id in vdc.video_by_id:
             intervals = isetmap.get_intervals(video_id, True)
             if intervals:
-                yield PythonISetData(video, False, intervals=intervals)
+                result_ids.append(video_id)
+                result_intervals.append(intervals)
+    return PythonISetData.from_lists(result_ids, result_intervals)
+
+
+def filter_python_iset(
+        data: PythonISetData,
+        video_filter: VideoFilter
+) -> PythonISetData:
+    return data.select(video_filter.match_ids(data.video_ids))
+
+
+def iter_python_iset(
+        vdc: VideoDataContext,
+        data: PythonISetData
+) -> Iterator[Tuple[Video, IntervalArray]]:
+    """Each video and its intervals, in order of video id"""
+    for i, video_id in enumerate(data.video_ids.tolist()):
+        video = vdc.video_by_id[video_id]
+        if data.is_entire_video[i]:
+            yield video, get_entire_video_ms_interval(video)
+        else:
+            yield video, data.get_intervals(i)
 
 
 MAX_TRANSCRIPT_SEARCH_COST = 0.005
 
+# Precomputed intervals are read without searching the caption index, so
+# terms that are ten times as common are allowed
+MAX_DERIVED_TRANSCRIPT_SEARCH_COST = 10 * MAX_TRANSCRIPT_SEARCH_COST
+
+# Above this fraction of the videos, scanning the postings of every document
+# and filtering afterwards is cheaper than searching a subset of documents
+MAX_CAPTION_SUBSET_FRACTION = 0.25
+
+
+def is_caption_subset_search(
+        video_filter: Optional[VideoFilter],
+        cost: float,
+        context: SearchContext
+) -> bool:
+    return video_filter is not None and (
+        context.videos is not None
+        or cost > MAX_TRANSCRIPT_SEARCH_COST
+        or video_filter.mask.mean() <= MAX_CAPTION_SUBSET_FRACTION)
+
+
+def check_caption_search_cost(
+        cdc: CaptionDataContext,
+        vdc: VideoDataContext,
+        text_str: str,
+        cost: float,
+        context: SearchContext,
+        max_cost: float
+) -> None:
+    """Raise if the estimated cost of the text query is above max_cost"""
+    # The cost limit applies to the whole search, rather than to each of its
+    # shards (which would each be scaled down as a subset of the documents)
+    video_filter = get_video_filter(
+        vdc, context._replace(shard_filter=None))
+    search_cost = cost
+    if is_caption_subset_search(video_filter, cost, context):
+        search_cost *= np.count_nonzero(video_filter.match_ids(
+            cdc.document_video_ids[cdc.video_ordered_document_ids])) / max(
+                len(cdc.documents), 1)
+
+    if search_cost > max_cost:
+        raise QueryTooExpensive(
+            'The text query is too expensive to compute. '
+            '"{}" contains too many common words/phrases.'.format(text_str))
+
+
+def parse_caption_query(text_str: str) -> Query:
+    try:
+        return Query(text_str.upper())
+    except Exception as e:
+        raise InvalidCaptionSearch(text_str)
+
 
 def get_caption_intervals(
         cdc: CaptionDataContext,
         vdc: VideoDataContext,
         text_str: str,
         context: SearchContext
-) -> PythonISetDataGenerator:
-    missing_videos = 0
-    matched_videos = 0
-    filtered_videos = 0
-
+) -> PythonISetData:
     text_window = context.text_window
-    video_filter = get_video_filter(context)
+    video_filter = get_video_filter(vdc, context)
 
-    documents = None
-    if context.videos is not None:
-        documents = []
-        for video_id in context.videos:
-            video = vdc.video_by_id[video_id]
-            if video_filter is None or video_filter(video):
-                document = cdc.document_by_name.get(video.name)
-                if document is not None:
-                    documents.append(document)
-        if len(documents) == 0:
-            return iter(())
+    query = parse_caption_query(text_str)
+    cost = query.estimate_cost(cdc.lexicon)
+    check_caption_search_cost(
+        cdc, vdc, text_str, cost, context, MAX_TRANSCRIPT_SEARCH_COST)
 
-    query = None
-    try:
-        query = Query(text_str.upper())
-    except Exception as e:
-        raise InvalidCaptionSearch(text_str)
+    # Whether the video of each document is in the context
+    document_video_ids = cdc.document_video_ids
+    if video_filter is not None:
+        is_match = video_filter.match_ids(document_video_ids)
+    else:
+        is_match = document_video_ids >= 0
 
-    if documents is None:
-        if query.estimate_cost(cdc.lexicon) > MAX_TRANSCRIPT_SEARCH_COST:
-            raise QueryTooExpensive(
-                'The text query is too expensive to compute. '
-                '"{}" contains too many common words/phrases.'.format(text_str))
+    documents = None
+    if is_caption_subset_search(video_filter, cost, context):
+        # Only search the documents of the videos in the context, in order
+        # of video id
+        document_ids = cdc.video_ordered_document_ids
+        documents = [
+            cdc.documents[i]
+            for i in document_ids[is_match[document_ids]].tolist()]
+        if len(documents) == 0:
+            return get_python_iset_from_filter(vdc, None)
 
-    results = []
+    video_ids = []
+    counts = []
+    bounds = []
     for raw_result in query.execute(
             cdc.lexicon, cdc.index, documents=documents,
             ignore_word_not_found=True, case_insensitive=True
     ):
-        document = cdc.documents[raw_result.id]
-        video = vdc.video_dict.get(document.name)
-        if video is None:
-            missing_videos += 1
-            continue
-        else:
-            matched_videos += 1
-        if video_filter is not None and not video_filter(video):
-            filtered_videos += 1
+        if not is_match[raw_result.id]:
             continue
+        video_id = int(document_video_ids[raw_result.id])
 
         postings = raw_result.postings
         if text_window > 0:
+            video = vdc.video_by_id[video_id]
             postings = PostingUtil.deoverlap(PostingUtil.to_fixed_length(
                 postings, text_window,
                 video.num_frames / video.fps))
-        results.append(PythonISetData(
-            video, False,
-            [(int(p.start * 1000), int(p.end * 1000)) for p in postings]))
-    results.sort(key=lambda x: x.video.id)
-    return iter(results)
+        video_ids.append(video_id)
+        counts.append(len(postings))
+        bounds.extend((p.start, p.end) for p in postings)
+    return PythonISetData.from_segments(
+        np.array(video_ids, dtype=np.int64),
+        np.array(counts, dtype=np.int64),
+        (np.array(bounds, dtype=np.float64).reshape(-1, 2) * 1000
+         ).astype(np.int64))
+
+
+def get_derived_text_intervals(
+        cdc: CaptionDataContext,
+        vdc: VideoDataContext,
+        text_str: str,
+        context: SearchContext
+) -> Optional[PythonISetData]:
+    """
+    Same as get_caption_intervals, but read from the precomputed postings of
+    a common token or bigram (if any)
+    """
+    isetmap = cdc.text_isetmaps.get(normalize_text_term(text_str))
+    if isetmap is None or context.text_window > 0:
+        # Windows are applied to each posting, which the isets do not keep
+        return None
+
+    cost = parse_caption_query(text_str).estimate_cost(cdc.lexicon)
+    check_caption_search_cost(
+        cdc, vdc, text_str, cost, context, MAX_DERIVED_TRANSCRIPT_SEARCH_COST)
+    return get_python_iset_from_rust_iset(
+        vdc, isetmap, get_video_filter(vdc, context))
 
 
 def search_result_to_python_iset(
         vdc: VideoDataContext,
         result: SearchResult
-) -> PythonISetDataGenerator:
+) -> PythonISetData:
     if result.type == SearchResultType.video_set:
-        video_filter = get_video_filter(result.context)
+        video_filter = get_video_set_filter(vdc, result.context)
         return get_python_iset_from_filter(
             vdc, video_filter)
 
     elif result.type == SearchResultType.rust_iset:
-        video_filter = get_video_filter(result.context)
+        video_filter = get_video_filter(vdc, result.context)
         return get_python_iset_from_rust_iset(
             vdc, result.data, video_filter)
 
@@ -279,212 +569,145 @@ def search_result_to_python_iset(
     raise UnreachableCode()
 
 
-def and_python_isets(
-        r1: SearchResult,
-        r2: SearchResult
-) -> PythonISetDataGenerator:
-    prev = None
-    for curr in heapq.merge(
-            ((d.video.id, d) for d in r1.data),
-            ((d.video.id, d) for d in r2.data)
-    ):
-        if prev is None:
-            prev = curr
-        elif prev[0] == curr[0]:
-            if prev[1].is_entire_video:
-                yield curr[1]
-            elif curr[1].is_entire_video:
-                yield prev[1]
-            else:
-                intervals = list(merge_close_intervals(
-                    intersect_sorted_intervals(
-                        prev[1].intervals, curr[1].intervals)))
-                if len(intervals) > 0:
-                    yield PythonISetData(curr[1].video, False, intervals)
-            prev = None
-        else:
-            assert curr[0] > prev[0], '{} < {}'.format(curr[0], prev[0])
-            prev = curr
+# Videos converted at a time, when iterating over a search result
+SEARCH_RESULT_CHUNK_VIDEOS = 1000
 
 
-def or_python_iset_with_filter(
+def iter_search_result_chunks(
         vdc: VideoDataContext,
-        video_filter: VideoFilterFn,
-        search_result: SearchResult
-) -> PythonISetDataGenerator:
-    assert video_filter is not None
-    assert search_result.type == SearchResultType.python_iset
-
-    all_videos_iter = iter(vdc.video_dict.values())
+        result: SearchResult
+) -> Iterator[PythonISetData]:
+    """
+    Same as search_result_to_python_iset, but in chunks of consecutive video
+    ids, so that each chunk can be consumed before the next is converted
+    """
+    if result.type == SearchResultType.python_iset:
+        yield result.data
+        return
 
-    # Match videos from search_result to all videos
-    for curr in search_result.data:
-        curr_video = curr.video
-        all_videos_head = next(all_videos_iter)
-        while all_videos_head and all_videos_head.id < curr_video.id:
-            if video_filter(all_videos_head):
-                yield PythonISetData(curr_video, True)
-            all_videos_head = next(all_videos_iter)
+    if result.type == SearchResultType.video_set:
+        video_filter = get_video_set_filter(vdc, result.context)
+        video_ids = (video_filter.ids() if video_filter is not None
+                     else np.zeros(0, dtype=np.int64))
+    elif result.type == SearchResultType.rust_iset:
+        video_filter = get_video_filter(vdc, result.context)
+        video_ids = np.sort(np.array(
+            get_rust_iset_ids(result.data, video_filter), dtype=np.int64))
+    else:
+        raise UnreachableCode()
 
-        assert all_videos_head.id == curr_video.id
-        if video_filter(curr_video):
-            yield PythonISetData(curr_video, True)
+    for i in range(0, len(video_ids), SEARCH_RESULT_CHUNK_VIDEOS):
+        chunk_ids = video_ids[i:i + SEARCH_RESULT_CHUNK_VIDEOS]
+        if result.type == SearchResultType.video_set:
+            yield PythonISetData.from_videos(chunk_ids)
         else:
-            yield curr
+            yield get_python_iset_from_rust_iset_ids(
+                vdc, result.data, chunk_ids.tolist())
 
-    # Finish up all_videos_iter
-    for video in all_videos_iter:
-        if video_filter(video):
-            yield PythonISetData(video, True)
+
+def and_python_isets(
+        d1: PythonISetData,
+        d2: PythonISetData
+) -> PythonISetData:
+    _, idxs1, idxs2 = np.intersect1d(
+        d1.video_ids, d2.video_ids, assume_unique=True, return_indices=True)
+    entire1 = d1.is_entire_video[idxs1]
+    entire2 = d2.is_entire_video[idxs2]
+    neither = ~entire1 & ~entire2
+    return PythonISetData.concat([
+        d1.take(idxs1[entire2]),
+        d2.take(idxs2[entire1 & ~entire2]),
+        PythonISetData.from_global_intervals(intersect_intervals(
+            d1.take(idxs1[neither]).to_global_intervals(),
+            d2.take(idxs2[neither]).to_global_intervals()))
+    ])
+
+
+def and_python_iset_with_rust_iset(
+        data: PythonISetData,
+        isetmap: MmapIntervalSetMapping,
+        video_filter: Optional[VideoFilter]
+) -> PythonISetData:
+    if video_filter is not None:
+        data = filter_python_iset(data, video_filter)
+    result_ids = []
+    result_intervals = []
+    for i, video_id in enumerate(data.video_ids.tolist()):
+        if data.is_entire_video[i]:
+            intervals = isetmap.get_intervals(video_id, True)
+        else:
+            intervals = isetmap.intersect(
+                video_id, intervals_to_list(data.get_intervals(i)), True)
+        if intervals:
+            result_ids.append(video_id)
+            result_intervals.append(intervals)
+    return PythonISetData.from_lists(result_ids, result_intervals)
 
 
 def or_python_isets(
-        r1: SearchResult,
-        r2: SearchResult
-) -> PythonISetDataGenerator:
-    assert r1.type == SearchResultType.python_iset
-    assert r2.type == SearchResultType.python_iset
-
-    prev = None
-    for curr in heapq.merge(
-            ((s.video.id, s) for s in r1.data),
-            ((s.video.id, s) for s in r2.data)
-    ):
-        if prev is None:
-            prev = curr
-        elif curr[0] == prev[0]:
-            if curr[1].is_entire_video:
-                yield curr[1]
-            elif prev[1].is_entire_video:
-                yield prev[1]
-            else:
-                yield PythonISetData(
-                    curr[1].video, False,
-                    deoverlap_intervals(
-                        heapq.merge(curr[1].intervals, prev[1].intervals),
-                        100))
-            prev = None
-        else:
-            assert curr[0] > prev[0], '{} < {}'.format(curr[0], prev[0])
-            yield prev[1]
-            prev = curr
-    if prev is not None:
-        yield prev[1]
+        d1: PythonISetData,
+        d2: PythonISetData
+) -> PythonISetData:
+    _, idxs1, idxs2 = np.intersect1d(
+        d1.video_ids, d2.video_ids, assume_unique=True, return_indices=True)
+    only1 = np.ones(len(d1), dtype=bool)
+    only1[idxs1] = False
+    only2 = np.ones(len(d2), dtype=bool)
+    only2[idxs2] = False
+    entire1 = d1.is_entire_video[idxs1]
+    entire2 = d2.is_entire_video[idxs2]
+    neither = ~entire1 & ~entire2
+    return PythonISetData.concat([
+        d1.select(only1),
+        d2.select(only2),
+        d1.take(idxs1[entire1]),
+        d2.take(idxs2[entire2 & ~entire1]),
+        PythonISetData.from_global_intervals(union_intervals(
+            d1.take(idxs1[neither]).to_global_intervals(),
+            d2.take(idxs2[neither]).to_global_intervals(), 100))
+    ])
+
+
+def or_python_iset_with_filter(
+        vdc: VideoDataContext,
+        video_filter: VideoFilter,
+        search_result: SearchResult
+) -> PythonISetData:
+    assert video_filter is not None
+    assert search_result.type == SearchResultType.python_iset
+    return or_python_isets(
+        get_python_iset_from_filter(vdc, video_filter), search_result.data)
 
 
 def or_python_iset_with_rust_iset(
         vdc: VideoDataContext,
         python_result: SearchResult,
         rust_result: SearchResult
-) -> PythonISetDataGenerator:
+) -> PythonISetData:
     assert python_result.type == SearchResultType.python_iset
     assert rust_result.type == SearchResultType.rust_iset
-
-    try:
-        python_result_head = next(python_result.data)
-    except StopIteration:
-        python_result_head = None
-
-    video_filter = get_video_filter(rust_result.context)
-    for video_id in rust_result.data.get_ids():
-        video = vdc.video_by_id.get(video_id)
-        if not video:
-            continue
-
-        while (
-                python_result_head is not None
-                and python_result_head.video.id < video_id
-        ):
-            yield python_result_head
-            try:
-                python_result_head = next(python_result.data)
-            except StopIteration:
-                python_result_head = None
-
-        assert (python_result_head is None
-                or python_result_head.video.id >= video_id)
-        if (
-                python_result_head is None
-                or python_result_head.video.id != video_id
-        ):
-            if video_filter is None or video_filter(video):
-                intervals = rust_result.data.get_intervals(video_id, True)
-                if intervals:
-                    yield PythonISetData(video, False, intervals=intervals)
-        else:
-            assert python_result_head.video.id == video_id
-            if (
-                    python_result_head.is_entire_video
-                    or (video_filter is not None and not video_filter(video))
-            ):
-                yield python_result_head
-            else:
-                yield PythonISetData(
-                    video, False,
-                    deoverlap_intervals(
-                        heapq.merge(
-                            python_result_head.intervals,
-                            rust_result.data.get_intervals(video_id, True)
-                        ),
-                        100))
-            try:
-                python_result_head = next(python_result.data)
-            except StopIteration:
-                python_result_head = None
-
-    # yield any remaining results
-    if python_result_head is not None:
-        yield python_result_head
-        for x in python_result.data:
-            yield x
+    return or_python_isets(
+        python_result.data, search_result_to_python_iset(vdc, rust_result))
 
 
 def or_rust_isets(
         vdc: VideoDataContext,
         r1: SearchResult,
         r2: SearchResult
-) -> PythonISetDataGenerator:
+) -> PythonISetData:
     assert r1.type == SearchResultType.rust_iset
     assert r2.type == SearchResultType.rust_iset
-
-    r1_filter = get_video_filter(r1.context)
-    r2_filter = get_video_filter(r2.context)
-    r1_ids = set(r1.data.get_ids())
-    r2_ids = set(r2.data.get_ids())
-    for video_id in sorted(r1_ids | r2_ids):
-        video = vdc.video_by_id.get(video_id)
-        if video is None:
-            continue
-
-        r1_intervals = (
-            r1.data.get_intervals(video_id, True)
-            if (
-                video.id in r1_ids
-                and (r1_filter is None or r1_filter(video))
-            ) else None)
-        r2_intervals = (
-            r2.data.get_intervals(video_id, True)
-            if (
-                video.id in r2_ids
-                and (r2_filter is None or r2_filter(video))
-            ) else None)
-        if r1_intervals and r2_intervals:
-            yield PythonISetData(
-                video, False,
-                deoverlap_intervals(
-                    heapq.merge(r1_intervals, r2_intervals), 100))
-        elif r1_intervals:
-            yield PythonISetData(video, False, r1_intervals)
-        elif r2_intervals:
-            yield PythonISetData(video, False, r2_intervals)
+    return or_python_isets(
+        search_result_to_python_iset(vdc, r1),
+        search_result_to_python_iset(vdc, r2))
 
 
 def join_intervals_with_commercials(
         vdc: VideoDataContext,
         video: Video,
-        intervals: List[Interval],
+        intervals: IntervalArray,
         is_commercial: Ternary
-) -> List[Interval]:
+) -> IntervalArray:
     if is_commercial != Ternary.both:
         if is_commercial == Ternary.true:
             intervals = intersect_isetmap(
@@ -603,44 +826,79 @@ def get_face_time_filter_mask(
     return payload_mask, payload_value
 
 
-def get_video_filter(context: SearchContext) -> Optional[VideoFilterFn]:
-    if (
-            context.videos is not None
-            or context.start_date is not None
-            or context.end_date is not None
-            or context.channel is not None
-            or context.show is not None
-            or context.hours is not None
-            or context.days_of_week is not None
-    ):
-        def video_filter(video: Video) -> bool:
-            if (
-                    (context.videos is not None and video.id not in context.videos)
-                    or (context.show is not None and video.show != context.show)
-                    or (context.days_of_week is not None
-                        and video.dayofweek not in context.days_of_week)
-                    or (context.channel is not None
-                        and video.channel != context.channel)
-                    or (context.start_date is not None
-                        and video.date < context.start_date)
-                    or (context.end_date is not None
-                        and video.date > context.end_date)
-            ):
-                return False
-            if context.hours:
-                video_start = video.hour
-                video_end = (
-                    video.hour + round(video.num_frames / video.fps / 3600))
-                for h in range(video_start, video_end + 1):
-                    if h in context.hours:
-                        break
-                else:
-                    return False
-            return True
-        return video_filter
+def is_restricted(context: SearchContext) -> bool:
+    """Whether the context restricts the videos (other than to a shard)"""
+    return (
+        context.videos is not None
+        or context.start_date is not None
+        or context.end_date is not None
+        or context.channel is not None
+        or context.show is not None
+        or context.hours is not None
+        or context.days_of_week is not None
+        or context.video_filter is not None)
+
+
+def get_video_filter(
+        vdc: VideoDataContext,
+        context: SearchContext
+) -> Optional[VideoFilter]:
+    if is_restricted(context) or context.shard_filter is not None:
+        table = vdc.video_table
+        index = vdc.video_index
+        mask = (table.mask_all() if context.video_filter is None
+                else context.video_filter.mask.copy())
+        if context.shard_filter is not None:
+            mask &= context.shard_filter.mask
+        if context.videos is not None:
+            videos_mask = np.zeros(len(table), dtype=bool)
+            videos_mask[table.rows(context.videos)] = True
+            mask &= videos_mask
+        if context.show is not None:
+            mask &= index.show(context.show)
+        if context.days_of_week is not None:
+            mask &= index.days_of_week(context.days_of_week)
+        if context.channel is not None:
+            mask &= index.channel(context.channel)
+        if context.start_date is not None:
+            mask &= table.date >= context.start_date.toordinal()
+        if context.end_date is not None:
+            mask &= table.date <= context.end_date.toordinal()
+        if context.hours:
+            mask &= index.hours(context.hours)
+        return VideoFilter(table, mask)
     return None
 
 
+def get_video_set_filter(
+        vdc: VideoDataContext,
+        context: SearchContext
+) -> Optional[VideoFilter]:
+    """
+    Videos of a video_set result, or None if the context is unrestricted.
+    A shard alone does not restrict it, so that the result is the same
+    whether or not the search is sharded.
+    """
+    return get_video_filter(vdc, context) if is_restricted(context) else None
+
+
+def get_global_face_iset_name(global_tags: Set[str]) -> str:
+    """Name of the derived face iset (e.g., male_host) for the global tags"""
+    is_all, gender_tag, host_tag = interpret_global_tags(global_tags)
+    if is_all:
+        return 'all'
+    parts = []
+    if gender_tag is not None:
+        parts.append(gender_tag)
+    if host_tag == GlobalTags.host:
+        parts.append('host')
+    elif host_tag == GlobalTags.non_host:
+        parts.append('nonhost')
+    if not parts:
+        raise UnreachableCode()
+    return '_'.join(parts)
+
+
 def get_face_tag_intervals(
         vdc: VideoDataContext,
         tag_str: str
@@ -648,34 +906,9 @@ def get_face_tag_intervals(
     all_tags = parse_tags(tag_str)
     global_tags = get_global_tags(all_tags)
     if len(global_tags) == len(all_tags.tags):
-        is_all, gender_tag, host_tag = interpret_global_tags(global_tags)
-        if is_all:
-            isetmap = vdc.face_intervals.all_isetmap
-        elif gender_tag is None:
-            if host_tag == GlobalTags.host:
-                isetmap = vdc.face_intervals.host_isetmap
-            elif host_tag == GlobalTags.non_host:
-                isetmap = vdc.face_intervals.nonhost_isetmap
-            else:
-                raise UnreachableCode()
-        elif gender_tag == GlobalTags.male:
-            if host_tag is None:
-                isetmap = vdc.face_intervals.male_isetmap
-            elif host_tag == GlobalTags.host:
-                isetmap = vdc.face_intervals.male_host_isetmap
-            elif host_tag == GlobalTags.non_host:
-                isetmap = vdc.face_intervals.male_nonhost_isetmap
-            else:
-                raise UnreachableCode()
-        elif gender_tag == GlobalTags.female:
-            if host_tag is None:
-                isetmap = vdc.face_intervals.female_isetmap
-            elif host_tag == GlobalTags.host:
-                isetmap = vdc.face_intervals.female_host_isetmap
-            elif host_tag == GlobalTags.non_host:
-                isetmap = vdc.face_intervals.female_nonhost_isetmap
-            else:
-                raise UnreachableCode()
+        isetmap = getattr(
+            vdc.face_intervals,
+            get_global_face_iset_name(global_tags) + '_isetmap')
     else:
         ilistmaps = person_tags_to_ilistmaps(vdc, all_tags.tags)
         _, gender_tag, host_tag = interpret_global_tags(global_tags)
@@ -686,6 +919,17 @@ def get_face_tag_intervals(
     return isetmap
 
 
+def get_face_tag_rollup(
+        vdc: VideoDataContext,
+        tag_str: str
+) -> Optional[ScreenTimeRollup]:
+    all_tags = parse_tags(tag_str)
+    global_tags = get_global_tags(all_tags)
+    if len(global_tags) == len(all_tags.tags):
+        return vdc.face_rollups.get(get_global_face_iset_name(global_tags))
+    return None
+
+
 def get_face_name_intervals(
         vdc: VideoDataContext,
         name: str
@@ -696,6 +940,14 @@ def get_face_name_intervals(
     return person_intervals.isetmap
 
 
+def get_face_name_rollup(
+        vdc: VideoDataContext,
+        name: str
+) -> Optional[ScreenTimeRollup]:
+    person_intervals = vdc.all_person_intervals.get(name, None)
+    return None if person_intervals is None else person_intervals.rollup
+
+
 def get_face_count_intervals(
         vdc: VideoDataContext,
         face_count: int
@@ -711,59 +963,191 @@ def get_face_count_intervals(
         0xFF, face_count, 3000, 0)
 
 
+def get_non_commercial_intervals(
+        vdc: VideoDataContext,
+        key: str,
+        value: Any
+) -> Optional[MmapIntervalSetMapping]:
+    """
+    Variant of the intervals of a face key with commercials removed, if
+    derive_data.py has precomputed one.
+
+    Face counts and the tags of people have none, since they are converted
+    from ilists (merging gaps and dropping short intervals), which must be
+    done before commercials are removed.
+    """
+    if key == SearchKey.face_name:
+        person_intervals = vdc.all_person_intervals.get(value.lower(), None)
+        if person_intervals is not None:
+            return person_intervals.non_commercial_isetmap
+
+    elif key == SearchKey.face_tag:
+        all_tags = parse_tags(value.lower())
+        global_tags = get_global_tags(all_tags)
+        if (
+                len(global_tags) == len(all_tags.tags)
+                and vdc.non_commercial_face_intervals is not None
+        ):
+            return getattr(
+                vdc.non_commercial_face_intervals,
+                get_global_face_iset_name(global_tags) + '_isetmap')
+    return None
+
+
 def intersect_isetmap(
         video: Video,
         isetmap: MmapIntervalSetMapping,
-        intervals: Optional[List[Interval]]
-) -> List[Interval]:
-    return (isetmap.get_intervals(video.id, True) if intervals is None
-            else isetmap.intersect(video.id, intervals, True))
+        intervals: Optional[IntervalArray]
+) -> IntervalArray:
+    return intervals_from_list(
+        isetmap.get_intervals(video.id, True) if intervals is None
+        else isetmap.intersect(video.id, intervals_to_list(intervals), True))
 
 
 def minus_isetmap(
         video: Video,
         isetmap: MmapIntervalSetMapping,
-        intervals: Optional[List[Interval]]
-) -> List[Interval]:
-    return isetmap.minus(
-        video.id, intervals if intervals is not None
-        else get_entire_video_ms_interval(video), True)
-
-
-def merge_close_intervals(
-        intervals: Iterable[Interval],
-        threshold: float = 0.25
-) -> Generator[Interval, None, None]:
-    curr_i = None
-    for i in intervals:
-        if curr_i is not None:
-            if max(curr_i[0], i[0]) - min(curr_i[1], i[1]) < threshold:
-                curr_i = (min(curr_i[0], i[0]), max(curr_i[1], i[1]))
-            else:
-                yield curr_i
-                curr_i = i
-        else:
-            curr_i = i
-    if curr_i is not None:
-        yield curr_i
-
-
-def intersect_sorted_intervals(
-        l1: List[Interval],
-        l2: List[Interval]
-) -> Generator[Interval, None, None]:
-    i, j = 0, 0
-    while i < len(l1) and j < len(l2):
-        a1, b1 = l1[i]
-        a2, b2 = l2[j]
-        max_a = max(a1, a2)
-        min_b = min(b1, b2)
-        if min_b - max_a > 0:
-            yield (max_a, min_b)
-        if a1 < a2:
-            i += 1
-        else:
-            j += 1
+        intervals: Optional[IntervalArray]
+) -> IntervalArray:
+    return intervals_from_list(isetmap.minus(
+        video.id, intervals_to_list(
+            intervals if intervals is not None
+            else get_entire_video_ms_interval(video)), True))
+
+
+def canonicalize_query(query: Any) -> Any:
+    """
+    Rewrite a query tree into a canonical form for use as a cache key
+
+    Raises InvalidUsage if the tree is malformed, since this is done before
+    the query is evaluated.
+    """
+    if isinstance(query, dict):
+        # Compound query
+        for k in query:
+            if k not in COMPOUND_QUERY_OPERANDS:
+                raise InvalidUsage('Unknown query operand: {}'.format(k))
+        return {k: canonicalize_query(query[k]) if query[k] else query[k]
+                for k in sorted(query)}
+    if not isinstance(query, list) or len(query) != 2:
+        raise InvalidUsage('Invalid query: {}'.format(json.dumps(query)))
+    k, v = query
+    if not isinstance(k, str):
+        raise InvalidUsage('Invalid query: {}'.format(json.dumps(query)))
+    if k == 'and' or k == 'or':
+        if not isinstance(v, list):
+            raise InvalidUsage('Invalid query: {}'.format(json.dumps(query)))
+        children = [canonicalize_query(c) for c in v]
+        # Sort is stable, so repeated text windows keep their relative order
+        children.sort(key=lambda c: (
+            c[0], '' if c[0] == SearchKey.text_window else json.dumps(c)))
+        return [k, children]
+    elif k in (SearchKey.face_name, SearchKey.face_tag, SearchKey.text):
+        if not isinstance(v, str):
+            raise InvalidUsage('Invalid query: {}'.format(json.dumps(query)))
+        return [k, v.upper() if k == SearchKey.text else v.lower()]
+    return [k, v]
+
+
+def get_context_key(context: SearchContext) -> Hashable:
+    def frozen(s: Optional[Set[int]]) -> Optional[frozenset]:
+        return None if s is None else frozenset(s)
+
+    return (
+        context.start_date, context.end_date, frozen(context.videos),
+        context.channel, context.show, frozen(context.hours),
+        frozen(context.days_of_week), context.text_window,
+        None if context.video_filter is None
+        else context.video_filter.mask.tobytes(),
+        context.exclude_commercials,
+        None if context.shard_filter is None
+        else context.shard_filter.mask.tobytes())
+
+
+# Video level keys are cheap to evaluate and are never shared
+MEMOIZABLE_SEARCH_KEYS = {
+    'and', 'or', SearchKey.text, SearchKey.face_name, SearchKey.face_tag,
+    SearchKey.face_count
+}
+
+
+class SearchMemo(object):
+    """
+    Results of the subtrees that are shared by a batch of queries, so that
+    each distinct subtree (in a given context) is evaluated only once.
+    """
+
+    def __init__(self, queries: Iterable[Any]):
+        counts = Counter()
+
+        def count_subtrees(query: Any) -> None:
+            k, v = query
+            if k in MEMOIZABLE_SEARCH_KEYS:
+                counts[json.dumps(query)] += 1
+            if k == 'and' or k == 'or':
+                for c in v:
+                    count_subtrees(c)
+
+        for q in queries:
+            count_subtrees(canonicalize_query(q))
+        self._shared = {k for k, v in counts.items() if v > 1}
+        self._lock = threading.Lock()
+        self._results: Dict[Hashable, Future] = {}
+
+    def search(
+            self, query: Any, context: SearchContext,
+            search_fn: Callable[[], Optional[SearchResult]]
+    ) -> Optional[SearchResult]:
+        if query[0] not in MEMOIZABLE_SEARCH_KEYS:
+            return search_fn()
+        query_str = json.dumps(canonicalize_query(query))
+        if query_str not in self._shared:
+            return search_fn()
+
+        # Subtrees may be searched concurrently, in which case the later
+        # searches wait for the first
+        key = (query_str, get_context_key(context))
+        with self._lock:
+            future = self._results.get(key)
+            is_first = future is None
+            if is_first:
+                future = Future()
+                self._results[key] = future
+        if is_first:
+            try:
+                future.set_result(search_fn())
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+
+class SearchTrace(object):
+    """Chosen plan and timings of each node in a query (for explain=true)"""
+
+    def __init__(self):
+        self._root = {'children': []}
+        self._stack = [self._root]
+
+    @contextmanager
+    def node(self, query: Any) -> Iterator[JsonObject]:
+        node = {'query': query, 'children': []}
+        self._stack[-1]['children'].append(node)
+        self._stack.append(node)
+        start_time = time.perf_counter()
+        try:
+            yield node
+        finally:
+            node['time_ms'] = round(
+                (time.perf_counter() - start_time) * 1000, 3)
+            self._stack.pop()
+
+    def annotate(self, **kwargs: Any) -> None:
+        """Add fields to the node that is currently being evaluated"""
+        self._stack[-1].update(kwargs)
+
+    def get(self) -> Optional[JsonObject]:
+        children = self._root['children']
+        return children[0] if children else None
 
 
 def get_video_metadata_json(video: Video) -> JsonObject:
@@ -786,15 +1170,189 @@ def add_search_routes(
         video_data_context: VideoDataContext,
         default_aggregate_by: str,
         default_is_commercial: Ternary,
-        default_text_window: int
+        default_text_window: int,
+        data_version: Optional[str],
+        search_cache_bytes: int,
+        search_parallelism: int
 ):
+    search_cache = LRUCache(search_cache_bytes, sizeof=lambda x: len(x[0]))
+
+    # Shared by all requests; children are only evaluated concurrently at the
+    # outermost level, so tasks never wait on other tasks in the pool
+    search_executor = (
+        ThreadPoolExecutor(max_workers=search_parallelism,
+                           thread_name_prefix='search')
+        if search_parallelism > 1 else None)
+    search_thread_state = threading.local()
+
+    # Contiguous rows of the video table, which is sorted by video id
+    search_shard_filters: List[VideoFilter] = []
+    if search_executor is not None:
+        table = video_data_context.video_table
+        num_shards = min(search_parallelism,
+                         len(table) // MIN_SEARCH_SHARD_VIDEOS)
+        if num_shards > 1:
+            bounds = np.linspace(0, len(table), num_shards + 1).astype(int)
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                mask = np.zeros(len(table), dtype=bool)
+                mask[start:end] = True
+                mask.flags.writeable = False
+                search_shard_filters.append(VideoFilter(table, mask))
+
+    def _is_sequential(items: List[Any]) -> bool:
+        """Whether to skip the executor (nested work is always sequential)"""
+        return (
+            search_executor is None
+            or len(items) < 2
+            or getattr(search_thread_state, 'in_executor', False))
+
+    def _run_in_executor(fn: Callable[[Any], Any], item: Any) -> Any:
+        search_thread_state.in_executor = True
+        try:
+            return fn(item)
+        finally:
+            search_thread_state.in_executor = False
+
+    def _map_in_executor(
+            fn: Callable[[Any], Any], items: List[Any]
+    ) -> List[Any]:
+        """Apply fn to the items concurrently, or sequentially if nested"""
+        if _is_sequential(items):
+            return [fn(x) for x in items]
+        return list(search_executor.map(partial(_run_in_executor, fn), items))
+
     def _get_is_commercial() -> Ternary:
         value = request.args.get(SearchParam.is_commercial, None, type=str)
         return Ternary[value] if value else default_is_commercial
 
+    # Estimated costs are the fraction of the videos that a query matches
+    num_videos = max(len(video_data_context.video_table), 1)
+    num_caption_videos = int(np.count_nonzero(
+        caption_data_context.video_document_ids >= 0))
+    num_caption_tokens: List[int] = []      # Counted on first use
+    video_fractions: Dict[Hashable, float] = {}
+
+    def _get_video_fraction(
+            key: Hashable, get_ids: Callable[[], List[int]]
+    ) -> float:
+        if key not in video_fractions:
+            video_fractions[key] = min(len(get_ids()) / num_videos, 1.)
+        return video_fractions[key]
+
+    def _estimate_text_cost(text_str: str) -> float:
+        term = normalize_text_term(text_str)
+        isetmap = caption_data_context.text_isetmaps.get(term)
+        if isetmap is not None:
+            return _get_video_fraction(
+                (SearchKey.text, term), isetmap.get_ids)
+
+        # The caption index estimates the fraction of its tokens that are
+        # searched. If the matches are spread evenly across the documents,
+        # the fraction that has at least one is 1 - e^(-matches / documents).
+        try:
+            token_fraction = Query(text_str.upper()).estimate_cost(
+                caption_data_context.lexicon)
+        except Exception:
+            return 1.
+        if not num_caption_tokens:
+            num_caption_tokens.append(
+                sum(w.count for w in caption_data_context.lexicon))
+        num_matches = token_fraction * num_caption_tokens[0]
+        return min(-math.expm1(
+            -num_matches / max(len(caption_data_context.documents), 1)
+        ) * num_caption_videos / num_videos, 1.)
+
+    def _estimate_tag_cost(tag_str: str) -> float:
+        all_tags = parse_tags(tag_str)
+        global_tags = get_global_tags(all_tags)
+        if len(global_tags) == len(all_tags.tags):
+            return _get_video_fraction(
+                frozenset(global_tags), get_face_tag_intervals(
+                    video_data_context, tag_str).get_ids)
+
+        # A tag matches at most the videos of all of its people
+        cost = 1.
+        for tag in all_tags.tags:
+            if tag in GLOBAL_TAGS:
+                continue
+            key = (SearchKey.face_tag, tag)
+            if key not in video_fractions:
+                people = \
+                    video_data_context.all_person_tags.tag_name_to_names(tag)
+                if not people:
+                    continue
+                video_fractions[key] = min(sum(
+                    _estimate_name_cost(p) for p in people
+                    if p in video_data_context.all_person_intervals), 1.)
+            cost = min(cost, video_fractions[key])
+        return cost
+
+    def _estimate_name_cost(name: str) -> float:
+        person_intervals = video_data_context.all_person_intervals.get(name)
+        if person_intervals is None:
+            return 1.
+        return _get_video_fraction(
+            (SearchKey.face_name, name), person_intervals.isetmap.get_ids)
+
+    def _estimate_cost(query: Any) -> float:
+        """
+        Estimate the fraction of the videos matched by a query, which is also
+        a proxy for how expensive it is to evaluate (1 if unknown)
+        """
+        k, v = query
+        if k == 'and':
+            return min((_estimate_cost(c) for c in v), default=1.)
+        elif k == 'or':
+            return min(sum(_estimate_cost(c) for c in v), 1.)
+        elif k == SearchKey.text:
+            return _estimate_text_cost(v)
+        elif k == SearchKey.face_name:
+            return _estimate_name_cost(v.lower())
+        elif k == SearchKey.face_tag:
+            try:
+                return _estimate_tag_cost(v.lower())
+            except InvalidUsage:
+                return 1.
+        elif k == SearchKey.text_window:
+            return 0.
+        return 1.
+
+    def _get_selectivity(context: SearchContext) -> float:
+        """Fraction of the videos that are in the context"""
+        video_filter = get_video_filter(video_data_context, context)
+        if video_filter is None:
+            return 1.
+        return float(video_filter.mask.mean()) if len(video_filter.mask) else 0.
+
+    def _push_down_videos(
+            result: SearchResult,
+            context: SearchContext
+    ) -> Optional[SearchContext]:
+        """Restrict the context to the videos in an iset result"""
+        if result.type == SearchResultType.python_iset:
+            video_ids = result.data.video_ids.tolist()
+            if len(video_ids) > MAX_PUSHDOWN_VIDEOS:
+                return context
+        else:
+            video_ids = result.data.get_ids()
+            if len(video_ids) > MAX_PUSHDOWN_VIDEOS:
+                return context
+            video_filter = get_video_filter(
+                video_data_context, result.context)
+            if video_filter is not None:
+                video_ids = video_filter.filter_ids(video_ids).tolist()
+        videos = set(video_ids)
+        if context.videos is not None:
+            videos &= context.videos
+        if not videos:
+            return None
+        return context._replace(videos=videos)
+
     def _search_and(
             children: Iterable[Any],
-            context: SearchContext
+            context: SearchContext,
+            memo: Optional[SearchMemo],
+            trace: Optional[SearchTrace]
     ) -> Optional[SearchResult]:
         # First pass: update the context
         deferred_children = []
@@ -842,99 +1400,192 @@ def add_search_routes(
             else:
                 deferred_children.append(c)
 
-        # Second pass: execute search
+        # Second pass: execute search, most selective children first
         if deferred_children:
-            deferred_children.sort(
-                key=lambda x: SEARCH_KEY_EXEC_PRIORITY.get(x[0], 100))
+            selectivity = _get_selectivity(context)
+            if selectivity == 0:
+                return None
+            plan = sorted(
+                ((_estimate_cost(c), c) for c in deferred_children),
+                key=lambda x: (
+                    x[0], SEARCH_KEY_EXEC_PRIORITY.get(x[1][0], 100)))
+            if trace is not None:
+                trace.annotate(selectivity=selectivity, plan=[
+                    {'query': c, 'estimated_cost': cost}
+                    for cost, c in plan])
+
+            # Children are independent unless an earlier iset can restrict
+            # the videos searched by a later text child
+            child_results = None
+            if not any(
+                    c[0] == SearchKey.text and any(
+                        c2[0] in PUSHDOWN_SEARCH_KEYS for _, c2 in plan[:i])
+                    for i, (_, c) in enumerate(plan)
+            ):
+                child_results = _search_and_children(
+                    [c for _, c in plan], context, memo, trace)
+                if child_results is None:
+                    return None
+
             curr_result = None
-            for child in deferred_children:
-                child_result = _search_recursive(child, context)
+            for i, (_, child) in enumerate(plan):
+                child_result = (
+                    _search_recursive(child, context, memo, trace)
+                    if child_results is None else child_results[i])
                 if child_result is None:
                     return None
                 if curr_result is None:
                     curr_result = child_result
-                    continue
-
-                r1 = curr_result
-                r2 = child_result
+                else:
+                    curr_result = _and_search_results(
+                        curr_result, child_result)
+                    if curr_result is None:
+                        return None
 
-                # Symmetric cases
                 if (
-                        r2.type == SearchResultType.video_set
-                        or (r1.type != SearchResultType.video_set
-                            and r2.type == SearchResultType.python_iset)
+                        curr_result.type != SearchResultType.video_set
+                        and any(c[0] == SearchKey.text
+                                for _, c in plan[i + 1:])
                 ):
-                    r1, r2 = r2, r1
-
-                if r1.type == SearchResultType.video_set:
-                    if r2.type == SearchResultType.video_set:
-                        # Result: video_set
-                        new_context = and_search_contexts(
-                            r1.context, r2.context)
-                        if new_context is None:
-                            return None
-                        curr_result = r2._replace(context=new_context)
-                    elif r2.type == SearchResultType.python_iset:
-                        # Result: python_iset
-                        video_filter = get_video_filter(r1.context)
-                        if video_filter:
-                            curr_result = SearchResult(
-                                SearchResultType.python_iset,
-                                data=filter(lambda x: video_filter(x.video),
-                                            r2.data))
-                    elif r2.type == SearchResultType.rust_iset:
-                        # Result: rust_iset
-                        new_context = and_search_contexts(
-                            r1.context, r2.context)
-                        if new_context is None:
-                            return None
-                        curr_result = r2._replace(context=new_context)
-                    else:
-                        raise UnreachableCode()
-
-                elif r1.type == SearchResultType.python_iset:
-                    if r2.type == SearchResultType.python_iset:
-                        # Result: python_iset
-                        curr_result = SearchResult(
-                            SearchResultType.python_iset,
-                            data=and_python_isets(r1, r2))
-                    elif r2.type == SearchResultType.rust_iset:
-                        # Result: python_iset
-                        video_filter = get_video_filter(r2.context)
-                        new_data = [
-                            PythonISetData(
-                                x.video, False,
-                                intervals=intersect_isetmap(
-                                    x.video, r2.data, x.intervals))
-                            for x in r1.data if video_filter(x.video)]
-                        curr_result = SearchResult(
-                            SearchResultType.python_iset,
-                            data=filter(lambda x: len(x.intervals) > 0,
-                                        new_data))
-                    else:
-                        raise UnreachableCode()
-
-                elif r1.type == SearchResultType.rust_iset:
-                    if r2.type == SearchResultType.rust_iset:
-                        # Result: rust_iset
-                        curr_result = SearchResult(
-                            SearchResultType.rust_iset,
-                            context=and_search_contexts(
-                                r1.context, r2.context),
-                            data=MmapISetIntersectionMapping(
-                                [r1.data, r2.data]))
-                    else:
-                        raise UnreachableCode()
-
-                else:
-                    raise UnreachableCode()
+                    # Only search the captions of the videos matched so far
+                    context = _push_down_videos(curr_result, context)
+                    if context is None:
+                        return None
+                    if trace is not None and context.videos is not None:
+                        trace.annotate(pushdown_videos=len(context.videos))
             return curr_result
         else:
             return SearchResult(SearchResultType.video_set, context=context)
 
+    def _search_children(
+            children: List[Any],
+            context: SearchContext,
+            memo: Optional[SearchMemo],
+            trace: Optional[SearchTrace]
+    ) -> List[Optional[SearchResult]]:
+        """Evaluate independent children, concurrently if possible"""
+        if trace is not None:   # the trace is not thread safe
+            return [_search_recursive(c, context, memo, trace)
+                    for c in children]
+        return _map_in_executor(
+            lambda c: _search_recursive(c, context, memo), children)
+
+    def _search_and_children(
+            children: List[Any],
+            context: SearchContext,
+            memo: Optional[SearchMemo],
+            trace: Optional[SearchTrace]
+    ) -> Optional[List[SearchResult]]:
+        """
+        Evaluate independent children of an AND, concurrently if possible.
+        Returns None as soon as any child matches nothing, and the children
+        that have not started yet are cancelled.
+        """
+        if trace is not None or _is_sequential(children):
+            child_results = []
+            for c in children:
+                child_result = _search_recursive(c, context, memo, trace)
+                if child_result is None:
+                    return None
+                child_results.append(child_result)
+            return child_results
+
+        def search_child(c: Any) -> Optional[SearchResult]:
+            return _search_recursive(c, context, memo)
+
+        futures = [
+            search_executor.submit(_run_in_executor, search_child, c)
+            for c in children]
+        try:
+            for future in as_completed(futures):
+                if future.result() is None:
+                    return None
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _and_search_results(
+            r1: SearchResult,
+            r2: SearchResult
+    ) -> Optional[SearchResult]:
+        """Intersect the results of two children of an AND"""
+        excludes_commercials = (
+            r1.excludes_commercials or r2.excludes_commercials)
+        # Symmetric cases
+        if (
+                r2.type == SearchResultType.video_set
+                or (r1.type != SearchResultType.video_set
+                    and r2.type == SearchResultType.python_iset)
+        ):
+            r1, r2 = r2, r1
+
+        if r1.type == SearchResultType.video_set:
+            if r2.type == SearchResultType.video_set:
+                # Result: video_set
+                new_context = and_search_contexts(
+                    r1.context, r2.context)
+                if new_context is None:
+                    return None
+                return r2._replace(context=new_context)
+            elif r2.type == SearchResultType.python_iset:
+                # Result: python_iset
+                video_filter = get_video_filter(
+                    video_data_context, r1.context)
+                if video_filter is None:
+                    return r2
+                return SearchResult(
+                    SearchResultType.python_iset,
+                    data=filter_python_iset(r2.data, video_filter),
+                    excludes_commercials=r2.excludes_commercials)
+            elif r2.type == SearchResultType.rust_iset:
+                # Result: rust_iset
+                new_context = and_search_contexts(
+                    r1.context, r2.context)
+                if new_context is None:
+                    return None
+                return r2._replace(context=new_context)
+            else:
+                raise UnreachableCode()
+
+        elif r1.type == SearchResultType.python_iset:
+            if r2.type == SearchResultType.python_iset:
+                # Result: python_iset
+                return SearchResult(
+                    SearchResultType.python_iset,
+                    data=and_python_isets(r1.data, r2.data),
+                    excludes_commercials=excludes_commercials)
+            elif r2.type == SearchResultType.rust_iset:
+                # Result: python_iset
+                return SearchResult(
+                    SearchResultType.python_iset,
+                    data=and_python_iset_with_rust_iset(
+                        r1.data, r2.data,
+                        get_video_filter(video_data_context, r2.context)),
+                    excludes_commercials=excludes_commercials)
+            else:
+                raise UnreachableCode()
+
+        elif r1.type == SearchResultType.rust_iset:
+            if r2.type == SearchResultType.rust_iset:
+                # Result: rust_iset
+                new_context = and_search_contexts(r1.context, r2.context)
+                if new_context is None:
+                    return None
+                return SearchResult(
+                    SearchResultType.rust_iset, context=new_context,
+                    data=MmapISetIntersectionMapping([r1.data, r2.data]),
+                    excludes_commercials=excludes_commercials)
+            else:
+                raise UnreachableCode()
+
+        raise UnreachableCode()
+
     def _search_or(
             children: Iterable[Any],
-            context: SearchContext
+            context: SearchContext,
+            memo: Optional[SearchMemo],
+            trace: Optional[SearchTrace]
     ) -> Optional[SearchResult]:
         # First, collect the child results with type video_set
         child_results = []
@@ -946,7 +1597,7 @@ def add_search_routes(
                     or kc == SearchKey.show or kc == SearchKey.hour
                     or kc == SearchKey.day_of_week
             ):
-                child_result = _search_recursive(c, context)
+                child_result = _search_recursive(c, context, memo, trace)
                 if child_result is not None:
                     child_results.append(child_result)
             elif kc == SearchKey.text_window:
@@ -958,7 +1609,8 @@ def add_search_routes(
         child_video_filters = []
         for c in child_results:
             assert c.type == SearchResultType.video_set, c.type
-            child_video_filter = get_video_filter(c.context)
+            child_video_filter = get_video_set_filter(
+                video_data_context, c.context)
             if child_video_filter is None:
                 # One of the children is "everything"
                 return c
@@ -966,14 +1618,23 @@ def add_search_routes(
 
         curr_result = None
         if child_video_filters:
+            # Result: video_set (union of the precomputed masks)
             curr_result = SearchResult(
-                SearchResultType.python_iset,
-                data=get_python_iset_from_filter(
-                    video_data_context,
-                    lambda v: any(f(v) for f in child_video_filters)))
-
-        for c in deferred_children:
-            child_result = _search_recursive(c, context)
+                SearchResultType.video_set,
+                context=context._replace(
+                    video_filter=reduce(operator.or_, child_video_filters)))
+
+        # Cheapest children first, so that the partial unions stay small
+        plan = sorted(
+            ((_estimate_cost(c), c) for c in deferred_children),
+            key=lambda x: x[0])
+        if trace is not None:
+            trace.annotate(plan=[
+                {'query': c, 'estimated_cost': cost} for cost, c in plan])
+
+        for child_result in _search_children(
+                [c for _, c in plan], context, memo, trace
+        ):
             if child_result is None:
                 continue
             if curr_result is None:
@@ -982,6 +1643,8 @@ def add_search_routes(
 
             r1 = curr_result
             r2 = child_result
+            excludes_commercials = (
+                r1.excludes_commercials and r2.excludes_commercials)
 
             # Symmetric cases
             if (
@@ -992,23 +1655,24 @@ def add_search_routes(
                 r1, r2 = r2, r1
 
             if r1.type == SearchResultType.video_set:
-                r1_filter = get_video_filter(r1.context)
+                r1_filter = get_video_set_filter(
+                    video_data_context, r1.context)
                 if r1_filter is None:
                     # R1 is "everything"
                     return r1
 
-                elif r2.type != SearchResultType.video_set:
-                    r2_filter = get_video_filter(r2.context)
+                elif r2.type == SearchResultType.video_set:
+                    r2_filter = get_video_set_filter(
+                        video_data_context, r2.context)
                     if r2_filter is None:
                         # R2 is "everything"
                         return r2
                     else:
-                        # Return: python_iset
+                        # Return: video_set
                         curr_result = SearchResult(
-                            SearchResultType.python_iset,
-                            data=get_python_iset_from_filter(
-                                video_data_context,
-                                lambda v: r1_filter(v) or r2_filter(v)))
+                            SearchResultType.video_set,
+                            context=context._replace(
+                                video_filter=r1_filter | r2_filter))
                 elif r2.type == SearchResultType.python_iset:
                     # Return: python_iset
                     curr_result = SearchResult(
@@ -1033,12 +1697,14 @@ def add_search_routes(
                 if r2.type == SearchResultType.python_iset:
                     curr_result = SearchResult(
                         SearchResultType.python_iset,
-                        data=or_python_isets(r1, r2))
+                        data=or_python_isets(r1.data, r2.data),
+                        excludes_commercials=excludes_commercials)
                 elif r2.type == SearchResultType.rust_iset:
                     curr_result = SearchResult(
                         SearchResultType.python_iset,
                         data=or_python_iset_with_rust_iset(
-                            video_data_context, r1, r2))
+                            video_data_context, r1, r2),
+                        excludes_commercials=excludes_commercials)
                 else:
                     raise UnreachableCode()
 
@@ -1047,7 +1713,8 @@ def add_search_routes(
                     # Return: python_iset
                     curr_result = SearchResult(
                         SearchResultType.python_iset,
-                        data=or_rust_isets(video_data_context, r1, r2))
+                        data=or_rust_isets(video_data_context, r1, r2),
+                        excludes_commercials=excludes_commercials)
                 else:
                     raise UnreachableCode()
 
@@ -1057,27 +1724,66 @@ def add_search_routes(
 
     def _search_recursive(
             query: Any,
-            context: SearchContext
+            context: SearchContext,
+            memo: Optional[SearchMemo] = None,
+            trace: Optional[SearchTrace] = None
+    ) -> Optional[SearchResult]:
+        def search_fn() -> Optional[SearchResult]:
+            if memo is not None:
+                return memo.search(
+                    query, context,
+                    lambda: _search_node(query, context, memo, trace))
+            return _search_node(query, context, memo, trace)
+
+        if trace is None:
+            return search_fn()
+        with trace.node(query):
+            result = search_fn()
+            trace.annotate(
+                result_type=None if result is None else result.type.name)
+        return result
+
+    def _search_node(
+            query: Any,
+            context: SearchContext,
+            memo: Optional[SearchMemo],
+            trace: Optional[SearchTrace]
     ) -> Optional[SearchResult]:
         k, v = query
         if k == 'all':
             return SearchResult(SearchResultType.video_set, context=context)
 
-        elif k == 'or':
-            return _search_or(v, context)
+        if context.exclude_commercials:
+            isetmap = get_non_commercial_intervals(video_data_context, k, v)
+            if isetmap is not None:
+                rollup = None
+                if k == SearchKey.face_name:
+                    rollup = get_face_name_rollup(
+                        video_data_context, v.lower())
+                elif k == SearchKey.face_tag:
+                    rollup = get_face_tag_rollup(
+                        video_data_context, v.lower())
+                return SearchResult(
+                    SearchResultType.rust_iset, context=context, data=isetmap,
+                    rollup=rollup, excludes_commercials=True)
+
+        if k == 'or':
+            return _search_or(v, context, memo, trace)
 
         elif k == 'and':
-            return _search_and(v, context)
+            return _search_and(v, context, memo, trace)
 
         elif k == SearchKey.face_name:
             return SearchResult(
                 SearchResultType.rust_iset, context=context,
-                data=get_face_name_intervals(video_data_context, v.lower()))
+                data=get_face_name_intervals(video_data_context, v.lower()),
+                rollup=get_face_name_rollup(video_data_context, v.lower()))
 
         elif k == SearchKey.face_tag:
             return SearchResult(
                 SearchResultType.rust_iset, context=context,
-                data=get_face_tag_intervals(video_data_context, v.lower()))
+                data=get_face_tag_intervals(video_data_context, v.lower()),
+                rollup=get_face_tag_rollup(video_data_context, v.lower()))
 
         elif k == SearchKey.face_count:
             return SearchResult(
@@ -1085,6 +1791,11 @@ def add_search_routes(
                 data=get_face_count_intervals(video_data_context, int(v)))
 
         elif k == SearchKey.text:
+            text_iset = get_derived_text_intervals(
+                caption_data_context, video_data_context, v, context)
+            if text_iset is not None:
+                return SearchResult(
+                    SearchResultType.python_iset, data=text_iset)
             return SearchResult(
                 SearchResultType.python_iset,
                 data=get_caption_intervals(
@@ -1143,15 +1854,182 @@ def add_search_routes(
 
         raise UnreachableCode()
 
+    def _get_video_values(
+            search_result: Optional[SearchResult],
+            is_commercial: Ternary
+    ) -> Generator[Tuple[Video, float], None, None]:
+        """Yield the matched seconds in each video"""
+        if search_result is not None and search_result.rollup is not None:
+            rows, ms = _get_rollup_values(search_result, is_commercial)
+            for row, value in zip(rows.tolist(), (ms / 1000).tolist()):
+                yield video_data_context.video_table.videos[row], value
+        elif search_result is not None:
+            for data in iter_search_result_chunks(
+                    video_data_context, search_result
+            ):
+                for video, intervals in iter_python_iset(
+                        video_data_context, data
+                ):
+                    if not search_result.excludes_commercials:
+                        intervals = join_intervals_with_commercials(
+                            video_data_context, video, intervals,
+                            is_commercial)
+                    if len(intervals) > 0:
+                        yield video, intervals_duration(intervals) / 1000
+
+    def _get_rollup_values(
+            search_result: SearchResult,
+            is_commercial: Ternary
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows of the matched videos and their precomputed milliseconds"""
+        rows, ms = search_result.rollup.get(
+            video_data_context.video_table, is_commercial)
+        keep = ms > 0
+        video_filter = get_video_filter(
+            video_data_context, search_result.context)
+        if video_filter is not None:
+            keep &= video_filter.mask[rows]
+        return rows[keep], ms[keep]
+
+    def _accumulate(
+            search_result: Optional[SearchResult],
+            is_commercial: Ternary,
+            accumulator: DateAccumulator
+    ) -> None:
+        if (
+                search_result is not None
+                and search_result.rollup is not None
+                and isinstance(accumulator, SimpleDateAccumulator)
+        ):
+            # Sum the precomputed totals by date, then add each date once
+            rows, ms = _get_rollup_values(search_result, is_commercial)
+            table = video_data_context.video_table
+            _, first_idxs, inverse = np.unique(
+                table.date[rows], return_index=True, return_inverse=True)
+            date_ms = np.bincount(inverse, weights=ms)
+            for i, value_ms in zip(first_idxs.tolist(), date_ms.tolist()):
+                video = table.videos[rows[i]]
+                accumulator.add(video.date, video.id, value_ms / 1000)
+        else:
+            for video, value in _get_video_values(
+                    search_result, is_commercial
+            ):
+                accumulator.add(video.date, video.id, value)
+
+    def _search_and_accumulate(
+            query: Any,
+            context: SearchContext,
+            is_commercial: Ternary,
+            aggregate_fn: AggregateFn,
+            accumulator: DateAccumulator,
+            memo: Optional[SearchMemo] = None
+    ) -> None:
+        """Search and accumulate each shard of the videos in parallel"""
+        if not search_shard_filters:
+            _accumulate(_search_recursive(query, context, memo),
+                        is_commercial, accumulator)
+            return
+
+        def search_shard(shard_filter: VideoFilter) -> DateAccumulator:
+            shard_accumulator = type(accumulator)(aggregate_fn)
+            shard_context = context._replace(shard_filter=shard_filter)
+            _accumulate(_search_recursive(query, shard_context, memo),
+                        is_commercial, shard_accumulator)
+            return shard_accumulator
+
+        # Shards are in video id order, as are the values of each shard
+        for shard_accumulator in _map_in_executor(
+                search_shard, search_shard_filters
+        ):
+            accumulator.merge(shard_accumulator)
+
+    def _stream_search(
+            search_result: Optional[SearchResult],
+            is_commercial: Ternary,
+            accumulator: DateAccumulator
+    ) -> Generator[JsonObject, None, None]:
+        """Yield the chunks of the accumulator as values are added"""
+        for video, value in _get_video_values(search_result, is_commercial):
+            accumulator.add(video.date, video.id, value)
+            yield from accumulator.pop_chunks()
+        for k, v in accumulator.get().items():
+            yield {k: v}
+
+    def _search_compound(
+            query: JsonObject,
+            context: SearchContext,
+            is_commercial: Ternary,
+            aggregate_fn: AggregateFn,
+            accumulator: DateAccumulator
+    ) -> JsonObject:
+        """Evaluate the operands of a compound query and combine them"""
+        operands = {k: v or ['all', None] for k, v in query.items()}
+        memo = SearchMemo(operands.values())
+
+        def accumulate(operand: Any, acc: DateAccumulator) -> None:
+            _search_and_accumulate(
+                operand, context, is_commercial, aggregate_fn, acc, memo)
+
+        accumulate(operands.get(QueryOperand.main, ['all', None]),
+                   accumulator)
+        if QueryOperand.add in operands:
+            accumulate(operands[QueryOperand.add], accumulator)
+
+        normalize_accumulator = None
+        if QueryOperand.normalize in operands:
+            normalize_accumulator = SimpleDateAccumulator(aggregate_fn)
+            accumulate(operands[QueryOperand.normalize],
+                       normalize_accumulator)
+
+        subtract_accumulator = None
+        if QueryOperand.subtract in operands:
+            subtract_accumulator = SimpleDateAccumulator(aggregate_fn)
+            accumulate(operands[QueryOperand.subtract], subtract_accumulator)
+
+        return CompoundDateAccumulator(
+            accumulator, normalize_accumulator, subtract_accumulator).get()
+
+    def _explain_search(
+            query: Any,
+            context: SearchContext,
+            is_commercial: Ternary,
+            accumulator: DateAccumulator
+    ) -> JsonObject:
+        """Evaluate a query and report the plan and where time was spent"""
+        trace = SearchTrace()
+        start_time = time.perf_counter()
+        search_result = _search_recursive(query, context, trace=trace)
+        search_time = time.perf_counter()
+        num_videos = 0
+        for video, value in _get_video_values(search_result, is_commercial):
+            accumulator.add(video.date, video.id, value)
+            num_videos += 1
+        end_time = time.perf_counter()
+        return {
+            'plan': trace.get(),
+            'num_videos': num_videos,
+            'time_ms': {
+                # Face intervals are evaluated lazily, during accumulation
+                'search': round((search_time - start_time) * 1000, 3),
+                'accumulate': round((end_time - search_time) * 1000, 3)
+            }
+        }
+
     @app.route('/search')
     def search() -> Response:
+        """
+        Count the time matched by a query in each date bucket.
+
+        With format=ndjson, detailed results are streamed as one JSON object
+        per line, mapping a date to a list of [video id, value] pairs. Lines
+        are in video id order and hold at most 1000 pairs, so the same date
+        can appear on more than one line; clients should concatenate the
+        lists of a date. Simple (detailed=false) results are streamed as one
+        line per date. Streamed results are neither cached nor sharded, since
+        they are sent as the videos are visited.
+        """
         aggregate_fn = get_aggregate_fn(default_aggregate_by)
-
-        accumulator = (
-            DetailedDateAccumulator(aggregate_fn)
-            if request.args.get(
-                SearchParam.detailed, 'true', type=str
-            ) == 'true' else SimpleDateAccumulator(aggregate_fn))
+        response_format = get_response_format()
 
         query_str = request.args.get(SearchParam.query, type=str)
         if query_str:
@@ -1159,38 +2037,147 @@ def add_search_routes(
         else:
             query = ['all', None]
 
+        # Also validates the query tree, before any of it is evaluated
+        query_key = json.dumps(canonicalize_query(query))
+
+        is_compound = isinstance(query, dict)
+        if is_compound:
+            # Compound results are always sent as JSON
+            response_format = ResponseFormat.json
+
+        detailed = request.args.get(
+            SearchParam.detailed, 'true', type=str) == 'true'
+        if not detailed:
+            if response_format == ResponseFormat.binary:
+                # Simple results are small, so always send them as JSON
+                response_format = ResponseFormat.json
+            accumulator = SimpleDateAccumulator(aggregate_fn)
+        elif response_format == ResponseFormat.ndjson:
+            accumulator = StreamingDetailedDateAccumulator(aggregate_fn)
+        elif response_format == ResponseFormat.binary:
+            accumulator = BinaryDetailedDateAccumulator(aggregate_fn)
+        else:
+            accumulator = DetailedDateAccumulator(aggregate_fn)
+
         start_date = parse_date(
             request.args.get(SearchParam.start_date, None, type=str))
         end_date = parse_date(
             request.args.get(SearchParam.end_date, None, type=str))
 
         is_commercial = _get_is_commercial()
+        context = SearchContext(
+            start_date=start_date, end_date=end_date,
+            text_window=default_text_window,
+            exclude_commercials=is_commercial == Ternary.false)
+
+        if request.args.get(SearchParam.explain, 'false', type=str) == 'true':
+            if is_compound:
+                raise InvalidUsage(
+                    '"{}" cannot be used with compound queries'.format(
+                        SearchParam.explain))
+            return jsonify(_explain_search(
+                query, context, is_commercial, accumulator))
+
+        cache_key = None
+        if (
+                search_cache.enabled
+                and response_format != ResponseFormat.ndjson
+        ):
+            cache_key = (
+                data_version,
+                query_key,
+                request.args.get(SearchParam.aggregate, None, type=str)
+                or str(default_aggregate_by),
+                start_date, end_date, detailed, is_commercial.value,
+                response_format.value)
+            cached_value = search_cache.get(cache_key)
+            if cached_value is not None:
+                cached_body, cached_mimetype = cached_value
+                resp = Response(cached_body, mimetype=cached_mimetype)
+                resp.vary.add('Accept')
+                return resp
+
+        if is_compound:
+            resp = jsonify(_search_compound(
+                query, context, is_commercial, aggregate_fn, accumulator))
+            resp.vary.add('Accept')
+            if cache_key is not None:
+                search_cache.put(cache_key, (resp.get_data(), resp.mimetype))
+            return resp
+
+        if response_format == ResponseFormat.ndjson:
+            return ndjson_response(_stream_search(
+                _search_recursive(query, context), is_commercial,
+                accumulator))
+
+        _search_and_accumulate(
+            query, context, is_commercial, aggregate_fn, accumulator)
+
+        if response_format == ResponseFormat.binary:
+            resp = Response(accumulator.get_bytes(), mimetype=BINARY_MIMETYPE)
+        else:
+            resp = jsonify(accumulator.get())
+        resp.vary.add('Accept')
+        if cache_key is not None:
+            search_cache.put(cache_key, (resp.get_data(), resp.mimetype))
+        return resp
+
+    @app.route('/search-batch')
+    def search_batch() -> Response:
+        aggregate_fn = get_aggregate_fn(default_aggregate_by)
 
-        search_result = _search_recursive(
-            query, SearchContext(
-                start_date=start_date, end_date=end_date,
-                text_window=default_text_window))
-
-        if search_result is not None:
-            def helper(video: Video, intervals: List[Interval]) -> None:
-                intervals = join_intervals_with_commercials(
-                    video_data_context, video, intervals, is_commercial)
-                if intervals:
-                    accumulator.add(
-                        video.date, video.id,
-                        sum(i[1] - i[0] for i in intervals) / 1000)
-
-            for data in search_result_to_python_iset(
-                    video_data_context, search_result
-            ):
-                if data.is_entire_video:
-                    intervals = get_entire_video_ms_interval(data.video)
-                else:
-                    assert data.intervals is not None
-                    intervals = data.intervals
-                helper(data.video, intervals)
+        batch_str = request.args.get(SearchParam.queries, None, type=str)
+        if not batch_str:
+            raise InvalidUsage('must specify queries')
+        batch = json.loads(batch_str)
+        if not isinstance(batch, list):
+            raise InvalidUsage('queries must be a list')
+        if len(batch) > MAX_BATCH_SEARCH_QUERIES:
+            raise QueryTooExpensive('Too many queries specified')
+
+        default_detailed = request.args.get(
+            SearchParam.detailed, 'true', type=str) == 'true'
+        start_date = parse_date(
+            request.args.get(SearchParam.start_date, None, type=str))
+        end_date = parse_date(
+            request.args.get(SearchParam.end_date, None, type=str))
+        is_commercial = _get_is_commercial()
+
+        queries = []
+        detailed = []
+        for b in batch:
+            if not isinstance(b, dict):
+                raise InvalidUsage('each query must be an object')
+            query = b.get(SearchParam.query)
+            if query is not None and not isinstance(query, list):
+                raise InvalidUsage('"{}" must be a list'.format(
+                    SearchParam.query))
+            queries.append(query or ['all', None])
+            b_detailed = b.get(SearchParam.detailed, default_detailed)
+            if not isinstance(b_detailed, bool):
+                raise InvalidUsage('"{}" must be a boolean'.format(
+                    SearchParam.detailed))
+            detailed.append(b_detailed)
+        memo = SearchMemo(queries)
 
-        return jsonify(accumulator.get())
+        results = []
+        for query, b_detailed in zip(queries, detailed):
+            accumulator = (
+                DetailedDateAccumulator(aggregate_fn) if b_detailed
+                else SimpleDateAccumulator(aggregate_fn))
+            search_result = _search_recursive(
+                query, SearchContext(
+                    start_date=start_date, end_date=end_date,
+                    text_window=default_text_window,
+                    exclude_commercials=is_commercial == Ternary.false),
+                memo)
+            _accumulate(search_result, is_commercial, accumulator)
+            results.append(accumulator.get())
+        return jsonify(results)
+
+    @app.route('/search-cache')
+    def get_search_cache_stats() -> Response:
+        return jsonify(search_cache.stats())
 
     def _video_name_or_id(v: str) -> str:
         try:
@@ -1200,7 +2187,6 @@ def add_search_routes(
             return v
 
     def _get_entire_video(video: Video) -> JsonObject:
-        document = caption_data_context.document_by_name.get(video.name)
         return {
             'metadata': get_video_metadata_json(video),
             'intervals': [(0, video.num_frames)],
@@ -1222,38 +2208,40 @@ def add_search_routes(
             query = ['all', None]
 
         is_commercial = _get_is_commercial()
+        response_format = get_response_format()
 
-        results = []
-
-        def collect(video: Video, intervals: List[Interval]) -> None:
-            intervals = join_intervals_with_commercials(
-                video_data_context, video, intervals, is_commercial)
-            if intervals:
-                results.append({
-                    'metadata': get_video_metadata_json(video),
-                    'intervals': list(merge_close_intervals(
-                        (i[0] / 1000, i[1] / 1000) for i in intervals
-                    ))
-                })
+        def get_results() -> Generator[JsonObject, None, None]:
+            if search_result is None:
+                return
+            for video, intervals in iter_python_iset(
+                    video_data_context,
+                    search_result_to_python_iset(
+                        video_data_context, search_result)
+            ):
+                assert video.id in video_ids, \
+                    'Unexpected video {}, not in {}'.format(
+                        video.id, video_ids)
+                if not search_result.excludes_commercials:
+                    intervals = join_intervals_with_commercials(
+                        video_data_context, video, intervals, is_commercial)
+                if len(intervals) > 0:
+                    yield {
+                        'metadata': get_video_metadata_json(video),
+                        'intervals': [
+                            (a / 1000, b / 1000) for a, b in merge_intervals(
+                                intervals, MERGE_RESULT_INTERVALS_MS
+                            ).tolist()]
+                    }
 
         search_result = _search_recursive(
             query, SearchContext(
-                videos=video_ids, text_window=default_text_window))
+                videos=video_ids, text_window=default_text_window,
+                exclude_commercials=is_commercial == Ternary.false))
 
-        if search_result is not None:
-            for data in search_result_to_python_iset(
-                    video_data_context, search_result
-            ):
-                assert data.video.id in video_ids, \
-                    'Unexpected video {}, not in {}'.format(
-                        data.video.id, video_ids)
-                if data.is_entire_video:
-                    intervals = get_entire_video_ms_interval(data.video)
-                else:
-                    assert data.intervals is not None
-                    intervals = data.intervals
-                collect(data.video, intervals)
+        if response_format == ResponseFormat.ndjson:
+            return ndjson_response(get_results())
 
+        results = list(get_results())
         assert len(results) <= len(video_ids), \
             'Expected {} results, got {}'.format(len(video_ids), len(results))
         return jsonify(results)
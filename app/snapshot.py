@@ -0,0 +1,137 @@
+"""
+Snapshot of the metadata that is slow to load from its sources (generated by
+derive_data.py): the videos, the total screen time of each person, person
+tags and hosts.
+"""
+
+import json
+import os
+import zlib
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Set
+
+import numpy as np
+
+from .types_backend import Video, Tag
+
+
+# In data/derived
+METADATA_SNAPSHOT_FILE = 'metadata.npz'
+
+
+class MetadataSnapshot(NamedTuple):
+    source_fingerprint: str             # of the sources when it was derived
+    timezone: str                       # of the video dates and hours
+    videos: Dict[str, Video]
+    person_screen_time: Dict[str, float]    # by person file prefix
+    person_tags: Dict[str, List[Tag]]       # by lowercase name
+    hosts: Dict[str, Set[str]]              # channels of each host
+
+
+def save_snapshot(fname: str, snapshot: MetadataSnapshot) -> None:
+    videos = list(snapshot.videos.values())
+    shows, show_codes = np.unique(
+        [v.show for v in videos], return_inverse=True)
+    channels, channel_codes = np.unique(
+        [v.channel for v in videos], return_inverse=True)
+    people = sorted(snapshot.person_screen_time)
+
+    tmp_fname = fname + '.tmp'
+    with open(tmp_fname, 'wb') as f:
+        np.savez(
+            f,
+            source_fingerprint=np.array(snapshot.source_fingerprint),
+            timezone=np.array(snapshot.timezone),
+            video_keys=np.array(list(snapshot.videos), dtype=str),
+            video_names=np.array([v.name for v in videos], dtype=str),
+            video_ids=np.array([v.id for v in videos], dtype=np.int64),
+            shows=shows.astype(str),
+            video_shows=show_codes.astype(np.int32),
+            channels=channels.astype(str),
+            video_channels=channel_codes.astype(np.int32),
+            video_dates=np.array(
+                [v.date.toordinal() for v in videos], dtype=np.int32),
+            video_hours=np.array([v.hour for v in videos], dtype=np.int16),
+            video_num_frames=np.array(
+                [v.num_frames for v in videos], dtype=np.int64),
+            video_fps=np.array([v.fps for v in videos], dtype=np.float64),
+            video_widths=np.array([v.width for v in videos], dtype=np.int32),
+            video_heights=np.array(
+                [v.height for v in videos], dtype=np.int32),
+            person_names=np.array(people, dtype=str),
+            person_screen_time=np.array(
+                [snapshot.person_screen_time[p] for p in people],
+                dtype=np.float64),
+            person_tags=np.array(json.dumps(snapshot.person_tags)),
+            hosts=np.array(json.dumps(
+                {k: sorted(v) for k, v in snapshot.hosts.items()})))
+    os.replace(tmp_fname, fname)
+
+
+def load_snapshot(fname: str) -> MetadataSnapshot:
+    with np.load(fname) as f:
+        shows = f['shows'].tolist()
+        channels = f['channels'].tolist()
+        videos = {}
+        for (
+                key, name, vid, show, channel, date, hour, num_frames, fps,
+                width, height
+        ) in zip(
+                f['video_keys'].tolist(), f['video_names'].tolist(),
+                f['video_ids'].tolist(), f['video_shows'].tolist(),
+                f['video_channels'].tolist(), f['video_dates'].tolist(),
+                f['video_hours'].tolist(), f['video_num_frames'].tolist(),
+                f['video_fps'].tolist(), f['video_widths'].tolist(),
+                f['video_heights'].tolist()
+        ):
+            date = datetime.fromordinal(date)
+            videos[key] = Video(
+                id=vid, name=name, show=shows[show],
+                channel=channels[channel], date=date,
+                dayofweek=date.isoweekday(), hour=hour,
+                num_frames=num_frames, fps=fps, width=width, height=height)
+        return MetadataSnapshot(
+            source_fingerprint=(
+                str(f['source_fingerprint'])
+                if 'source_fingerprint' in f.files else ''),
+            timezone=str(f['timezone']),
+            videos=videos,
+            person_screen_time=dict(zip(
+                f['person_names'].tolist(),
+                f['person_screen_time'].tolist())),
+            person_tags={
+                k: [Tag(*t) for t in v]
+                for k, v in json.loads(str(f['person_tags'])).items()},
+            hosts={
+                k: set(v) for k, v in json.loads(str(f['hosts'])).items()})
+
+
+def is_snapshot_fresh(fname: str, source_paths: List[str]) -> bool:
+    """Whether the snapshot is newer than all of its (existing) sources"""
+    if not os.path.isfile(fname):
+        return False
+    mtime = os.path.getmtime(fname)
+    return all(
+        os.path.getmtime(p) <= mtime for p in source_paths
+        if os.path.exists(p))
+
+
+def get_source_fingerprint(source_paths: List[str]) -> str:
+    """
+    Sizes and modification times of the (existing) sources, and of the files
+    in the sources that are directories
+    """
+    fingerprint = 0
+    for i, source_path in enumerate(source_paths):
+        if os.path.isdir(source_path):
+            fnames = sorted(os.listdir(source_path))
+        else:
+            fnames = ['']
+        for fname in fnames:
+            fpath = os.path.join(source_path, fname) if fname else source_path
+            if os.path.isfile(fpath):
+                stat = os.stat(fpath)
+                fingerprint = zlib.crc32('{}:{}:{}:{};'.format(
+                    i, fname, stat.st_size, stat.st_mtime_ns
+                ).encode(), fingerprint)
+    return '{:08x}'.format(fingerprint)
@@ -2,9 +2,12 @@
 Classes for accumulating results
 """
 
+import struct
+import sys
 from abc import abstractmethod
+from array import array
 from datetime import datetime
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional
 
 from .types_backend import AggregateFn, Number, JsonObject
 from .parsing import format_date
@@ -24,6 +27,20 @@ class DateAccumulator:
     def get(self) -> JsonObject:
         pass
 
+    def pop_chunks(self) -> List[JsonObject]:
+        """Return and forget values that can be released before get()"""
+        return []
+
+    @abstractmethod
+    def get_totals(self) -> Dict[str, Number]:
+        """Return the total value in each date bucket"""
+        pass
+
+    @abstractmethod
+    def merge(self, other: 'DateAccumulator') -> None:
+        """Add the values of an accumulator over later video ids"""
+        pass
+
 
 class DetailedDateAccumulator(DateAccumulator):
     Value = Tuple[int, Number]
@@ -42,6 +59,17 @@ class DetailedDateAccumulator(DateAccumulator):
     def get(self) -> JsonObject:
         return self._values
 
+    def get_totals(self) -> Dict[str, Number]:
+        return {k: sum(x[1] for x in v) for k, v in self._values.items()}
+
+    def merge(self, other: DateAccumulator) -> None:
+        assert isinstance(other, DetailedDateAccumulator)
+        for k, v in other._values.items():
+            if k not in self._values:
+                self._values[k] = v
+            else:
+                self._values[k].extend(v)
+
 
 class SimpleDateAccumulator(DateAccumulator):
 
@@ -59,3 +87,164 @@ class SimpleDateAccumulator(DateAccumulator):
 
     def get(self) -> JsonObject:
         return self._values
+
+    def get_totals(self) -> Dict[str, Number]:
+        return self._values
+
+    def merge(self, other: DateAccumulator) -> None:
+        assert isinstance(other, SimpleDateAccumulator)
+        for k, v in other._values.items():
+            if k not in self._values:
+                self._values[k] = v
+            else:
+                self._values[k] += v
+
+
+class StreamingDetailedDateAccumulator(DateAccumulator):
+    """
+    Detailed accumulator that releases its values in chunks as they are
+    added, instead of holding all of them until the end. Consecutive values
+    in the same date bucket are grouped into one chunk, so the same date can
+    appear in more than one chunk.
+    """
+    Value = Tuple[int, Number]
+
+    def __init__(self, aggregate_fn: AggregateFn, max_chunk_len: int = 1000):
+        self._chunks: List[JsonObject] = []
+        self._key: Optional[str] = None
+        self._values: List['StreamingDetailedDateAccumulator.Value'] = []
+        self._totals: Dict[str, Number] = {}    # including released values
+        self._aggregate_fn = aggregate_fn
+        self._max_chunk_len = max_chunk_len
+
+    def _flush(self) -> None:
+        if self._values:
+            self._chunks.append({self._key: self._values})
+            self._values = []
+
+    def add(self, date: datetime, video_id: int, value: Number) -> None:
+        if value > 0:
+            key = format_date(self._aggregate_fn(date))
+            if key != self._key or len(self._values) >= self._max_chunk_len:
+                self._flush()
+                self._key = key
+            self._values.append((video_id, value))
+            self._totals[key] = self._totals.get(key, 0) + value
+
+    def pop_chunks(self) -> List[JsonObject]:
+        chunks = self._chunks
+        self._chunks = []
+        return chunks
+
+    def merge(self, other: DateAccumulator) -> None:
+        assert isinstance(other, StreamingDetailedDateAccumulator)
+        self._flush()
+        self._chunks.extend(other._chunks)
+        self._key = other._key
+        self._values = other._values
+        for k, v in other._totals.items():
+            self._totals[k] = self._totals.get(k, 0) + v
+
+    def get_totals(self) -> Dict[str, Number]:
+        return self._totals
+
+    def get(self) -> JsonObject:
+        """Return the final (incomplete) chunk"""
+        values = self._values
+        self._values = []
+        return {self._key: values} if values else {}
+
+
+class BinaryDetailedDateAccumulator(DateAccumulator):
+    """
+    Detailed accumulator that stores values in typed arrays and encodes
+    them as a compact binary payload.
+
+    Payload (little-endian): uint32 number of dates, then for each date a
+    12 byte NUL-padded ASCII date, uint32 count n, n uint32 video ids, and
+    n float32 values. All sections are 4-byte aligned.
+    """
+    DATE_LEN = 12
+
+    def __init__(self, aggregate_fn: AggregateFn):
+        self._ids: Dict[str, array] = {}
+        self._values: Dict[str, array] = {}
+        self._aggregate_fn = aggregate_fn
+
+    def add(self, date: datetime, video_id: int, value: Number) -> None:
+        if value > 0:
+            key = format_date(self._aggregate_fn(date))
+            if key not in self._ids:
+                self._ids[key] = array('I')
+                self._values[key] = array('f')
+            self._ids[key].append(video_id)
+            self._values[key].append(value)
+
+    def get(self) -> JsonObject:
+        return {k: list(zip(ids, self._values[k]))
+                for k, ids in self._ids.items()}
+
+    def get_totals(self) -> Dict[str, Number]:
+        return {k: sum(v) for k, v in self._values.items()}
+
+    def merge(self, other: DateAccumulator) -> None:
+        assert isinstance(other, BinaryDetailedDateAccumulator)
+        for k, ids in other._ids.items():
+            if k not in self._ids:
+                self._ids[k] = ids
+                self._values[k] = other._values[k]
+            else:
+                self._ids[k].extend(ids)
+                self._values[k].extend(other._values[k])
+
+    def get_bytes(self) -> bytes:
+        chunks = [struct.pack('<I', len(self._ids))]
+        for k, ids in self._ids.items():
+            values = self._values[k]
+            if sys.byteorder != 'little':
+                ids = array('I', ids)
+                ids.byteswap()
+                values = array('f', values)
+                values.byteswap()
+            chunks.append(struct.pack(
+                '<{}sI'.format(self.DATE_LEN), k.encode('ascii'), len(ids)))
+            chunks.append(ids.tobytes())
+            chunks.append(values.tobytes())
+        return b''.join(chunks)
+
+
+class CompoundDateAccumulator(object):
+    """
+    Combines the operands of a compound query (ADD, SUBTRACT, NORMALIZE)
+    into a final series.
+
+    The main accumulator also receives the values of the added query. The
+    final value of each date is (main - subtract) / normalize, where dates
+    without a normalization value are omitted.
+    """
+
+    def __init__(
+            self,
+            main: DateAccumulator,
+            normalize: Optional[SimpleDateAccumulator],
+            subtract: Optional[SimpleDateAccumulator]
+    ):
+        self._main = main
+        self._normalize = normalize
+        self._subtract = subtract
+
+    def get(self) -> JsonObject:
+        totals = dict(self._main.get_totals())
+        result = {'main': self._main.get()}
+        if self._subtract is not None:
+            subtract = self._subtract.get()
+            for k, v in subtract.items():
+                totals[k] = totals.get(k, 0) - v
+            result['subtract'] = subtract
+        if self._normalize is not None:
+            normalize = self._normalize.get()
+            totals = {k: v / normalize[k] for k, v in totals.items()
+                      if normalize.get(k)}
+            result['normalize'] = normalize
+        result['values'] = totals
+        return result
@@ -3,7 +3,7 @@ Data types used by the backend server.
 """
 
 from datetime import datetime
-from typing import Callable, Dict, List, Tuple, NamedTuple, Union
+from typing import Callable, Dict, List, Tuple, NamedTuple, Optional, Union
 
 
 class Video(NamedTuple):
@@ -40,6 +40,8 @@ class PersonIntervals(NamedTuple):
     ilistmap: 'MmapIntervalListMapping'
     isetmap: 'MmapIntervalSetMapping'
     screen_time_seconds: float
+    rollup: Optional['ScreenTimeRollup'] = None   # if isetmap is derived
+    non_commercial_isetmap: Optional['MmapIntervalSetMapping'] = None
 
 
 class Tag(NamedTuple):
@@ -86,5 +88,4 @@ Interval = Tuple[Number, Number]
 Caption = Tuple[float, float, str]
 JsonObject = Dict[str, object]
 
-VideoFilterFn = Callable[[Video], bool]
 AggregateFn = Callable[[datetime], datetime]
@@ -12,6 +12,12 @@ class Aggregate(Enum):
     year = 'year'
 
 
+class ResponseFormat(Enum):
+    json = 'json'
+    ndjson = 'ndjson'       # newline delimited chunks, streamed
+    binary = 'binary'       # packed arrays (detailed results only)
+
+
 class Ternary(Enum):
     true = 'true'
     false = 'false'
@@ -42,8 +48,19 @@ class SearchParam:
     is_commercial = 'is_commercial'
 
     query = 'query'
+    queries = 'queries'
     video_ids = 'ids'
 
+    format = 'format'
+    explain = 'explain'
+
+
+class QueryOperand:
+    main = 'main'
+    add = 'add'
+    normalize = 'normalize'
+    subtract = 'subtract'
+
 
 class GlobalTags:
     all = 'all'
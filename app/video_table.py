@@ -0,0 +1,173 @@
+"""
+Columnar (NumPy) representation of the video metadata.
+
+Filters over the videos are evaluated as vectorized boolean masks over the
+rows of the table instead of calling a Python function on every Video.
+"""
+
+from typing import Iterable, Iterator, List
+
+import numpy as np
+
+from .types_backend import Video
+
+
+class VideoTable(object):
+    """Video metadata as parallel arrays, with rows sorted by video id"""
+
+    def __init__(self, videos: Iterable[Video]):
+        self.videos: List[Video] = sorted(videos, key=lambda v: v.id)
+
+        self.channels: List[str] = sorted({v.channel for v in self.videos})
+        self.shows: List[str] = sorted({v.show for v in self.videos})
+        self._channel_codes = {c: i for i, c in enumerate(self.channels)}
+        self._show_codes = {s: i for i, s in enumerate(self.shows)}
+
+        self.ids = np.array([v.id for v in self.videos], dtype=np.int64)
+        self.channel = np.array(
+            [self._channel_codes[v.channel] for v in self.videos],
+            dtype=np.int32)
+        self.show = np.array(
+            [self._show_codes[v.show] for v in self.videos], dtype=np.int32)
+        self.date = np.array(
+            [v.date.toordinal() for v in self.videos], dtype=np.int32)
+        self.dayofweek = np.array(
+            [v.dayofweek for v in self.videos], dtype=np.int8)
+        self.hour = np.array([v.hour for v in self.videos], dtype=np.int16)
+        self.duration = np.array(
+            [v.num_frames / v.fps for v in self.videos], dtype=np.float64)
+        # Last hour of the day that the video airs in (may exceed 23)
+        self.end_hour = self.hour + np.round(
+            self.duration / 3600).astype(np.int16)
+
+        self.row_by_id = np.full(
+            int(self.ids.max()) + 1 if len(self.ids) > 0 else 0, -1,
+            dtype=np.int64)
+        self.row_by_id[self.ids] = np.arange(len(self.ids))
+
+    def __len__(self) -> int:
+        return len(self.videos)
+
+    def channel_code(self, channel: str) -> int:
+        return self._channel_codes.get(channel, -1)
+
+    def show_code(self, show: str) -> int:
+        return self._show_codes.get(show, -1)
+
+    def rows(self, video_ids: Iterable[int]) -> np.ndarray:
+        """Rows of the video ids, ignoring ids that are not in the table"""
+        ids = np.fromiter(video_ids, dtype=np.int64)
+        ids = ids[(ids >= 0) & (ids < len(self.row_by_id))]
+        rows = self.row_by_id[ids]
+        return rows[rows >= 0]
+
+    def mask_all(self) -> np.ndarray:
+        return np.ones(len(self.videos), dtype=bool)
+
+
+class VideoFilter(object):
+    """
+    Boolean mask over the rows of a VideoTable.
+
+    Instances can also be called on a single Video.
+    """
+
+    def __init__(self, table: VideoTable, mask: np.ndarray):
+        self.table = table
+        self.mask = mask
+
+    def __call__(self, video: Video) -> bool:
+        return bool(self.mask[self.table.row_by_id[video.id]])
+
+    def __or__(self, other: 'VideoFilter') -> 'VideoFilter':
+        return VideoFilter(self.table, self.mask | other.mask)
+
+    def __and__(self, other: 'VideoFilter') -> 'VideoFilter':
+        return VideoFilter(self.table, self.mask & other.mask)
+
+    def is_empty(self) -> bool:
+        return not self.mask.any()
+
+    def ids(self) -> np.ndarray:
+        """Sorted ids of the matching videos"""
+        return self.table.ids[self.mask]
+
+    def videos(self) -> Iterator[Video]:
+        """Matching videos, sorted by id"""
+        for row in np.flatnonzero(self.mask):
+            yield self.table.videos[row]
+
+    def match_ids(self, ids: np.ndarray) -> np.ndarray:
+        """Boolean mask of the video ids (an int64 array) that match"""
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        in_range = (ids >= 0) & (ids < len(self.table.row_by_id))
+        rows[in_range] = self.table.row_by_id[ids[in_range]]
+        keep = rows >= 0
+        keep[keep] = self.mask[rows[keep]]
+        return keep
+
+    def filter_ids(self, video_ids: Iterable[int]) -> np.ndarray:
+        """Subset of the video ids that match (order is preserved)"""
+        ids = np.fromiter(video_ids, dtype=np.int64)
+        return ids[self.match_ids(ids)]
+
+
+class VideoAttributeIndex(object):
+    """
+    Precomputed postings over the rows of a VideoTable for each channel,
+    show, day of week and hour.
+
+    Attributes with few values are stored as dense boolean masks, while
+    shows (of which there are many) are stored as sorted arrays of rows.
+    """
+
+    def __init__(self, table: VideoTable):
+        self._table = table
+        self._channel_masks = [
+            self._freeze(table.channel == i)
+            for i in range(len(table.channels))]
+        self._dayofweek_masks = {
+            d: self._freeze(table.dayofweek == d) for d in range(1, 8)}
+        self._hour_masks = [
+            self._freeze((table.hour <= h) & (table.end_hour >= h))
+            for h in range(24)]
+
+        show_order = np.argsort(table.show, kind='stable')
+        show_counts = np.bincount(table.show, minlength=len(table.shows))
+        self._show_rows = [
+            self._freeze(rows) for rows in
+            np.split(show_order, np.cumsum(show_counts)[:-1])]
+
+    @staticmethod
+    def _freeze(a: np.ndarray) -> np.ndarray:
+        a.flags.writeable = False
+        return a
+
+    def _empty(self) -> np.ndarray:
+        return np.zeros(len(self._table), dtype=bool)
+
+    def channel(self, channel: str) -> np.ndarray:
+        code = self._table.channel_code(channel)
+        return self._channel_masks[code] if code >= 0 else self._empty()
+
+    def show(self, show: str) -> np.ndarray:
+        mask = self._empty()
+        code = self._table.show_code(show)
+        if code >= 0:
+            mask[self._show_rows[code]] = True
+        return mask
+
+    def days_of_week(self, days: Iterable[int]) -> np.ndarray:
+        mask = self._empty()
+        for d in days:
+            if d in self._dayofweek_masks:
+                mask |= self._dayofweek_masks[d]
+        return mask
+
+    def hours(self, hours: Iterable[int]) -> np.ndarray:
+        """Videos that air during any of the hours"""
+        mask = self._empty()
+        for h in hours:
+            if 0 <= h < len(self._hour_masks):
+                mask |= self._hour_masks[h]
+        return mask
@@ -8,18 +8,32 @@ import os
 import json
 import heapq
 import time
-from collections import defaultdict
-from functools import wraps
+from collections import Counter, defaultdict
+from functools import lru_cache, partial, wraps
 from inspect import getfullargspec
 from multiprocessing import Pool
-from typing import List, Tuple
+from typing import Dict, List, Tuple
+import numpy as np
 from pytz import timezone
 
+from captions.query import Query
 from rs_intervalset import MmapIntervalListMapping, MmapIntervalSetMapping
 from rs_intervalset.writer import (
     IntervalSetMappingWriter, IntervalListMappingWriter)
-
-from app.load import load_videos
+from rs_intervalset.wrapper import MmapIListToISetMapping
+
+from app.load import (
+    load_videos, load_caption_data, normalize_text_term, TEXT_TERMS_FILE,
+    NON_COMMERCIAL_DIR, RELOAD_FILE, get_person_file_prefixes,
+    get_metadata_snapshot_sources, read_person_tags, load_hosts)
+from app.rollup import ScreenTimeRollup
+from app.caption_store import (
+    CAPTION_STORE_FILE, CAPTION_STORE_INDEX_FILE, CaptionStore,
+    EncodedCaptions, render_captions, encode_captions,
+    get_caption_index_fingerprint)
+from app.snapshot import (
+    METADATA_SNAPSHOT_FILE, MetadataSnapshot, save_snapshot,
+    get_source_fingerprint)
 
 U32_MAX = 0xFFFFFFFF
 
@@ -30,10 +44,14 @@ PAYLOAD_LEN = 1
 # Minimum interval for no faces
 MIN_NO_FACES_MS = 1000
 
+# Number of documents sampled when counting bigrams
+TEXT_BIGRAM_SAMPLE_DOCS = 1000
+
 
 def get_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument('--datadir', type=str, default='data')
+    parser.add_argument('--indexdir', type=str, default='data/index')
     parser.add_argument(
         '-i', '--incremental', action='store_true',
         help='Incrementally update existing derived files (skips video ids '
@@ -44,6 +62,13 @@ def get_args() -> argparse.Namespace:
     parser.add_argument(
         '-p', '--person-limit', type=int, default=2 ** 20,    # 1MB
         help='Person isets will be precomputed for people ilists exceeding this size.')
+    parser.add_argument(
+        '-k', '--text-limit', type=int, default=100,
+        help='Isets will be precomputed for this many of the most frequent '
+             'caption tokens (and bigrams).')
+    parser.add_argument(
+        '-z', '--timezone', dest='tz_name', type=str, default='US/Eastern',
+        help='Timezone of the server (for the metadata snapshot).')
     return parser.parse_args()
 
 
@@ -378,11 +403,317 @@ def derive_tag_ilists(
                 error_callback=build_error_callback('Failed on: ' + tag))
 
 
+@lru_cache()
+def load_caption_index(index_dir: str):
+    # Loaded once per worker process
+    return load_caption_data(index_dir)
+
+
+def encode_document_captions(
+        index_dir: str,
+        document_id: int
+) -> EncodedCaptions:
+    caption_data = load_caption_index(index_dir)
+    return encode_captions(render_captions(
+        caption_data.documents, caption_data.lexicon,
+        caption_data.documents[document_id]))
+
+
+@print_task_info
+def derive_caption_store(
+        index_dir: str,
+        data_dir: str,
+        outfile: str,
+        is_incremental: bool
+) -> None:
+    index_outfile = os.path.join(
+        os.path.dirname(outfile), CAPTION_STORE_INDEX_FILE)
+    caption_data = load_caption_index(index_dir)
+    video_ids = {
+        v.name: v.id
+        for v in load_videos(data_dir, timezone('UTC')).values()}
+    document_ids = {}
+    for d in caption_data.documents:
+        video_id = video_ids.get(d.name)
+        if video_id is not None:
+            document_ids[video_id] = d.id
+    ids = sorted(document_ids)
+
+    index_fingerprint = get_caption_index_fingerprint(index_dir)
+    prev_store = None
+    if is_incremental and os.path.exists(index_outfile):
+        prev_store = CaptionStore(outfile, index_outfile)
+        if prev_store.index_fingerprint != index_fingerprint:
+            print('Caption index has changed. Re-rendering all captions.')
+            prev_store = None
+
+    with Pool() as workers:
+        new_entries = workers.imap(
+            partial(encode_document_captions, index_dir),
+            [
+                document_ids[i] for i in ids
+                if prev_store is None or prev_store.get(i) is None
+            ],
+            chunksize=64)
+
+        def get_entries():
+            for i in ids:
+                entry = prev_store.get(i) if prev_store is not None else None
+                yield entry if entry is not None else next(new_entries)
+
+        CaptionStore.write(
+            outfile, index_outfile, get_entries(), ids, index_fingerprint)
+
+
+@print_task_info
+def derive_text_iset(
+        index_dir: str,
+        data_dir: str,
+        text: str,
+        outfile: str,
+        is_incremental: bool
+) -> None:
+    caption_data = load_caption_index(index_dir)
+    video_ids = {
+        v.name: v.id
+        for v in load_videos(data_dir, timezone('UTC')).values()}
+
+    skip_ids = set()
+    if is_incremental and os.path.exists(outfile):
+        skip_ids = get_iset_ids(outfile)
+
+    # Same intervals (in ms) as a search of the caption index, which are the
+    # postings as they are (i.e., not sorted or merged)
+    video_intervals = {}
+    for result in Query(text).execute(
+            caption_data.lexicon, caption_data.index,
+            ignore_word_not_found=True, case_insensitive=True
+    ):
+        video_id = video_ids.get(caption_data.documents[result.id].name)
+        if video_id is None or video_id in skip_ids:
+            continue
+        if result.postings:
+            video_intervals[video_id] = [
+                (int(p.start * 1000), int(p.end * 1000))
+                for p in result.postings]
+
+    with IntervalSetMappingWriter(outfile, append=is_incremental) as writer:
+        for video_id in sorted(video_intervals):
+            writer.write(video_id, video_intervals[video_id])
+
+
+def get_top_text_terms(index_dir: str, limit: int) -> List[str]:
+    """Most frequent tokens and bigrams in the captions"""
+    caption_data = load_caption_index(index_dir)
+
+    token_counts = Counter()
+    for word in caption_data.lexicon:
+        token_counts[normalize_text_term(word.token)] += word.count
+    top_tokens = [t for t, _ in token_counts.most_common(limit)]
+
+    # A bigram cannot be more frequent than its tokens, so the most frequent
+    # bigrams are counted among the most frequent tokens (on a sample)
+    sample_step = max(
+        len(caption_data.documents) // TEXT_BIGRAM_SAMPLE_DOCS, 1)
+    sample_documents = list(caption_data.documents)[::sample_step]
+    token_at = {}
+    for token in top_tokens:
+        for result in Query(token).execute(
+                caption_data.lexicon, caption_data.index,
+                documents=sample_documents, ignore_word_not_found=True,
+                case_insensitive=True
+        ):
+            for p in result.postings:
+                token_at[(result.id, p.idx)] = token
+    bigram_counts = Counter()
+    for (doc_id, idx), token in token_at.items():
+        next_token = token_at.get((doc_id, idx + 1))
+        if next_token is not None:
+            bigram_counts['{} {}'.format(token, next_token)] += 1
+    top_bigrams = [b for b, _ in bigram_counts.most_common(limit)]
+    return top_tokens + top_bigrams
+
+
+def derive_text_isets(
+        workers: Pool,
+        index_dir: str,
+        data_dir: str,
+        outdir: str,
+        limit: int,
+        is_incremental: bool
+) -> None:
+    mkdir_if_not_exists(outdir)
+
+    terms_path = os.path.join(outdir, TEXT_TERMS_FILE)
+    terms: Dict[str, str] = {}
+    if os.path.exists(terms_path):
+        with open(terms_path) as f:
+            terms = json.load(f)
+    for term in get_top_text_terms(index_dir, limit):
+        if term not in terms:
+            # Terms can contain characters that are not valid in file names
+            terms[term] = '{}.iset.bin'.format(len(terms))
+    with open(terms_path, 'w') as f:
+        json.dump(terms, f)
+
+    for term, fname in terms.items():
+        workers.apply_async(
+            derive_text_iset,
+            (
+                index_dir, data_dir, term, os.path.join(outdir, fname),
+                is_incremental
+            ),
+            error_callback=build_error_callback('Failed on: ' + term))
+
+
+@print_task_info
+def derive_non_commercial_iset(
+        iset_file: str,
+        commercial_iset_file: str,
+        outfile: str,
+        is_incremental: bool
+) -> None:
+    isetmap = MmapIntervalSetMapping(iset_file)
+    commercial_isetmap = MmapIntervalSetMapping(commercial_iset_file)
+    video_ids = set(isetmap.get_ids())
+    if is_incremental and os.path.exists(outfile):
+        video_ids -= get_iset_ids(outfile)
+
+    with IntervalSetMappingWriter(outfile, append=is_incremental) as writer:
+        for video_id in sorted(video_ids):
+            intervals = isetmap.get_intervals(video_id, True)
+            if intervals:
+                result = commercial_isetmap.minus(video_id, intervals, True)
+                if result:
+                    writer.write(video_id, result)
+
+
+def derive_non_commercial_intervals(
+        workers: Pool,
+        derived_dir: str,
+        commercial_iset_file: str,
+        is_incremental: bool
+) -> None:
+    outdir = os.path.join(derived_dir, NON_COMMERCIAL_DIR)
+
+    def helper(fname: str) -> None:
+        outfile = os.path.join(outdir, fname)
+        mkdir_if_not_exists(os.path.dirname(outfile))
+        workers.apply_async(
+            derive_non_commercial_iset,
+            (
+                os.path.join(derived_dir, fname), commercial_iset_file,
+                outfile, is_incremental
+            ),
+            error_callback=build_error_callback('Failed on: ' + fname))
+
+    # Only isets, since commercials must be removed after an ilist has been
+    # converted to an iset (which merges gaps and drops short intervals)
+    for subdir in ['face', 'people']:
+        if os.path.isdir(os.path.join(derived_dir, subdir)):
+            for fname in os.listdir(os.path.join(derived_dir, subdir)):
+                if fname.endswith('.iset.bin'):
+                    helper(os.path.join(subdir, fname))
+
+
+@print_task_info
+def derive_screen_time_rollup(
+        iset_file: str,
+        commercial_iset_file: str,
+        outfile: str,
+        is_incremental: bool
+) -> None:
+    isetmap = MmapIntervalSetMapping(iset_file)
+    commercial_isetmap = MmapIntervalSetMapping(commercial_iset_file)
+    video_ids = set(isetmap.get_ids())
+    prev_rollup = None
+    if is_incremental and os.path.exists(outfile):
+        prev_rollup = ScreenTimeRollup.load(outfile)
+        video_ids -= set(prev_rollup.ids.tolist())
+
+    def total_ms(intervals: List[Tuple[int, int]]) -> int:
+        return sum(b - a for a, b in intervals)
+
+    ids, commercial_ms, non_commercial_ms = [], [], []
+    for video_id in sorted(video_ids):
+        intervals = isetmap.get_intervals(video_id, True)
+        if intervals:
+            ids.append(video_id)
+            commercial_ms.append(total_ms(
+                commercial_isetmap.intersect(video_id, intervals, True)))
+            non_commercial_ms.append(total_ms(
+                commercial_isetmap.minus(video_id, intervals, True)))
+
+    rollup = ScreenTimeRollup(
+        np.array(ids, dtype=np.int64),
+        np.array(commercial_ms, dtype=np.int64),
+        np.array(non_commercial_ms, dtype=np.int64))
+    if prev_rollup is not None:
+        rollup = prev_rollup + rollup
+    rollup.save(outfile)
+
+
+def derive_screen_time_rollups(
+        workers: Pool,
+        iset_dir: str,
+        commercial_iset_file: str,
+        outdir: str,
+        is_incremental: bool
+) -> None:
+    mkdir_if_not_exists(outdir)
+
+    for iset_file in os.listdir(iset_dir):
+        if not iset_file.endswith('.iset.bin'):
+            continue
+        rollup_path = os.path.join(
+            outdir, parse_person_name(iset_file) + '.npz')
+        workers.apply_async(
+            derive_screen_time_rollup,
+            (
+                os.path.join(iset_dir, iset_file), commercial_iset_file,
+                rollup_path, is_incremental
+            ),
+            error_callback=build_error_callback('Failed on: ' + iset_file))
+
+
+@print_task_info
+def derive_metadata_snapshot(datadir: str, outfile: str, tz_name: str) -> None:
+    # Before reading the sources, so that changes while reading are detected
+    source_fingerprint = get_source_fingerprint(
+        get_metadata_snapshot_sources(datadir))
+
+    person_iset_dir = os.path.join(datadir, 'derived', 'people')
+    person_screen_time = {}
+    for person_file_prefix in get_person_file_prefixes(datadir):
+        person_iset_path = os.path.join(
+            person_iset_dir, person_file_prefix + '.iset.bin')
+        if os.path.isfile(person_iset_path):
+            person_isetmap = MmapIntervalSetMapping(person_iset_path)
+        else:
+            person_isetmap = MmapIListToISetMapping(
+                MmapIntervalListMapping(
+                    os.path.join(datadir, 'people',
+                                 person_file_prefix + '.ilist.bin'), 1),
+                0, 0, 3000, 100)
+        person_screen_time[person_file_prefix] = person_isetmap.sum() / 1000
+
+    save_snapshot(outfile, MetadataSnapshot(
+        source_fingerprint=source_fingerprint,
+        timezone=tz_name,
+        videos=load_videos(datadir, timezone(tz_name)),
+        person_screen_time=person_screen_time,
+        person_tags=read_person_tags(datadir),
+        hosts=load_hosts(os.path.join(datadir, 'hosts.csv'))))
+
+
 def main(
         datadir: str,
+        indexdir: str,
         incremental: bool,
         tag_limit: int,
-        person_limit: int
+        person_limit: int,
+        text_limit: int,
+        tz_name: str
 ) -> None:
     outdir = os.path.join(datadir, 'derived')
     mkdir_if_not_exists(outdir)
@@ -400,6 +731,10 @@ def main(
             ),
             error_callback=build_error_callback('Failed on: num faces ilist'))
 
+        derive_text_isets(
+            workers, indexdir, datadir, os.path.join(outdir, 'text'),
+            text_limit, incremental)
+
         metadata_path = os.path.join(datadir, 'people.metadata.json')
         if os.path.exists(metadata_path):
             derive_tag_ilists(
@@ -419,6 +754,34 @@ def main(
 
         workers.close()
         workers.join()
+
+    derive_caption_store(
+        indexdir, datadir, os.path.join(outdir, CAPTION_STORE_FILE),
+        incremental)
+
+    # Rollups and non-commercial variants are computed from the derived
+    # intervals
+    with Pool() as workers:
+        derive_non_commercial_intervals(
+            workers, outdir, os.path.join(datadir, 'commercials.iset.bin'),
+            incremental)
+
+        for iset_type in ['face', 'people']:
+            derive_screen_time_rollups(
+                workers, os.path.join(outdir, iset_type),
+                os.path.join(datadir, 'commercials.iset.bin'),
+                os.path.join(outdir, 'rollup', iset_type), incremental)
+
+        workers.close()
+        workers.join()
+
+    # Written last, since it is computed from the derived data
+    derive_metadata_snapshot(
+        datadir, os.path.join(outdir, METADATA_SNAPSHOT_FILE), tz_name)
+
+    # Signal running servers to load the new data
+    with open(os.path.join(datadir, RELOAD_FILE), 'a'):
+        os.utime(os.path.join(datadir, RELOAD_FILE))
     print('Done!')
 
 
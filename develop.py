@@ -72,7 +72,9 @@ def main(
             default_is_commercial=Ternary.false,    # exclude comercials
             allow_sharing=True,
             data_version='dev',
-            show_uptime=True)
+            show_uptime=True,
+            search_cache_bytes=0,                   # disable caching
+            search_parallelism=1)                   # search on one thread
     else:
         from flask import Flask
         from app.route_html import add_html_routes
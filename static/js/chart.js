@@ -160,19 +160,13 @@ function secondsToMinutes(x) {
 }
 
 function getPointValue(result, video_data, t) {
-  var value = video_data.reduce((acc, x) => acc + x[1], 0);
-  if (result.normalize) {
-    var denom = _.get(result.normalize, t, null);
-    if (denom) { // TODO: what if this is NaN
-      value /= denom;
-    }
+  var value;
+  if (result.values) {
+    value = _.get(result.values, t, 0.);
   } else {
-    if (result.subtract) {
-      value -= _.get(result.subtract, t, 0.);
-    }
-    value = secondsToMinutes(value);
+    value = video_data.reduce((acc, x) => acc + x[1], 0);
   }
-  return value;
+  return result.normalize ? value : secondsToMinutes(value);
 }
 
 function getRoundedValue(value, frac_digits) {
@@ -201,9 +195,9 @@ class Chart {
     // Data for lines
     let line_data = _.flatMap(this.search_results, ([color, result]) => {
       var values = result.main;
-      // Fill in zeros for subtraction
-      if (result.subtract) {
-        Object.keys(result.subtract).forEach(t => {
+      // Fill in zeros for dates that only the combined values have
+      if (result.values) {
+        Object.keys(result.values).forEach(t => {
           if (!values.hasOwnProperty(t)) {
             values[t] = [];
           }
@@ -13,6 +13,44 @@ function findInArrayCaseInsensitive(arr, v) {
   return null;
 }
 
+const MAX_PERSON_NAME_LOOKUPS = 100;
+
+/* Names of people in queries, by lower case name (null if unknown) */
+const PERSON_NAMES = new Map();
+
+/* Returns undefined if the name has not been looked up yet */
+function getPersonName(name) {
+  return PERSON_NAMES.get(name.toLowerCase());
+}
+
+/* Look up the names that are not known yet, returning a promise */
+function lookupPersonNames(names) {
+  let missing = Array.from(new Set(names.map(x => x.toLowerCase()))).filter(
+    x => !PERSON_NAMES.has(x));
+  let requests = [];
+  for (var i = 0; i < missing.length; i += MAX_PERSON_NAME_LOOKUPS) {
+    let batch = missing.slice(i, i + MAX_PERSON_NAME_LOOKUPS);
+    requests.push(Promise.resolve($.ajax({
+      url: '/person-names', type: 'get', cache: true,
+      data: {names: JSON.stringify(batch)}
+    })).then(found => {
+      batch.forEach((x, j) => PERSON_NAMES.set(x, found[j]));
+    }));
+  }
+  return Promise.all(requests);
+}
+
+/* People matching a prefix of a word in their names, by screen time */
+function autocompletePeople(prefix, limit) {
+  return Promise.resolve($.ajax({
+    url: '/autocomplete', type: 'get', cache: true,
+    data: {type: 'name', prefix: prefix || '', limit: limit}
+  })).then(names => {
+    names.forEach(x => PERSON_NAMES.set(x.toLowerCase(), x.toLowerCase()));
+    return names;
+  });
+}
+
 function urlSafeBase64Encode(s) {
   return btoa(s).replace(/=/g, '').replace(/\+/g, '.').replace(/\//g, '_');
 }
@@ -175,6 +175,14 @@ function getRandomSample(arr) {
   return arr[Math.floor(Math.random() * arr.length)];
 }
 
+function addSelectOptions(select, values) {
+  let existing = new Set(select.find('option').map(function() {
+    return this.value;
+  }).get());
+  values.filter(x => !existing.has(x)).forEach(
+    x => select.append($('<option>').val(x).text(x)));
+}
+
 function isValidQuery(s, macros) {
   try {
     new SearchableQuery(s, macros, false);
@@ -237,8 +245,12 @@ class Editor {
       builder = $(QUERY_BUILDER_HTML);
       let show_select = builder.find(`[name="${SEARCH_KEY.show}"]`);
       ALL_SHOWS.forEach(x => show_select.append($('<option>').val(x).text(x)));
+      // The people with the most screen time are listed by the server
       let name_select = builder.find(`[name="${SEARCH_KEY.face_name}"]`);
-      ALL_PEOPLE.forEach(x => name_select.append($('<option>').val(x).text(x)));
+      autocompletePeople('', MAX_PEOPLE_AUTOCOMPLETE).then(names => {
+        addSelectOptions(name_select, names.map(x => x.toLowerCase()));
+        name_select.trigger('chosen:updated');
+      }).catch(() => console.log('Failed to load people'));
       let tag_select = builder.find(`[name="${SEARCH_KEY.face_tag}"]`);
       ALL_GLOBAL_TAGS.forEach(x => tag_select.append($('<option>').val(x).text(x)));
       ALL_PERSON_TAGS.forEach(x => tag_select.append($('<option>').val(x).text(x)));
@@ -305,7 +317,9 @@ class Editor {
 
       let face_names = top_level_kv[SEARCH_KEY.face_name];
       if (face_names) {
-        query_builder.find(`[name="${SEARCH_KEY.face_name}"]`).val(face_names);
+        let name_select = query_builder.find(`[name="${SEARCH_KEY.face_name}"]`);
+        addSelectOptions(name_select, face_names);
+        name_select.val(face_names);
       }
 
       let face_tags = top_level_kv[SEARCH_KEY.face_tag];
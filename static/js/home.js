@@ -50,20 +50,17 @@ function getChartPath(data) {
 function getDownloadUrl(search_results) {
   let json_data = _.flatMap(search_results, ([color, result]) => {
     let times = new Set(Object.keys(result.main));
-    if (result.normalize) {
-      Object.keys(result.normalize).forEach(x => times.add(x));
-    }
-    if (result.subtract) {
-      Object.keys(result.subtract).forEach(x => times.add(x));
+    if (result.values) {
+      Object.keys(result.values).forEach(x => times.add(x));
     }
     var query_text = $.trim(result.query);
     let unit = result.normalize ? 'ratio' : 'seconds';
     return Array.from(times).map(t => {
-      var value = _.get(result.main, t, []).reduce((acc, x) => acc + x[1], 0);
-      if (result.normalize) {
-        value /=  _.get(result.normalize, t, 0);
-      } else if (result.subtract) {
-        value -=  _.get(result.subtract, t, 0);
+      var value;
+      if (result.values) {
+        value = _.get(result.values, t, 0);
+      } else {
+        value = _.get(result.main, t, []).reduce((acc, x) => acc + x[1], 0);
       }
       return [query_text, t, value.toString(), unit];
     });
@@ -92,6 +92,55 @@ const FACE_TAG_SPLIT_RE = /(?:\s+and\s+)|(?:\s*,\s*)/i;
 
 class QueryParseError extends Error {}
 
+const SEARCH_BINARY_MIMETYPE = 'application/octet-stream';
+const SEARCH_BINARY_DATE_LEN = 12;
+
+/* Decode a detailed search result sent as packed little-endian arrays */
+function decodeBinarySearchResult(buffer) {
+  let view = new DataView(buffer);
+  let decoder = new TextDecoder('ascii');
+  let result = {};
+  let num_dates = view.getUint32(0, true);
+  var offset = 4;
+  for (var i = 0; i < num_dates; i++) {
+    let date = decoder.decode(
+      new Uint8Array(buffer, offset, SEARCH_BINARY_DATE_LEN)
+    ).replace(/\0+$/, '');
+    let n = view.getUint32(offset + SEARCH_BINARY_DATE_LEN, true);
+    offset += SEARCH_BINARY_DATE_LEN + 4;
+    let ids = new Uint32Array(buffer, offset, n);
+    offset += 4 * n;
+    let values = new Float32Array(buffer, offset, n);
+    offset += 4 * n;
+    let pairs = new Array(n);
+    for (var j = 0; j < n; j++) {
+      pairs[j] = [ids[j], values[j]];
+    }
+    result[date] = pairs;
+  }
+  return result;
+}
+
+/* Fetch a detailed search, preferring the binary encoding */
+function fetchDetailedSearch(params, onError) {
+  return fetch(`/search?${params}`, {
+    headers: {Accept: SEARCH_BINARY_MIMETYPE}
+  }).then(resp => {
+    if (!resp.ok) {
+      return resp.text().then(text => {
+        onError({responseText: text, status: resp.status}, 'error',
+                resp.statusText);
+        throw new Error(resp.statusText);
+      });
+    }
+    let content_type = resp.headers.get('Content-Type') || '';
+    if (content_type.startsWith(SEARCH_BINARY_MIMETYPE)) {
+      return resp.arrayBuffer().then(decodeBinarySearchResult);
+    }
+    return resp.json();
+  });
+}
+
 class SearchResult {
 
   constructor(query, alias, results) {
@@ -100,6 +149,8 @@ class SearchResult {
     this.main = results.main;
     this.normalize = _.get(results, 'normalize', null);
     this.subtract = _.get(results, 'subtract', null);
+    // Final value of each date, if the server combined a compound query
+    this.values = _.get(results, 'values', null);
   }
 
   has_normalization() {
@@ -140,14 +191,12 @@ function validateKeyValue(key, value, no_err) {
       break;
     }
     case SEARCH_KEY.face_name: {
-      if (!ALL_PEOPLE_LOWER_CASE_SET.has(value.toLowerCase())) {
+      // Names that have not been looked up yet are checked by the server
+      let name = getPersonName(value);
+      if (name === null) {
         throw getKVError();
-      }
-      let name = findInArrayCaseInsensitive(ALL_PEOPLE, value);
-      if (name) {
+      } else if (name) {
         value = name;
-      } else {
-        throw getKVError();
       }
       break;
     }
@@ -346,60 +395,35 @@ class SearchableQuery {
       return getSortedQueryString(obj);
     }
 
-    let result = {};
+    let query_str = this.query;
+    let query_alias = this.alias;
 
-    let promises = [
-      $.ajax({
-        url: '/search', type: 'get', data: getParams(this.main_query, true),
+    if (this.has_add || this.has_norm || this.has_sub) {
+      // Compound queries are combined by the server in one request
+      let compound = {main: this.main_query};
+      if (this.has_add) {
+        compound.add = this.add_query;
+      }
+      if (this.has_norm) {
+        compound.normalize = this.norm_query;
+      }
+      if (this.has_sub) {
+        compound.subtract = this.sub_query;
+      }
+      return $.ajax({
+        url: '/search', type: 'get', data: getParams(compound, true),
         cache: true, error: onError
-      }).then(resp => result.main = resp)
-    ];
-
-    var to_add = null;
-    if (this.has_add) {
-      promises.push(
-        $.ajax({
-          url: '/search', type: 'get', data: getParams(this.add_query, true),
-          cache: true, error: onError
-        }).then(resp => to_add = resp)
-      );
-    }
-
-    if (this.has_norm) {
-      promises.push(
-        $.ajax({
-          url: '/search', type: 'get', data: getParams(this.norm_query, false),
-          cache: true, error: onError
-        }).then(resp => result.normalize = resp)
-      );
-    }
-
-    if (this.has_sub) {
-      promises.push(
-        $.ajax({
-          url: '/search', type: 'get', data: getParams(this.sub_query, false),
-          cache: true, error: onError
-        }).then(resp => result.subtract = resp)
-      );
+      }).then(
+        resp => onSuccess(new SearchResult(query_str, query_alias, resp))
+      ).catch(function() {
+        console.log('Uh oh. Something went wrong.');
+      });
     }
 
-    let query_str = this.query;
-    let query_alias = this.alias;
-    return Promise.all(promises).then(
-      () => {
-        if (to_add) {
-          Object.entries(to_add).forEach(([t, v]) => {
-            if (result.main.hasOwnProperty(t)) {
-              result.main[t] = result.main[t].concat(v);
-            } else {
-              result.main[t] = v;
-            }
-          });
-        }
-        return onSuccess(new SearchResult(query_str, query_alias, result));
-      }
+    return fetchDetailedSearch(getParams(this.main_query, true), onError).then(
+      resp => onSuccess(new SearchResult(query_str, query_alias, {main: resp}))
     ).catch(function() {
-      Console.log('Uh oh. Something went wrong.');
+      console.log('Uh oh. Something went wrong.');
     });
   }
 
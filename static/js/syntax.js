@@ -1,5 +1,13 @@
 const DEBUG_AUTOCOMPLETE = false;
 const MAX_PEOPLE_AUTOCOMPLETE = 2000
+const PERSON_NAME_LOOKUP_DELAY = 250;
+
+function restyleCodeEditors() {
+  $('.CodeMirror').each(function() {
+    let editor = this.CodeMirror;
+    editor.setOption('mode', editor.getOption('mode'));
+  });
+}
 
 function generateCodeMirrorQueryParser(options) {
 
@@ -10,6 +18,24 @@ function generateCodeMirrorQueryParser(options) {
   let keyword_regex = new RegExp('^(' + keywords.join('|') + ')', 'i');
   let space_keyword_regex = new RegExp(`^\\s+(?:${keywords.join('|')})`, 'i');
 
+  // Names are looked up by the server in batches, after which the editors
+  // are restyled
+  let pending_names = new Set();
+  var pending_names_timeout = null;
+
+  function lookupPersonNameLater(name) {
+    pending_names.add(name);
+    if (pending_names_timeout == null) {
+      pending_names_timeout = setTimeout(() => {
+        let names = Array.from(pending_names);
+        pending_names.clear();
+        pending_names_timeout = null;
+        lookupPersonNames(names).then(restyleCodeEditors).catch(
+          () => console.log('Failed to look up names:', names));
+      }, PERSON_NAME_LOOKUP_DELAY);
+    }
+  }
+
   function fail(stream) {
     if (!stream.skipTo('\n')) {
       stream.skipToEnd();
@@ -107,8 +133,14 @@ function generateCodeMirrorQueryParser(options) {
             t => !ALL_TAGS_LOWER_CASE_SET.has(t.toLowerCase())
           );
           return err ? 'error' : 'face';
-        case SEARCH_KEY.face_name:
-          return ALL_PEOPLE_LOWER_CASE_SET.has(value.toLowerCase()) ? 'face' : 'error';
+        case SEARCH_KEY.face_name: {
+          let name = getPersonName(value);
+          if (name === undefined) {
+            lookupPersonNameLater(value);
+            return 'face';
+          }
+          return name ? 'face' : 'error';
+        }
         case SEARCH_KEY.face_count:
           return value.match(/\d+/) ? 'face' : 'error';
         case SEARCH_KEY.text_window:
@@ -333,7 +365,11 @@ function addCodeHintHelper(name) {
 
   let all_shows = ALL_SHOWS.filter(x => x.length > 0);
 
+  // Returns a promise, since names are looked up by the server
   function getValuesForKey(key, substr) {
+    if (key == SEARCH_KEY.face_name) {
+      return autocompletePeople(substr, MAX_PEOPLE_AUTOCOMPLETE);
+    }
     var values = [];
     switch (key) {
       case SEARCH_KEY.channel:
@@ -342,9 +378,6 @@ function addCodeHintHelper(name) {
       case SEARCH_KEY.show:
         values = all_shows;
         break;
-      case SEARCH_KEY.face_name:
-        values = substr || ALL_AUTOCOMPLETE_PEOPLE.length <= MAX_PEOPLE_AUTOCOMPLETE ? ALL_AUTOCOMPLETE_PEOPLE : [];
-        break;
       case SEARCH_KEY.face_tag:
         values = ALL_TAGS;
         break;
@@ -361,10 +394,10 @@ function addCodeHintHelper(name) {
       let substr_regex = new RegExp(substr, 'i');
       values = values.filter(x => x.match(substr_regex))
     }
-    return values;
+    return Promise.resolve(values);
   }
 
-  CodeMirror.registerHelper('hint', name, function(editor) {
+  function getHint(editor) {
     let cursor = editor.getCursor();
     let line = editor.getLine(cursor.line);
     var start = cursor.ch;
@@ -430,12 +463,12 @@ function addCodeHintHelper(name) {
     if ($.trim(curr_unit).match(search_keys_regex)) {
       // cursor is in a key
       let key = curr_unit;
-      var values = getValuesForKey(key).map(x => `"${x}"`);
-      if (match = suffix.match(/^\s*=/)) {
+      let has_equals = suffix.match(/^\s*=/);
+      let values = getValuesForKey(key).then(
+        values => values.map(x => has_equals ? `"${x}"` : `="${x}"`));
+      if (match = has_equals) {
         end += match[0].length;
         curr_unit = line.slice(start, end);
-      } else {
-        values = values.map(x => '=' + x);
       }
       suffix = line.substring(end);
 
@@ -499,7 +532,7 @@ function addCodeHintHelper(name) {
       // cursor is in a value
       let prefix_quote_char = match[1];
       let key = reverseString(inv_prefix.match(/\s*=\s*(\w+)/)[1]);
-      var values = [];
+      var values = Promise.resolve([]);
       if (key.match(search_keys_regex)) {
         // Strip quotes from curr unit
         curr_unit = $.trim(curr_unit);
@@ -512,11 +545,10 @@ function addCodeHintHelper(name) {
             return null;
           }
         }
-        values = getValuesForKey(key, curr_unit);
-        if (values.length == 1 && values[0] == curr_unit) {
-          return null;
-        }
-        values = values.map(v => `"${v}"`);
+        let value = curr_unit;
+        values = getValuesForKey(key, value).then(
+          values => values.length == 1 && values[0] == value ?
+            [] : values.map(v => `"${v}"`));
       }
       if (prefix_quote_char) {
         start--;
@@ -582,7 +614,22 @@ function addCodeHintHelper(name) {
         };
       }
     }
-  });
+  }
+
+  // The list of hints may be a promise, which is resolved before showing it
+  function getHintAsync(editor, callback) {
+    let hint = getHint(editor);
+    if (hint && hint.list instanceof Promise) {
+      hint.list.then(
+        list => callback(list.length > 0 ? Object.assign(hint, {list: list}) : null)
+      ).catch(() => callback(null));
+    } else {
+      callback(hint);
+    }
+  }
+  getHintAsync.async = true;
+
+  CodeMirror.registerHelper('hint', name, getHintAsync);
 }
 
 // Copyright 2017 Isaac Evavold
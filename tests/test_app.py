@@ -7,13 +7,15 @@ import os
 import random
 from datetime import datetime
 from urllib.parse import urlencode
-from typing import Dict, List, Optional, Callable
+from typing import Any, Dict, List, Optional, Callable
 import pytest
 from pytz import timezone
 from flask import Response
 from flask.testing import FlaskClient
 
+from app import route_search
 from app.core import build_app
+from app.load import TEXT_TERMS_FILE
 from app.types_frontend import Ternary
 
 
@@ -21,13 +23,12 @@ CONFIG_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
                            '..', 'config.json')
 
 
-@pytest.fixture(scope='module')
-def client():
-    """Dummy up a client with the default config"""
+def _build_test_app(**kwargs):
+    """Build the app with the default config (overridden by kwargs)"""
     with open(CONFIG_FILE) as f:
         config = json.load(f)
 
-    flask_app = build_app(
+    app_kwargs = dict(
         data_dir=config['data_dir'],
         index_dir=config['index_dir'],
         video_endpoint=config.get('video_endpoint'),
@@ -49,9 +50,17 @@ def client():
         hide_gender=False,
         allow_sharing=True,
         data_version='test',
-        show_uptime=True)
+        show_uptime=True,
+        search_cache_bytes=64 * 1024 * 1024,
+        search_parallelism=4)
+    app_kwargs.update(kwargs)
+    return build_app(**app_kwargs)
 
-    with flask_app.test_client() as test_client:
+
+@pytest.fixture(scope='module')
+def client():
+    """Dummy up a client with the default config"""
+    with _build_test_app().test_client() as test_client:
         yield test_client
 
 
@@ -89,6 +98,13 @@ def test_get_pages(client: FlaskClient) -> None:
 def test_get_generated_js(client: FlaskClient) -> None:
     """Make sure the we can retreive values.js"""
     _is_ok(client.get('/generated/js/values.js'))
+    response = client.get('/generated/js/values.js', headers={
+        'Accept-Encoding': 'gzip'})
+    _is_ok(response)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    response = client.get('/generated/js/values.js', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
 
 
 def test_get_data(client: FlaskClient) -> None:
@@ -99,6 +115,37 @@ def test_get_data(client: FlaskClient) -> None:
     _is_ok(client.get('/data/tags.json'))
 
 
+def test_autocomplete(client: FlaskClient) -> None:
+    """People are suggested by a prefix of any word in their name"""
+    response = client.get('/autocomplete?' + urlencode({
+        'type': 'name', 'prefix': 'blitz'}))
+    _is_ok(response)
+    assert 'Wolf Blitzer' in response.get_json()
+    _is_ok(client.get('/autocomplete?type=tag&prefix=a&limit=10'))
+    _is_bad(client.get('/autocomplete?type=show'))
+
+
+def test_person_names(client: FlaskClient) -> None:
+    """Names are looked up case insensitively"""
+    response = client.get('/person-names?' + urlencode({
+        'names': json.dumps(['Wolf Blitzer', 'not a person'])}))
+    _is_ok(response)
+    assert response.get_json() == ['wolf blitzer', None]
+    _is_bad(client.get('/person-names'))
+    _is_bad(client.get('/person-names?' + urlencode({
+        'names': json.dumps('wolf blitzer')})))
+
+
+def test_get_data_cached(client: FlaskClient) -> None:
+    """Data should be revalidated with its ETag"""
+    for path in ['/data/shows.json', '/data/people.json']:
+        response = client.get(path)
+        _is_ok(response)
+        response = client.get(path, headers={
+            'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+
+
 def test_get_captions(client: FlaskClient) -> None:
     """Make sure that captions can be fetched"""
     base_id = 10000
@@ -106,6 +153,31 @@ def test_get_captions(client: FlaskClient) -> None:
         _is_ok(client.get('/captions/{}'.format(base_id)))
 
 
+def test_get_captions_cached(client: FlaskClient) -> None:
+    """Captions should be revalidated with their ETag"""
+    response = client.get('/captions/10000')
+    _is_ok(response)
+    response = client.get('/captions/10000', headers={
+        'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_get_captions_window(client: FlaskClient) -> None:
+    """Captions can be restricted to a time range (in seconds)"""
+    response = client.get('/captions/10000?start=60&end=120')
+    _is_ok(response)
+    for start, end, _ in response.get_json():
+        assert end > 60 and start < 120
+    _is_bad(client.get('/captions/10000?start=120&end=60'))
+
+
+def test_get_memory(client: FlaskClient) -> None:
+    """Make sure that the memory usage of the worker is reported"""
+    response = client.get('/memory')
+    _is_ok(response)
+    assert response.get_json()['pid'] > 0
+
+
 # Search tests
 
 ResponseFn = Callable[[Response, Dict[str, Optional[str]]], None]
@@ -226,6 +298,350 @@ def test_count_video_time(client: FlaskClient) -> None:
         }, {}, _check_count_result)
 
 
+def test_search_cache(client: FlaskClient) -> None:
+    """Equivalent queries should be served from the result cache"""
+    def search(query: List[object]) -> Response:
+        response = client.get('/search?' + urlencode({
+            'aggregate': 'month', 'detailed': 'false',
+            'query': json.dumps(query)}))
+        _check_count_result(response, {})
+        return response
+
+    r1 = search(['and', [['channel', 'CNN'], ['name', 'Wolf Blitzer']]])
+    hits = client.get('/search-cache').get_json()['hits']
+    r2 = search(['and', [['name', 'wolf blitzer'], ['channel', 'CNN']]])
+    assert client.get('/search-cache').get_json()['hits'] == hits + 1
+    assert r1.get_json() == r2.get_json()
+
+
+def test_search_invalid_query(client: FlaskClient) -> None:
+    """Malformed query trees are rejected before they are evaluated"""
+    for query in [
+            [1, 'x'],
+            ['and', [[1, 'x'], ['name', 'wolf blitzer']]],
+            ['or', [['channel', 'CNN'], [None, 'x']]],
+            ['and', ['name', 'wolf blitzer']],
+            ['name', 1],
+            ['name']
+    ]:
+        _is_bad(client.get('/search?' + urlencode({
+            'aggregate': 'month', 'query': json.dumps(query)})))
+
+
+def _check_ndjson_result(
+        response: Response,
+        params: Dict[str, Optional[str]]
+) -> None:
+    assert response.status_code == 200, 'Query failed: {}, {}'.format(
+        repr(params), str(response.data))
+    assert response.mimetype == 'application/x-ndjson'
+    for line in response.get_data(as_text=True).splitlines():
+        assert isinstance(json.loads(line), dict)
+
+
+def test_count_video_time_ndjson(client: FlaskClient) -> None:
+    _combination_test_get(
+        client, '/search', {
+            'detailed': TEST_DETAILED_OPTIONS,
+            'aggregate': TEST_AGGREGATE_OPTIONS,
+            'format': ['ndjson']
+        }, {
+            'channel': TEST_CHANNEL_OPTIONS,
+            'name': TEST_FACE_NAME_OPTIONS,
+            'text': [None, 'united states of america'],
+        }, _check_ndjson_result, n=25)
+
+
+def test_search_ndjson_dates(client: FlaskClient) -> None:
+    """The lines of a date, concatenated, are the detailed JSON result"""
+    params = {
+        'aggregate': 'year', 'query': json.dumps(['name', 'wolf blitzer'])}
+    response = client.get('/search?' + urlencode(params))
+    assert response.status_code == 200, str(response.data)
+    expected = response.get_json()
+
+    params['format'] = 'ndjson'
+    response = client.get('/search?' + urlencode(params))
+    _check_ndjson_result(response, params)
+    merged = {}  # type: Dict[str, List[Any]]
+    for line in response.get_data(as_text=True).splitlines():
+        for date, values in json.loads(line).items():
+            merged.setdefault(date, []).extend(values)
+    assert merged == expected
+
+
+def test_count_video_time_binary(client: FlaskClient) -> None:
+    """Detailed results can be requested as packed arrays"""
+    response = client.get(
+        '/search?' + urlencode({
+            'aggregate': 'year', 'detailed': 'true',
+            'query': json.dumps(['channel', 'CNN'])}),
+        headers={'Accept': 'application/octet-stream'})
+    _is_ok(response)
+    assert response.mimetype == 'application/octet-stream'
+    data = response.get_data()
+    assert len(data) >= 4 and len(data) % 4 == 0
+
+
+def test_search_batch(client: FlaskClient) -> None:
+    """Batched queries should match the individual searches"""
+    queries = [
+        ['name', 'wolf blitzer'],
+        ['and', [['name', 'wolf blitzer'], ['channel', 'CNN']]],
+        ['and', [['channel', 'CNN'], ['name', 'wolf blitzer']]],
+    ]
+    params = {'aggregate': 'month', 'start_date': '2017-01-01'}
+    response = client.get('/search-batch?' + urlencode({
+        'queries': json.dumps([
+            {'query': q, 'detailed': False} for q in queries]),
+        **params}))
+    _is_ok(response)
+    batch_results = response.get_json()
+    assert len(batch_results) == len(queries)
+    for query, batch_result in zip(queries, batch_results):
+        response = client.get('/search?' + urlencode({
+            'query': json.dumps(query), 'detailed': 'false', **params}))
+        _is_ok(response)
+        assert response.get_json() == batch_result
+
+    for batch in [
+            [['name', 'wolf blitzer']],
+            [{'query': 'name'}],
+            [{'query': ['name', 'wolf blitzer'], 'detailed': 'false'}]
+    ]:
+        _is_bad(client.get('/search-batch?' + urlencode({
+            'queries': json.dumps(batch), **params})))
+
+
+def test_search_sharded(monkeypatch) -> None:
+    """Results should not depend on whether the search is sharded"""
+    def get_results(client: FlaskClient) -> List[object]:
+        results = []
+        for query in [
+                None,
+                {'main': ['name', 'wolf blitzer'], 'normalize': None},
+                ['or', [['all', None], ['name', 'wolf blitzer']]],
+                ['and', [['channel', 'CNN'], ['text', 'president']]]
+        ]:
+            for detailed in TEST_DETAILED_OPTIONS:
+                params = {'aggregate': 'year', 'detailed': detailed}
+                if query is not None:
+                    params['query'] = json.dumps(query)
+                response = client.get('/search?' + urlencode(params))
+                _is_ok(response)
+                results.append(response.get_json())
+        return results
+
+    def rounded(x: object) -> object:
+        # Shards are summed in a different order
+        if isinstance(x, float):
+            return round(x, 3)
+        elif isinstance(x, dict):
+            return {k: rounded(v) for k, v in x.items()}
+        elif isinstance(x, list):
+            return [rounded(v) for v in x]
+        return x
+
+    with _build_test_app(
+            search_parallelism=1, search_cache_bytes=0
+    ).test_client() as client:
+        unsharded_results = get_results(client)
+    monkeypatch.setattr(route_search, 'MIN_SEARCH_SHARD_VIDEOS', 1)
+    with _build_test_app(search_cache_bytes=0).test_client() as client:
+        sharded_results = get_results(client)
+    assert rounded(sharded_results) == rounded(unsharded_results)
+
+
+def test_search_non_commercial(monkeypatch) -> None:
+    """Precomputed intervals without commercials match removing them live"""
+    def get_results(client: FlaskClient) -> List[object]:
+        results = []
+        for query in [['tag', 'male'], ['name', 'wolf blitzer'],
+                      ['tag', 'presenter,male'], ['facecount', '1']]:
+            for detailed in TEST_DETAILED_OPTIONS:
+                response = client.get('/search?' + urlencode({
+                    'aggregate': 'year', 'detailed': detailed,
+                    'is_commercial': 'false', 'query': json.dumps(query)}))
+                _is_ok(response)
+                results.append(response.get_json())
+        return results
+
+    with _build_test_app(search_cache_bytes=0).test_client() as client:
+        precomputed_results = get_results(client)
+    monkeypatch.setattr(
+        route_search, 'get_non_commercial_intervals', lambda *args: None)
+    with _build_test_app(search_cache_bytes=0).test_client() as client:
+        live_results = get_results(client)
+    assert precomputed_results == live_results
+
+
+def test_search_derived_text(monkeypatch) -> None:
+    """Precomputed text intervals match searching the caption index"""
+    with open(CONFIG_FILE) as f:
+        terms_file = os.path.join(
+            json.load(f)['data_dir'], 'derived', 'text', TEXT_TERMS_FILE)
+    if not os.path.exists(terms_file):
+        pytest.skip('no precomputed text intervals')
+    with open(terms_file) as f:
+        term = next(iter(json.load(f)))
+
+    def get_results(client: FlaskClient) -> List[object]:
+        results = []
+        for query in [['text', term],
+                      ['and', [['text', term], ['name', 'wolf blitzer']]]]:
+            for detailed in TEST_DETAILED_OPTIONS:
+                response = client.get('/search?' + urlencode({
+                    'aggregate': 'day', 'detailed': detailed,
+                    'start_date': '2017-01-02', 'end_date': '2017-01-03',
+                    'query': json.dumps(['and', [
+                        ['channel', 'CNN'], ['show', 'The Situation Room'],
+                        query]])}))
+                _is_ok(response)
+                results.append(response.get_json())
+        return results
+
+    with _build_test_app(search_cache_bytes=0).test_client() as client:
+        derived_results = get_results(client)
+    monkeypatch.setattr(
+        route_search, 'get_derived_text_intervals', lambda *args: None)
+    with _build_test_app(search_cache_bytes=0).test_client() as client:
+        live_results = get_results(client)
+    assert derived_results == live_results
+
+
+def test_search_compound(client: FlaskClient) -> None:
+    """NORMALIZE, ADD and SUBTRACT can be computed by the server"""
+    def search(query: object) -> Dict[str, Any]:
+        params = {'aggregate': 'year', 'detailed': 'false'}
+        if query is not None:
+            params['query'] = json.dumps(query)
+        response = client.get('/search?' + urlencode(params))
+        _is_ok(response)
+        return response.get_json()
+
+    main_query = ['name', 'wolf blitzer']
+    main_totals = search(main_query)
+    date = next(iter(main_totals))
+    for operand, operand_query in [
+            ('add', ['name', 'rachel maddow']),
+            ('normalize', ['channel', 'CNN']),
+            ('subtract', ['tag', 'male']),
+            ('normalize', None)
+    ]:
+        response = client.get('/search?' + urlencode({
+            'aggregate': 'year', 'detailed': 'true',
+            'query': json.dumps(
+                {'main': main_query, operand: operand_query})}))
+        _is_ok(response)
+        result = response.get_json()
+        assert 'main' in result
+        if operand != 'add':
+            assert operand in result
+
+        operand_total = search(operand_query).get(date, 0)
+        if operand == 'add':
+            expected = main_totals[date] + operand_total
+        elif operand == 'subtract':
+            expected = main_totals[date] - operand_total
+        elif operand_total:
+            expected = main_totals[date] / operand_total
+        else:
+            # Dates without a normalization value are omitted
+            assert date not in result['values']
+            continue
+        assert abs(result['values'][date] - expected) < 1e-3 * max(
+            abs(expected), 1)
+    _is_bad(client.get('/search?' + urlencode({
+        'aggregate': 'year',
+        'query': json.dumps({'main': main_query, 'bad': main_query})})))
+
+
+def test_search_explain(client: FlaskClient) -> None:
+    """The plan puts the most selective children first"""
+    query = ['and', [['text', 'immigration'], ['name', 'wolf blitzer'],
+                     ['channel', 'CNN']]]
+    response = client.get('/search?' + urlencode({
+        'aggregate': 'year', 'query': json.dumps(query), 'explain': 'true'}))
+    _is_ok(response)
+    result = response.get_json()
+    plan = result['plan']
+    assert plan['query'] == query
+    costs = [p['estimated_cost'] for p in plan['plan']]
+    assert costs == sorted(costs)
+    assert len(plan['children']) == 2
+    assert all('time_ms' in c for c in plan['children'])
+    assert 'search' in result['time_ms']
+    assert result['num_videos'] >= 0
+
+
+def test_search_explain_mixed(client: FlaskClient) -> None:
+    """Text and face children are estimated as a fraction of the videos"""
+    def explain(query: List[object]) -> Dict[str, Any]:
+        response = client.get('/search?' + urlencode({
+            'aggregate': 'year', 'is_commercial': 'both',
+            'query': json.dumps(query), 'explain': 'true'}))
+        _is_ok(response)
+        return response.get_json()
+
+    text_query = ['text', 'immigration']
+    name_query = ['name', 'wolf blitzer']
+    tag_query = ['tag', 'male']
+    plan = explain(
+        ['and', [text_query, name_query, tag_query]])['plan']['plan']
+    costs = [p['estimated_cost'] for p in plan]
+    assert costs == sorted(costs)
+    assert all(0 <= c <= 1 for c in costs)
+    costs = {json.dumps(p['query']): p['estimated_cost'] for p in plan}
+    assert len(costs) == 3
+
+    # Faces are estimated by the fraction of the videos that they are in
+    assert abs(
+        costs[json.dumps(name_query)] / costs[json.dumps(tag_query)]
+        - explain(name_query)['num_videos']
+        / explain(tag_query)['num_videos']) < 1e-2
+
+
+def test_count_video_time_totals(client: FlaskClient) -> None:
+    """Simple results are the totals of the detailed results"""
+    for query in [['tag', 'male'],
+                  ['and', [['name', 'wolf blitzer'], ['channel', 'CNN']]]]:
+        results = {}
+        for detailed in TEST_DETAILED_OPTIONS:
+            response = client.get('/search?' + urlencode({
+                'aggregate': 'month', 'detailed': detailed,
+                'is_commercial': 'false', 'query': json.dumps(query)}))
+            _is_ok(response)
+            results[detailed] = response.get_json()
+        assert results['false'].keys() == results['true'].keys()
+        for k, v in results['true'].items():
+            assert abs(results['false'][k] - sum(x[1] for x in v)) < 1e-3
+
+
+def test_count_video_time_commercials(client: FlaskClient) -> None:
+    """Time in and out of commercials adds up to the total time"""
+    for query in [['tag', 'female'], ['facecount', '2'],
+                  ['and', [['name', 'wolf blitzer'], ['tag', 'presenter']]]]:
+        results = {}
+        for is_commercial in ['true', 'false', 'both']:
+            response = client.get('/search?' + urlencode({
+                'aggregate': 'year', 'detailed': 'false',
+                'is_commercial': is_commercial, 'query': json.dumps(query)}))
+            _is_ok(response)
+            results[is_commercial] = response.get_json()
+        for k, v in results['both'].items():
+            assert abs(results['true'].get(k, 0) + results['false'].get(k, 0)
+                       - v) < 1e-3 * v
+
+
+def test_search_restricted_text(client: FlaskClient) -> None:
+    """Common words are allowed when few videos are in scope"""
+    query = ['and', [['text', 'united states'], ['channel', 'CNN'],
+                     ['show', 'The Situation Room']]]
+    _is_ok(client.get('/search?' + urlencode({
+        'aggregate': 'day', 'start_date': '2017-01-02',
+        'end_date': '2017-01-03', 'query': json.dumps(query)})))
+
+
 # Search within a video tests
 
 
@@ -0,0 +1,101 @@
+"""
+Tests of the NumPy interval set algebra
+"""
+
+import random
+from typing import Set
+
+import numpy as np
+
+from app.interval_array import (
+    IntervalArray, empty_intervals, intervals_from_list, intervals_to_list,
+    intervals_duration, merge_intervals, union_intervals, intersect_intervals)
+
+
+def _points(intervals: IntervalArray) -> Set[int]:
+    """Milliseconds covered by the intervals"""
+    return {t for a, b in intervals.tolist() for t in range(a, b)}
+
+
+def _is_deoverlapped(intervals: IntervalArray) -> bool:
+    return bool(np.all(intervals[1:, 0] > intervals[:-1, 1]))
+
+
+def _random_intervals(n: int) -> IntervalArray:
+    intervals = []
+    for _ in range(n):
+        start = random.randint(0, 200)
+        intervals.append((start, start + random.randint(1, 50)))
+    return intervals_from_list(sorted(intervals))
+
+
+def test_conversions() -> None:
+    intervals = [(0, 1), (5, 10)]
+    assert intervals_to_list(intervals_from_list(intervals)) == intervals
+    assert intervals_from_list(iter(intervals)).shape == (2, 2)
+    assert intervals_from_list([]).shape == (0, 2)
+    assert intervals_to_list(empty_intervals()) == []
+
+
+def test_duration() -> None:
+    assert intervals_duration(intervals_from_list([(0, 10), (20, 25)])) == 15
+    assert intervals_duration(empty_intervals()) == 0
+
+
+def test_merge() -> None:
+    intervals = intervals_from_list([(0, 10), (5, 7), (10, 12), (20, 30)])
+    assert intervals_to_list(merge_intervals(intervals)) == [
+        (0, 12), (20, 30)]
+    assert intervals_to_list(merge_intervals(intervals, 8)) == [(0, 30)]
+    assert len(merge_intervals(empty_intervals())) == 0
+
+
+def test_union() -> None:
+    a = intervals_from_list([(0, 10), (50, 60)])
+    b = intervals_from_list([(5, 20), (100, 110)])
+    assert intervals_to_list(union_intervals(a, b)) == [
+        (0, 20), (50, 60), (100, 110)]
+    assert intervals_to_list(union_intervals(a, b, 30)) == [
+        (0, 60), (100, 110)]
+    assert intervals_to_list(union_intervals(a, empty_intervals())) == \
+        intervals_to_list(a)
+
+
+def test_intersect() -> None:
+    a = intervals_from_list([(0, 10), (20, 30), (40, 50)])
+    b = intervals_from_list([(5, 25), (30, 40), (45, 60)])
+    assert intervals_to_list(intersect_intervals(a, b)) == [
+        (5, 10), (20, 25), (45, 50)]
+    assert len(intersect_intervals(a, empty_intervals())) == 0
+    assert len(intersect_intervals(empty_intervals(), b)) == 0
+
+
+def test_intersect_long_interval() -> None:
+    """A long interval overlaps every interval that starts after it"""
+    a = intervals_from_list([(0, 100)])
+    b = intervals_from_list([(10, 20), (30, 40), (90, 110)])
+    expected = [(10, 20), (30, 40), (90, 100)]
+    assert intervals_to_list(intersect_intervals(a, b)) == expected
+    assert intervals_to_list(intersect_intervals(b, a)) == expected
+
+    # Inputs may overlap themselves (e.g., the postings of a text search)
+    a = intervals_from_list([(0, 100), (10, 20), (50, 60)])
+    b = intervals_from_list([(15, 55), (58, 70)])
+    assert intervals_to_list(intersect_intervals(a, b)) == [
+        (15, 55), (58, 70)]
+
+
+def test_random() -> None:
+    """Same results as operations on the points that are covered"""
+    random.seed(0)
+    for _ in range(200):
+        a = _random_intervals(random.randint(0, 10))
+        b = _random_intervals(random.randint(0, 10))
+        for result, expected in [
+                (merge_intervals(a), _points(a)),
+                (union_intervals(a, b), _points(a) | _points(b)),
+                (intersect_intervals(a, b), _points(a) & _points(b))
+        ]:
+            assert _is_deoverlapped(result)
+            assert _points(result) == expected
+            assert intervals_duration(result) == len(expected)
@@ -0,0 +1,106 @@
+"""
+Tests of the intervals of many videos that are combined in python
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.route_search import (
+    PythonISetData, and_python_isets, or_python_isets)
+
+
+U32_MAX = 0xFFFFFFFF
+
+
+def _to_dict(data: PythonISetData) -> Dict[int, Optional[List[List[int]]]]:
+    """Intervals of each video (None if it is entire)"""
+    assert np.all(np.diff(data.video_ids) > 0)
+    assert len(data.offsets) == len(data) + 1
+    return {
+        video_id: None if data.is_entire_video[i]
+        else data.get_intervals(i).tolist()
+        for i, video_id in enumerate(data.video_ids.tolist())
+    }
+
+
+def test_from_lists() -> None:
+    """Videos are sorted by id, and their intervals are kept as they are"""
+    data = PythonISetData.from_lists(
+        [3, 1, 2], [[(5, 6), (0, 1)], [(1, 2)], []])
+    assert _to_dict(data) == {1: [[1, 2]], 2: [], 3: [[5, 6], [0, 1]]}
+    assert _to_dict(PythonISetData.from_lists([], [])) == {}
+
+
+def test_from_videos() -> None:
+    data = PythonISetData.from_videos(np.array([1, 4], dtype=np.int64))
+    assert _to_dict(data) == {1: None, 4: None}
+    assert len(data.intervals) == 0
+
+
+def test_and() -> None:
+    d1 = PythonISetData.from_lists([1, 2, 4], [[(0, 10)], [(0, 10)], [(5, 6)]])
+    d2 = PythonISetData.from_lists([2, 3, 4], [[(5, 20)], [(0, 1)], [(0, 5)]])
+    assert _to_dict(and_python_isets(d1, d2)) == {2: [[5, 10]]}
+
+
+def test_and_entire_videos() -> None:
+    """An entire video keeps the intervals of the other set"""
+    d1 = PythonISetData.concat([
+        PythonISetData.from_videos(np.array([1, 3], dtype=np.int64)),
+        PythonISetData.from_lists([2], [[(0, 10)]])])
+    d2 = PythonISetData.concat([
+        PythonISetData.from_videos(np.array([3], dtype=np.int64)),
+        PythonISetData.from_lists([1, 2], [[(5, 6)], [(20, 30)]])])
+    assert _to_dict(and_python_isets(d1, d2)) == {1: [[5, 6]], 3: None}
+    assert _to_dict(and_python_isets(d2, d1)) == {1: [[5, 6]], 3: None}
+
+
+def test_or() -> None:
+    """Intervals at most 100ms apart are merged"""
+    d1 = PythonISetData.from_lists([1, 2], [[(0, 10)], [(0, 10)]])
+    d2 = PythonISetData.from_lists(
+        [2, 3], [[(50, 60), (500, 600)], [(0, 1)]])
+    assert _to_dict(or_python_isets(d1, d2)) == {
+        1: [[0, 10]], 2: [[0, 60], [500, 600]], 3: [[0, 1]]}
+
+
+def test_or_entire_videos() -> None:
+    d1 = PythonISetData.concat([
+        PythonISetData.from_videos(np.array([1], dtype=np.int64)),
+        PythonISetData.from_lists([2], [[(0, 10)]])])
+    d2 = PythonISetData.concat([
+        PythonISetData.from_videos(np.array([2], dtype=np.int64)),
+        PythonISetData.from_lists([1, 3], [[(5, 6)], [(0, 1)]])])
+    assert _to_dict(or_python_isets(d1, d2)) == {1: None, 2: None, 3: [[0, 1]]}
+    assert _to_dict(or_python_isets(d2, d1)) == {1: None, 2: None, 3: [[0, 1]]}
+
+
+def test_empty() -> None:
+    empty = PythonISetData.from_lists([], [])
+    d = PythonISetData.concat([
+        PythonISetData.from_videos(np.array([1], dtype=np.int64)),
+        PythonISetData.from_lists([2], [[(0, 10)]])])
+    for d1, d2 in [(empty, empty), (empty, d), (d, empty)]:
+        assert _to_dict(and_python_isets(d1, d2)) == {}
+    assert _to_dict(or_python_isets(empty, empty)) == {}
+    assert _to_dict(or_python_isets(empty, d)) == _to_dict(d)
+    assert _to_dict(or_python_isets(d, empty)) == _to_dict(d)
+    assert _to_dict(PythonISetData.concat([empty, d, empty])) == _to_dict(d)
+
+
+def test_video_boundaries() -> None:
+    """Intervals at the ends of videos are not joined with the next video"""
+    d1 = PythonISetData.from_lists(
+        [1, 2], [[(U32_MAX - 10, U32_MAX)], [(0, 10)]])
+    d2 = PythonISetData.from_lists(
+        [1, 2], [[(U32_MAX - 5, U32_MAX)], [(0, 5)]])
+    assert _to_dict(or_python_isets(d1, d2)) == {
+        1: [[U32_MAX - 10, U32_MAX]], 2: [[0, 10]]}
+    assert _to_dict(and_python_isets(d1, d2)) == {
+        1: [[U32_MAX - 5, U32_MAX]], 2: [[0, 5]]}
+
+    data = PythonISetData.from_lists(
+        [0, 1, 2], [[(0, U32_MAX)], [(0, 1)], [(U32_MAX - 1, U32_MAX)]])
+    assert _to_dict(PythonISetData.from_global_intervals(
+        data.to_global_intervals())) == _to_dict(data)
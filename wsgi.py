@@ -3,9 +3,26 @@ WSGI entry point
 
 Example use:
     pip3 install uwsgi
-    uwsgi --socket 0.0.0.0:80 --protocol=http -w wsgi:app -p 8
+    uwsgi --socket 0.0.0.0:80 --protocol=http -w wsgi:app -p 8 --enable-threads
+
+The app is loaded once before the workers are forked (i.e., without
+--lazy-apps), so that they share its memory. The unique memory of each
+worker is reported by /memory.
+
+derive_data.py touches data/.reload when the data has changed. The uwsgi
+master can reload the workers when it is touched, in one of two ways:
+
+    --touch-reload data/.reload
+        Reload the whole server. The app is still loaded once and shared,
+        but requests wait while it loads.
+
+    --lazy-apps --touch-chain-reload data/.reload
+        Reload the workers one at a time, while the others keep serving.
+        Each worker loads its own copy of the app, so memory is not shared,
+        but at most one extra copy is loaded during a reload.
 """
 
+import gc
 import json
 from datetime import datetime
 from pytz import timezone
@@ -14,6 +31,9 @@ from app.types_frontend import Ternary
 
 CONFIG_FILE = 'config.json'
 
+# Collections while loading would leave holes in the shared pages
+gc.disable()
+
 DEFAULT_MIN_DATE = [2010, 1, 1]
 DEFAULT_MAX_DATE = [2030, 1, 1]
 
@@ -32,6 +52,9 @@ DEFAULT_TEXT_WINDOW = 0
 
 DEFAULT_ALLOW_SHARING = True
 
+DEFAULT_SEARCH_CACHE_BYTES = 256 * 1024 * 1024
+DEFAULT_SEARCH_PARALLELISM = 4
+
 with open(CONFIG_FILE) as f:
     config = json.load(f)
 
@@ -66,6 +89,15 @@ app = build_app(
         'default_is_commercial', DEFAULT_IS_COMMERCIAL),
     allow_sharing=options.get('allow_sharing', DEFAULT_ALLOW_SHARING),
     data_version=config.get('data_version'),
-    show_uptime=config.get('show_uptime', False))
+    show_uptime=config.get('show_uptime', False),
+    search_cache_bytes=options.get(
+        'search_cache_bytes', DEFAULT_SEARCH_CACHE_BYTES),
+    search_parallelism=options.get(
+        'search_parallelism', DEFAULT_SEARCH_PARALLELISM))
 del config
 del options
+
+# Exclude the loaded objects from future collections, which would otherwise
+# write to (and copy) their pages in every forked worker
+gc.freeze()
+gc.enable()